@@ -69,26 +69,39 @@ ReleaseVersion.set_active(ReleaseVersion.version7_0)
 
 #%%        ##############  Antenna Function definitions  ############## 
 
+def GeometrySuffix(thickness=0, matchingLEs=False, x=0, y=0):
+    # geometry parameters besides type and length that differ from the defaults, appended to the
+    # entity, group and simulation names so differently built antennas never share a name
+    suffix = ""
+    if thickness:
+        suffix += " thickness " + str(thickness)
+    if matchingLEs:
+        suffix += " matched"
+    if x or y:
+        suffix += " at " + str(x) + " " + str(y)
+    return suffix
+
 def MakePlainDipool(length, width = 10, x=0, y=0, gapwidth=2, thickness=0, matchingLEs=False):
+	suffix = GeometrySuffix(thickness, matchingLEs, x, y)
 	hl = length/2.0
 	hgw = gapwidth/2.0
 	hw = width/2.0
 	arm1 = mod.CreateSolidBlock(v3(x,y-hw,-hgw),v3(x+thickness,y+hw,-hl))
 	arm2 = mod.CreateSolidBlock(v3(x,y-hw,hgw),v3(x+thickness,y+hw,hl))
 	copper = mod.Unite([arm1, arm2], 1)
-	copper.Name = "Conductor "+ str(length)+ " plain"
+	copper.Name = "Conductor "+ str(length)+ " plain" + suffix
 	if matchingLEs:
 		source = mod.CreatePolyLine([v3(x,y,0),v3(x,y,hgw)])
-		source.Name = "source "+ str(length)+ " plain"
+		source.Name = "source "+ str(length)+ " plain" + suffix
 		sLE = mod.CreatePolyLine([v3(x,y,-hgw),v3(x,y,0)])
-		sLE.Name = "seriesLE "+ str(length)+ " plain"
+		sLE.Name = "seriesLE "+ str(length)+ " plain" + suffix
 		pLE = mod.CreatePolyLine([v3(x,y-hw/2,-hgw),v3(x,y-hw/2,hgw)])
-		pLE.Name = "parallelLE "+ str(length)+ " plain"
+		pLE.Name = "parallelLE "+ str(length)+ " plain" + suffix
 	else:
 		source = mod.CreatePolyLine([v3(x,y,-hgw),v3(x,y,hgw)])
-		source.Name = "source "+ str(length)+ " plain"
+		source.Name = "source "+ str(length)+ " plain" + suffix
 	
-	antennagroup = mod.CreateGroup("Plain Dipole "+ str(length)+"mm")
+	antennagroup = mod.CreateGroup("Plain Dipole "+ str(length)+"mm" + suffix)
 	for elem in [copper, source]:
 		antennagroup.Add(elem)
 	if matchingLEs:
@@ -98,23 +111,24 @@ def MakePlainDipool(length, width = 10, x=0, y=0, gapwidth=2, thickness=0, match
 	return antennagroup
 
 def MakeLumpedDipool(length, width=10, x=0, y=0, gapwidth=2, thickness=0, matchingLEs=False):
+    suffix = GeometrySuffix(thickness, matchingLEs, x, y)
     hl = length / 2.0
     hgw = gapwidth / 2.0
     hw = width / 2.0
     arm1 = mod.CreateSolidBlock(v3(x, y - hw, -hgw), v3(x + thickness, y + hw, -hl))
     arm2 = mod.CreateSolidBlock(v3(x, y - hw, hgw), v3(x + thickness, y + hw, hl))
     copper = mod.Unite([arm1, arm2], 1)
-    copper.Name = "Conductor " + str(length) + " lumped"
+    copper.Name = "Conductor " + str(length) + " lumped" + suffix
     if matchingLEs:
         source = mod.CreatePolyLine([v3(x, y, 0), v3(x, y, hgw)])
-        source.Name = "source " + str(length) + " lumped"
+        source.Name = "source " + str(length) + " lumped" + suffix
         sLE = mod.CreatePolyLine([v3(x, y, -hgw), v3(x, y, 0)])
-        sLE.Name = "seriesLE " + str(length) + " lumped"
+        sLE.Name = "seriesLE " + str(length) + " lumped" + suffix
         pLE = mod.CreatePolyLine([v3(x, y - hw / 2, -hgw), v3(x, y - hw / 2, hgw)])
-        pLE.Name = "parallelLE " + str(length) + " lumped"
+        pLE.Name = "parallelLE " + str(length) + " lumped" + suffix
     else:
         source = mod.CreatePolyLine([v3(x, y, -hgw), v3(x, y, hgw)])
-        source.Name = "source " + str(length) + " lumped"
+        source.Name = "source " + str(length) + " lumped" + suffix
 
     counts = 1
     caps = []
@@ -124,11 +138,11 @@ def MakeLumpedDipool(length, width=10, x=0, y=0, gapwidth=2, thickness=0, matchi
         copper = mod.Subtract([copper, subtractblok])
 
         cap = mod.CreatePolyLine([v3(x, y, z - 2), v3(x, y, z + 2)])
-        cap.Name = "capacitor " + str(counts) + " " + str(length)
+        cap.Name = "capacitor " + str(counts) + " " + str(length) + suffix
         counts = counts + 1
         caps.append(cap)
 
-    antennagroup = mod.CreateGroup("Lumped Dipole " + str(length) + "mm")
+    antennagroup = mod.CreateGroup("Lumped Dipole " + str(length) + "mm" + suffix)
 
     for elem in [copper, source]:
         antennagroup.Add(elem)
@@ -136,25 +150,29 @@ def MakeLumpedDipool(length, width=10, x=0, y=0, gapwidth=2, thickness=0, matchi
     if matchingLEs:
         for elem in [pLE, sLE]:
             antennagroup.Add(elem)
+
+    return antennagroup
+
 def MakeFractionatedDipool(length, width=10, x=0, y=0, gapwidth=2, thickness=0, matchingLEs=False):
+    suffix = GeometrySuffix(thickness, matchingLEs, x, y)
     hl = length / 2.0
     hgw = gapwidth / 2.0
     hw = width / 2.0
     arm1 = mod.CreateSolidBlock(v3(x, y - hw, -hgw), v3(x + thickness, y + hw, -hl))
     arm2 = mod.CreateSolidBlock(v3(x, y - hw, hgw), v3(x + thickness, y + hw, hl))
     copper = mod.Unite([arm1, arm2], 1)
-    copper.Name = "Conductor " + str(length) + " fractionated"
+    copper.Name = "Conductor " + str(length) + " fractionated" + suffix
 
     if matchingLEs:
         source = mod.CreatePolyLine([v3(x, y, 0), v3(x, y, hgw)])
-        source.Name = "source " + str(length) + " fractionated"
+        source.Name = "source " + str(length) + " fractionated" + suffix
         sLE = mod.CreatePolyLine([v3(x, y, -hgw), v3(x, y, 0)])
-        sLE.Name = "seriesLE " + str(length) + " fractionated"
+        sLE.Name = "seriesLE " + str(length) + " fractionated" + suffix
         pLE = mod.CreatePolyLine([v3(x, y - hw / 2, -hgw), v3(x, y - hw / 2, hgw)])
-        pLE.Name = "parallelLE " + str(length) + " fractionated"
+        pLE.Name = "parallelLE " + str(length) + " fractionated" + suffix
     else:
         source = mod.CreatePolyLine([v3(x, y, -hgw), v3(x, y, hgw)])
-        source.Name = "source " + str(length) + " fractionated"
+        source.Name = "source " + str(length) + " fractionated" + suffix
 
     for z in hl * np.array([-2. / 3, -1. / 3, 1. / 3, 2. / 3]):
     # for z in hl * np.array([-3. / 4,-2./4, -1. / 4, 1. / 4, 2. / 4,3./4]):        
@@ -173,7 +191,7 @@ def MakeFractionatedDipool(length, width=10, x=0, y=0, gapwidth=2, thickness=0,
         pieces.append(mod.Intersect([halfcircle2, stukkie2]))
         copper = mod.Unite([copper] + pieces)
 
-    antennagroup = mod.CreateGroup("Fractionated Dipole " + str(length) + "mm")
+    antennagroup = mod.CreateGroup("Fractionated Dipole " + str(length) + "mm" + suffix)
     for elem in [copper, source]:
         antennagroup.Add(elem)
     if matchingLEs:
@@ -184,8 +202,16 @@ def MakeFractionatedDipool(length, width=10, x=0, y=0, gapwidth=2, thickness=0,
 
 #%%      ##############  Model and simulation building functions  ############## 
 
+# Names of the antenna groups created by the Make...Dipool functions, followed by the length in mm and GeometrySuffix
+DIPOLE_GROUP_NAMES = {"Plain": "Plain Dipole ", "fractionated": "Fractionated Dipole ", "lumped": "Lumped Dipole "}
+
 def MakeModel(L,x=0, y=0, dipoletype='plain', thickness=0, matchingLEs=False):
     
+	# Reuse an antenna that was already built, instead of creating a duplicate
+	group_name = DIPOLE_GROUP_NAMES.get(dipoletype, "") + str(L) + "mm" + GeometrySuffix(thickness, matchingLEs, x, y)
+	if dipoletype in DIPOLE_GROUP_NAMES and group_name in mod.AllEntities():
+		return mod.AllEntities()[group_name]
+
 	if not "phantom" in mod.AllEntities():
 		phantom = mod.CreateSolidBlock(v3(-520,-250,-250), v3(-20,250,250))
 		phantom.Name = "phantom"
@@ -207,7 +233,7 @@ def MakeModel(L,x=0, y=0, dipoletype='plain', thickness=0, matchingLEs=False):
 
 
 
-def MakeSIM_Multi(L,dipoletype = "plain", value = None,freq=298):
+def SimulationName(L, dipoletype = "plain", value = None, freq=298, thickness=0, matchingLEs=False, x=0, y=0):
     
     #B0 definitions are mostly used for simulation naming and are frequency dependent
     if freq ==298:
@@ -218,37 +244,48 @@ def MakeSIM_Multi(L,dipoletype = "plain", value = None,freq=298):
         B0 = " 14T phosphorus"    
     else: 
         raise Exception("Undifined frequency. Values should be given in MHz. ")
+    geometry = GeometrySuffix(thickness, matchingLEs, x, y)
+
+    if dipoletype == "Plain":
+        return "Plain Dipole "+ str(L)+" mm"+ geometry + B0 + " block"
+    elif dipoletype == "fractionated":
+        return "Fractionated Dipole "+ str(L) +" mm"+ geometry + B0 + "head"
+    elif dipoletype == "lumped":
+        return "Lumped Dipole "+ str(L)+" mm"+ geometry +" "+ str(value)+ B0 + " head"
+    else: 
+        raise Exception("Undifined antenna type. Please check spelling or modifiy simulation function")        
 
+
+def MakeSIM_Multi(L,dipoletype = "plain", value = None,freq=298, name=None,
+                  phantom_grid_max_step=5.0, phantom_grid_resolution=10.0,
+                  antenna_grid_max_step=1.0, antenna_grid_resolution=0.05,
+                  thickness=0, matchingLEs=False, x=0, y=0):
+    
     # Creating the simulation
     simulation = emfdtd.MultiportSimulation()
+    simulation.Name = SimulationName(L, dipoletype, value, freq, thickness, matchingLEs, x, y) if name is None else name
+    suffix = GeometrySuffix(thickness, matchingLEs, x, y)
  
 
     if dipoletype == "Plain":
-        simulation.Name = "Plain Dipole "+ str(L)+" mm"+ B0 + " block"
-        
-        entity_source = mod.AllEntities()["source "+str(L)+ " plain"]  
+        entity_source = mod.AllEntities()["source "+str(L)+ " plain" + suffix]  
         entity_phantom = mod.AllEntities()["phantom"]
-        entity__conductor = mod.AllEntities()["Conductor "+str(L)+ " plain"]  
+        entity__conductor = mod.AllEntities()["Conductor "+str(L)+ " plain" + suffix]  
     
     elif dipoletype == "fractionated":
-        
-        simulation.Name = "Fractionated Dipole "+ str(L) +" mm"+ B0 + "head"
-        
-        entity_source = mod.AllEntities()["source "+str(L)+ " fractionated"]  
+        entity_source = mod.AllEntities()["source "+str(L)+ " fractionated" + suffix]  
         entity_phantom = mod.AllEntities()["phantom"]
-        entity__conductor = mod.AllEntities()["Conductor "+str(L)+ " fractionated"]  
+        entity__conductor = mod.AllEntities()["Conductor "+str(L)+ " fractionated" + suffix]  
         
     elif dipoletype == "lumped":
-        simulation.Name = "Lumped Dipole "+ str(L)+" mm"+" "+ str(value)+ B0 + " head"
-        
-        entity_source = mod.AllEntities()["source "+str(L)+ " lumped"]  
+        entity_source = mod.AllEntities()["source "+str(L)+ " lumped" + suffix]  
         entity_phantom = mod.AllEntities()["phantom"]
-        entity__conductor = mod.AllEntities()["Conductor "+str(L)+ " lumped"]  
+        entity__conductor = mod.AllEntities()["Conductor "+str(L)+ " lumped" + suffix]  
     
-        entity_capacitor1 = mod.AllEntities()["capacitor 1 "+str(L)]  
-        entity_capacitor2 = mod.AllEntities()["capacitor 2 "+str(L)] 
-        entity_capacitor3 = mod.AllEntities()["capacitor 3 "+str(L)] 
-        entity_capacitor4 = mod.AllEntities()["capacitor 4 "+str(L)]
+        entity_capacitor1 = mod.AllEntities()["capacitor 1 "+str(L) + suffix]  
+        entity_capacitor2 = mod.AllEntities()["capacitor 2 "+str(L) + suffix] 
+        entity_capacitor3 = mod.AllEntities()["capacitor 3 "+str(L) + suffix] 
+        entity_capacitor4 = mod.AllEntities()["capacitor 4 "+str(L) + suffix]
         
     else: 
         raise Exception("Undifined antenna type. Please check spelling or modifiy simulation function")        
@@ -336,8 +373,8 @@ def MakeSIM_Multi(L,dipoletype = "plain", value = None,freq=298):
     # Adding a new ManualGridSettings
     manual_grid_settings = simulation.AddManualGridSettings([entity_phantom])
     manual_grid_settings.Name = "phantom_grid"
-    manual_grid_settings.MaxStep = numpy.array([5.0, 5.0, 5.0]), units.MilliMeters
-    manual_grid_settings.Resolution = numpy.array([10.0, 10.0, 10.0]), units.MilliMeters
+    manual_grid_settings.MaxStep = numpy.array([phantom_grid_max_step] * 3), units.MilliMeters
+    manual_grid_settings.Resolution = numpy.array([phantom_grid_resolution] * 3), units.MilliMeters
     
     # Adding a new ManualGridSettings
     if dipoletype == "Plain" or dipoletype =="fractionated" or dipoletype == "meander" :
@@ -349,8 +386,8 @@ def MakeSIM_Multi(L,dipoletype = "plain", value = None,freq=298):
         raise Exception("Undifined antenna type in gridsettings. Please check spelling or modifiy simulation function")    
         
     manual_grid_settings.Name = "antenna_grid"
-    manual_grid_settings.MaxStep = numpy.array([1, 1, 1]), units.MilliMeters
-    manual_grid_settings.Resolution = numpy.array([0.05, 0.05, 0.05]), units.MilliMeters
+    manual_grid_settings.MaxStep = numpy.array([antenna_grid_max_step] * 3), units.MilliMeters
+    manual_grid_settings.Resolution = numpy.array([antenna_grid_resolution] * 3), units.MilliMeters
     
     # Editing AutomaticVoxelerSettings "Automatic Voxeler Settings
     automatic_voxeler_settings = [x for x in simulation.AllSettings if isinstance(x, emfdtd.AutomaticVoxelerSettings) and x.Name == "Automatic Voxeler Settings"][0]
@@ -378,6 +415,8 @@ def MakeSIM_Multi(L,dipoletype = "plain", value = None,freq=298):
     # Add the simulation to the UI
     doc.AllSimulations.Add( simulation )
 
+    return simulation
+
 
 #%%  ##############  Antenna experiments ############## 
 
@@ -427,15 +466,17 @@ def Run_experiments(case):
         for freq in freq_list:
             for value in value_list:
                 
-                MakeSIM_Multi(L=L,dipoletype=dipoletype, value = value,freq=freq)
+                MakeSIM_Multi(L=L,dipoletype=dipoletype, value = value,freq=freq, thickness=thickness, matchingLEs=matchingLEs)
 
 
 #%%  ##############  Create the chosen experiments  ############## 
 # for i in range(3):
 #     	Run_experiments(i)
 
-import XCoreModeling as xcm
-xcm.GetActiveModel().Clear()                
-Run_experiments(2)
+# if-statement to only build the experiments when this file is run directly
+if __name__ == "__main__":
+    import XCoreModeling as xcm
+    xcm.GetActiveModel().Clear()
+    Run_experiments(2)
 
-print("done")
\ No newline at end of file
+    print("done")
@@ -1,16 +1,37 @@
 import simulate
+import result_cache
 import imp
 
 # force module updates
-CUSTOM_MODULES = [simulate]
+CUSTOM_MODULES = [simulate, result_cache]
 for module in CUSTOM_MODULES:
     imp.reload(module)
 
 # extraction paramters
 SIMULATION_NAME = "Fractionated Dipole Array simulation at 298MHz"
 NORMALIZED_POWER = 8.0  # power in watts to be divided over antennas
+USE_CACHE = True  # store the exports in the result cache registered by simulation_controls.py
+BATCH_EXPORT = False  # export all ports into a single HDF5 container instead of one .mat file per port
 
 # if-statement to only perform extraction when this file is run directly
 if __name__ == "__main__":
-    simulate.extract_multiport(simulation_name=SIMULATION_NAME, normalized_power=NORMALIZED_POWER)
-    simulate.extract_singleports(simulation_name=SIMULATION_NAME, relative_path="EXPORTS")
+    cache = simulate.open_result_cache() if USE_CACHE else None
+    if cache is not None and cache.restored(SIMULATION_NAME):
+        # multiport_sim restored the exports from the cache, no simulation was created to extract
+        print(f"Results of {SIMULATION_NAME} were restored from the cache, nothing to extract")
+    else:
+        simulate.extract_multiport(simulation_name=SIMULATION_NAME, normalized_power=NORMALIZED_POWER)
+        # a failed S-parameter extraction must not stop the B1 export
+        extra_files = []
+        try:
+            simulate.export_s_matrix(simulation_name=SIMULATION_NAME, relative_path="EXPORTS")
+            extra_files.append(simulate.export_path("EXPORTS") + "\\" + simulate.S_MATRIX_FILE)
+        except Exception as error:
+            print(f"S-matrix export failed, exporting the B1 fields without it: {error}")
+
+        if BATCH_EXPORT:
+            simulate.export_singleports(simulation_name=SIMULATION_NAME, relative_path="EXPORTS", cache=cache,
+                                        extra_files=extra_files)
+        else:
+            simulate.extract_singleports(simulation_name=SIMULATION_NAME, relative_path="EXPORTS", cache=cache,
+                                         extra_files=extra_files)
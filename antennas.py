@@ -4,6 +4,8 @@ from s4l_v1 import Rotation, Translation
 
 import numpy as np
 
+import utils
+
 
 class FractionatedDipole:
 
@@ -37,11 +39,13 @@ class FractionatedDipole:
             self.sLE = None
             self.pLE = None
 
+        # all cut-outs and meander pieces are combined in a single Subtract and a single Unite, the
+        # segments are far enough apart that this equals subtracting and uniting per segment
+        subtractbloks = []
+        pieces = []
         # for z in hl * np.array([-3. / 4,-2./4, -1. / 4, 1. / 4, 2. / 4,3./4]):
         for z in hl * np.array([-2. / 3, -1. / 3, 1. / 3, 2. / 3]):
-            subtractblok = model.CreateSolidBlock(Vec3(x - 1, y - hw, z - 6), Vec3(x + 1, y + hw, z + 6))
-            self.copper = model.Subtract([self.copper, subtractblok])
-            pieces = []
+            subtractbloks.append(model.CreateSolidBlock(Vec3(x - 1, y - hw, z - 6), Vec3(x + 1, y + hw, z + 6)))
             pieces.append(model.CreateSolidBlock(Vec3(x, y + hw, z + 10), Vec3(x + thickness, y + hw + 6, z + 6)))
             pieces.append(model.CreateSolidBlock(Vec3(x, y - hw, z - 6), Vec3(x + thickness, y - hw - 6, z - 10)))
             pieces.append(model.CreateSolidBlock(Vec3(x, y - hw - 6, z + 2), Vec3(x + thickness, y + hw + 6, z - 2)))
@@ -51,7 +55,9 @@ class FractionatedDipole:
             halfcircle2 = model.CreateSolidTube(Vec3(x - 1, y - hw - 6, z - 4), Vec3(2, 0, 0), 6, 2)
             stukkie2 = model.CreateSolidBlock(Vec3(x, y - hw - 6, z - 10), Vec3(x + thickness, y - hw - 12, z + 2))
             pieces.append(model.Intersect([halfcircle2, stukkie2]))
-            self.copper = model.Unite([self.copper] + pieces)
+        self.copper = model.Subtract([self.copper] + subtractbloks)
+        self.copper = model.Unite([self.copper] + pieces)
+        self.copper.Name = "Conductor"
 
         for elem in [self.copper, self.source]:
             self.element_group.Add(elem)
@@ -59,6 +65,35 @@ class FractionatedDipole:
             for elem in [self.pLE, self.sLE]:
                 self.element_group.Add(elem)
 
+    def clone(self, name=None):
+        """
+        Copy of this antenna made by cloning its entities, without repeating the Boolean operations.
+        """
+        antenna = self.__class__.__new__(self.__class__)
+        antenna.name = self.name if name is None else name
+        antenna.element_group = model.CreateGroup(antenna.name)
+        antenna.x = self.x
+        antenna.y = self.y
+        antenna.angle = self.angle
+
+        antenna.copper = self.copper.Clone()
+        antenna.copper.Name = self.copper.Name
+        antenna.source = self.source.Clone()
+        antenna.source.Name = self.source.Name
+        antenna.sLE = None
+        antenna.pLE = None
+        for elem in [antenna.copper, antenna.source]:
+            antenna.element_group.Add(elem)
+
+        if self.sLE is not None:
+            antenna.sLE = self.sLE.Clone()
+            antenna.sLE.Name = self.sLE.Name
+            antenna.pLE = self.pLE.Clone()
+            antenna.pLE.Name = self.pLE.Name
+            for elem in [antenna.pLE, antenna.sLE]:
+                antenna.element_group.Add(elem)
+        return antenna
+
     def set_name(self, new_name):
         self.name = new_name
         self.element_group.Name = new_name
@@ -91,12 +126,18 @@ class ElipseArray:
         #     [np.array((array_width/2*np.cos(t), array_height/2*np.sin(t))) for t in self.alt_angles]
         #     )
 
-        for i, coord in enumerate(self.coords_2D):
-            antenna = antenna_class(**antenna_parameters)
-            antenna.set_name(f"{antenna.name} {i+1}")
+        # build a single element and clone it for the others, before any of them is transformed
+        template = antenna_class(**antenna_parameters)
+        base_name = template.name
+        for i in range(n_antennas):
+            antenna = template if i == 0 else template.clone()
+            antenna.set_name(f"{base_name} {i+1}")
             self.antenna_list.append(antenna)
             self.antenna_group.Add(antenna.element_group)
 
+        for i, coord in enumerate(self.coords_2D):
+            antenna = self.antenna_list[i]
+
             # move antenna to the correct position and orientation
             rotation = Rotation(2, self.angles[i])
             translation = Translation(Vec3(coord[0], coord[1], 0))
@@ -105,6 +146,7 @@ class ElipseArray:
             antenna.x, antenna.y = coord[0], coord[1]
             antenna.angle = self.angles[i]
 
+        utils.ENTITY_INDEX.invalidate()
         print(f"Created: Elipse array with {n_antennas} '{antenna_class.__name__}' elements")
 
     def add_spacers(self, height: int) -> None:
@@ -115,12 +157,17 @@ class ElipseArray:
 
         length = self.antenna_parameters["length"]
         width = self.antenna_parameters["width"] + 30
-        for i, coord in enumerate(self.coords_2D):
-            spacer = Spacer(length, width, height)
-            spacer.set_name(f"{spacer.name} {i+1}")
+        template = Spacer(length, width, height)
+        base_name = template.name
+        for i in range(len(self.coords_2D)):
+            spacer = template if i == 0 else template.clone()
+            spacer.set_name(f"{base_name} {i+1}")
             self.spacer_list.append(spacer)
             self.spacer_group.Add(spacer.block)
 
+        for i, coord in enumerate(self.coords_2D):
+            spacer = self.spacer_list[i]
+
             # move spacer to the position and orientation of antennas
             rotation = Rotation(2, self.spacer_angles[i])
             translation = Translation(Vec3(coord[0], coord[1], 0))
@@ -129,6 +176,7 @@ class ElipseArray:
             spacer.x, spacer.y = coord[0], coord[1]
             spacer.angle = self.spacer_angles[i]
 
+        utils.ENTITY_INDEX.invalidate()
         print(f' - Added spacers to "{self.name}"')
 
     def add_bounding_box(self):
@@ -136,6 +184,7 @@ class ElipseArray:
                                          Vec3(self.width/2, self.height/2, self.length/2)
                                          )
         self.box.Name = "Bounding Box"
+        utils.ENTITY_INDEX.invalidate()
 
     def set_name(self, new_name) -> None:
         self.name = new_name
@@ -159,6 +208,19 @@ class Spacer:
         self.block.ApplyTransform(rotation)
         self.block.ApplyTransform(translation)
 
+    def clone(self, name=None):
+        spacer = self.__class__.__new__(self.__class__)
+        spacer.length = self.length
+        spacer.width = self.width
+        spacer.height = self.height
+        spacer.x = self.x
+        spacer.y = self.y
+        spacer.angle = self.angle
+        spacer.block = self.block.Clone()
+        spacer.name = self.name if name is None else name
+        spacer.block.Name = spacer.name
+        return spacer
+
     def set_name(self, new_name):
         self.name = new_name
         self.block.Name = new_name
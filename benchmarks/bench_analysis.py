@@ -0,0 +1,203 @@
+"""
+Analysis chain benchmark on synthetic per-port B1+ fields.
+
+Writes a field store with 8 synthetic channels on a Duke-scale grid, NaN outside an elliptic
+cylinder of tissue, and times the stages of the analysis chain on it: loading the masked field,
+combining the channels, the homogeneity metrics, the CoV gradient, a full phase optimisation, a
+slab sweep and rendering a slice gallery. Per stage it reports the fastest wall time and the peak
+traced memory. Results can be written to JSON and compared against a baseline file, in which case
+the exit code is 1 if any stage got slower than the tolerance allows.
+
+Usage: python benchmarks/bench_analysis.py [--shape 208 120 450] [--output results.json]
+                                           [--baseline baseline.json] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import field_store  # noqa: E402
+import metrics  # noqa: E402
+import shimming  # noqa: E402
+import slab_sweep  # noqa: E402
+from masked_field import MaskedField  # noqa: E402
+from slice_renderer import SliceRenderer  # noqa: E402
+
+
+N_CHANNELS = 8
+DUKE_SHAPE = (208, 120, 450)  # voxels of the Duke export grid
+GRID_EXTENT = (0.52, 0.30, 1.80)  # metres
+TISSUE_RADII = (0.17, 0.11)  # elliptic cylinder of tissue in the XY plane, metres
+ARRAY_RADII = (0.20, 0.14)  # dipole positions, metres
+WAVELENGTH = 0.12  # in tissue at 298 MHz, metres
+CHUNK_SLICES = 16
+SWEEP_STEP = 10
+GALLERY_SLICES = 50
+TOLERANCE = 0.2  # allowed relative slowdown against the baseline
+
+
+def make_store(store_path: str, shape: tuple = DUKE_SHAPE, n_channels: int = N_CHANNELS, seed: int = 0):
+    """
+    Writes a field store of synthetic channels, each a damped spherical wave from a point on an
+    ellipse around the tissue, generated a chunk of z-slices at a time.
+    """
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+    rng = np.random.default_rng(seed)
+    axes = [np.linspace(-extent / 2, extent / 2, n) for extent, n in zip(GRID_EXTENT, shape)]
+    angles = np.linspace(0, 2 * np.pi, n_channels, endpoint=False)
+    sources = np.stack([ARRAY_RADII[0] * np.cos(angles), ARRAY_RADII[1] * np.sin(angles),
+                        rng.normal(0, 0.01, n_channels)], axis=1)
+    source_phases = rng.uniform(0, 2 * np.pi, n_channels)
+
+    fields = np.lib.format.open_memmap(os.path.join(store_path, field_store.FIELDS_FILE), mode="w+",
+                                       dtype=np.complex64, shape=(n_channels,) + tuple(shape), fortran_order=True)
+    x, y = np.meshgrid(axes[0], axes[1], indexing="ij")
+    outside = (x / TISSUE_RADII[0])**2 + (y / TISSUE_RADII[1])**2 > 1
+    for start in range(0, shape[2], CHUNK_SLICES):
+        z = axes[2][start:start + CHUNK_SLICES]
+        for c in range(n_channels):
+            distance = np.sqrt((x[..., None] - sources[c, 0])**2 + (y[..., None] - sources[c, 1])**2
+                               + (z - sources[c, 2])**2)
+            chunk = np.exp(1j * (source_phases[c] - 2 * np.pi * distance / WAVELENGTH)) / (distance + 0.02)
+            chunk[outside] = np.nan
+            chunk[..., np.abs(z) > 0.45 * GRID_EXTENT[2]] = np.nan
+            fields[c, :, :, start:start + len(z)] = chunk
+    fields.flush()
+    del fields
+    np.savez(os.path.join(store_path, field_store.AXES_FILE), x=axes[0], y=axes[1], z=axes[2],
+             files=np.array([f"synthetic_{c}" for c in range(n_channels)]))
+    return field_store.FieldStore(store_path)
+
+
+def case_load(context: dict):
+    return MaskedField.from_store(context["store"])
+
+
+def case_combine(context: dict):
+    return context["fields"].combine(shimming.START_PHASES)
+
+
+def case_metric(context: dict):
+    return metrics.field_metrics(context["fields"], shimming.START_PHASES)
+
+
+def case_gradient(context: dict):
+    return shimming.cov_and_gradient(shimming.START_PHASES, context["slab"])
+
+
+def case_optimise(context: dict):
+    return shimming.optimise_phases(context["slab"], shimming.START_PHASES)
+
+
+def case_slab_sweep(context: dict):
+    return slab_sweep.sweep_slabs(context["fields"], step=SWEEP_STEP)
+
+
+def case_render(context: dict):
+    renderer = SliceRenderer(context["store"])
+    for index in np.linspace(0, context["store"].shape[2] - 1, GALLERY_SLICES).astype(int):
+        renderer.axis_plane(shimming.START_PHASES, 2, index)
+
+
+CASES = {"load": case_load,
+         "combine": case_combine,
+         "metric": case_metric,
+         "gradient": case_gradient,
+         "optimise": case_optimise,
+         "slab_sweep": case_slab_sweep,
+         "render": case_render}
+
+
+def run_case(case, context: dict, repeat: int) -> dict:
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case(context)
+        wall_times.append(time.perf_counter() - start)
+
+    # separate run for the memory, tracing slows down the allocations
+    tracemalloc.start()
+    case(context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"wall_time": min(wall_times), "peak_memory": peak}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """
+    :return: names of the stages that are more than tolerance slower than in the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["wall_time"] / baseline[name]["wall_time"]
+        print(f"{name}: {ratio:.2f}x baseline")
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--shape", type=int, nargs=3, default=DUKE_SHAPE, help="grid shape of the synthetic fields")
+    parser.add_argument("--store", help="directory of the synthetic store, kept afterwards and reused if it exists")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative slowdown")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per case, the fastest is reported")
+    parser.add_argument("cases", nargs="*", default=list(CASES), help="cases to run, all by default")
+    arguments = parser.parse_args()
+
+    store_path = arguments.store or tempfile.mkdtemp(prefix="bench_analysis_")
+    try:
+        if arguments.store and os.path.exists(os.path.join(store_path, field_store.FIELDS_FILE)):
+            store = field_store.FieldStore(store_path)
+        else:
+            start = time.perf_counter()
+            store = make_store(store_path, tuple(arguments.shape))
+            print(f"Generated {store.shape} x {store.n_channels} fields in {time.perf_counter() - start:.1f} s")
+
+        fields = MaskedField.from_store(store)
+        center_slice = int(np.median(fields.grid_coordinates()[2]))
+        context = {"store": store,
+                   "fields": fields,
+                   "slab": fields.slab(center_slice - shimming.HALF_WIDTH, center_slice + shimming.HALF_WIDTH + 1)}
+        print(f"{fields.n_voxels} tissue voxels, {context['slab'].n_voxels} in the shim slab")
+
+        results = {"shape": list(store.shape), "n_voxels": fields.n_voxels, "stages": {}}
+        for name in arguments.cases:
+            result = run_case(CASES[name], context, arguments.repeat)
+            results["stages"][name] = result
+            print(f"{name}: {result['wall_time'] * 1000:.1f} ms, peak {result['peak_memory'] / 1024**2:.1f} MiB")
+    finally:
+        if not arguments.store:
+            shutil.rmtree(store_path, ignore_errors=True)
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("shape") != results["shape"]:
+            print(f"Baseline grid {baseline.get('shape')} differs from {results['shape']}")
+        regressions = compare(results["stages"], baseline["stages"], arguments.tolerance)
+        if regressions:
+            print("Slower than baseline: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
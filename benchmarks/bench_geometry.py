@@ -0,0 +1,128 @@
+"""
+Model construction benchmark against the headless Sim4Life stand-in in benchmarks/standin.
+
+Builds the ElipseArray of setup_controls_duke.py, runs simulate.multiport_sim on it and runs the
+Model_builder.Run_experiments cases, reporting per case the wall time and the count and time of
+every recorded Sim4Life operation. Results can be written to JSON to compare between commits.
+
+Usage: python benchmarks/bench_geometry.py [--output results.json] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "standin"))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from s4l_recorder import RECORDER  # noqa: E402
+from s4l_v1 import document, model  # noqa: E402
+import antennas  # noqa: E402
+import simulate  # noqa: E402
+import utils  # noqa: E402
+import Model_builder  # noqa: E402
+
+
+# mirrors setup_controls_duke.py and simulation_controls.py
+N_DIPOLES = 8
+DIPOLE_SETTINGS = {"length": 350,
+                   "width": 10,
+                   "gapwidth": 2,
+                   "thickness": 0,
+                   "matchingLEs": False}
+ARRAY_WIDTH = 170
+ARRAY_HEIGHT = 260
+SPACER_THICKNESS = 10
+PADDING = 200 * 0.95
+GRID_SETTINGS = {"antenna_grid_max_step": 1.0,
+                 "antenna_grid_resolution": 0.05,
+                 "phantom_grid_max_step": 3.0,
+                 "phantom_grid_resolution": 10.0
+                 }
+
+
+def reset() -> None:
+    model.ACTIVE_MODEL.clear()
+    document.AllSimulations.clear()
+    document.AllAlgorithms.clear()
+    utils.ENTITY_INDEX.invalidate()
+    RECORDER.reset()
+
+
+def build_array():
+    array = antennas.ElipseArray(name="Fractionated Dipole Array", n_antennas=N_DIPOLES,
+                                 antenna_parameters=DIPOLE_SETTINGS, antenna_class=antennas.FractionatedDipole,
+                                 array_width=ARRAY_WIDTH, array_height=ARRAY_HEIGHT)
+    array.add_spacers(SPACER_THICKNESS)
+    array.add_bounding_box()
+    return array
+
+
+def case_elipse_array() -> None:
+    build_array()
+
+
+def case_clear_and_rebuild() -> None:
+    build_array()
+    utils.clear_from_model(["Fractionated Dipole Array", "Spacer Group", "Bounding Box"])
+    build_array()
+
+
+def case_multiport_sim() -> None:
+    array = build_array()
+    RECORDER.reset()
+    simulate.multiport_sim(array=array, top_padding=PADDING, bottom_padding=PADDING, cuda_kernel=True,
+                           bounding_box="Bounding Box", **GRID_SETTINGS)
+
+
+def run_experiment(case: int):
+    def run() -> None:
+        Model_builder.Run_experiments(case)
+    return run
+
+
+CASES = {"elipse_array": case_elipse_array,
+         "clear_and_rebuild": case_clear_and_rebuild,
+         "multiport_sim": case_multiport_sim,
+         "run_experiments_plain": run_experiment(0),
+         "run_experiments_lumped": run_experiment(1),
+         "run_experiments_fractionated": run_experiment(2)}
+
+
+def run_case(case, repeat: int) -> dict:
+    wall_times = []
+    for _ in range(repeat):
+        reset()
+        start = time.perf_counter()
+        case()
+        wall_times.append(time.perf_counter() - start)
+    return {"wall_time": min(wall_times),
+            "operations": RECORDER.snapshot(),
+            "entities": len(model.ACTIVE_MODEL.entities)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per case, the fastest is reported")
+    parser.add_argument("cases", nargs="*", default=list(CASES), help="cases to run, all by default")
+    arguments = parser.parse_args()
+
+    results = {}
+    for name in arguments.cases:
+        results[name] = run_case(CASES[name], arguments.repeat)
+        operations = results[name]["operations"]
+        print(f"{name}: {results[name]['wall_time'] * 1000:.1f} ms, "
+              f"{sum(op['count'] for op in operations.values())} operations")
+        for operation, stats in operations.items():
+            print(f"    {operation:40s} {stats['count']:6d} {stats['time'] * 1000:9.3f} ms")
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Stand-in for XCoreModeling, sharing the active model of the s4l_v1.model stand-in.
+"""
+from s4l_v1 import model
+from s4l_recorder import recorded
+
+
+class _Model:
+    @recorded("GetEntities")
+    def GetEntities(self) -> list:
+        # top-level entities only, like the real active model
+        return [entity for entity in model.ACTIVE_MODEL.entities if entity.parent is None]
+
+    @recorded("Clear")
+    def Clear(self) -> None:
+        model.ACTIVE_MODEL.clear()
+
+
+@recorded("GetActiveModel")
+def GetActiveModel() -> _Model:
+    return _Model()
@@ -0,0 +1,97 @@
+"""
+Operation recorder shared by the headless Sim4Life stand-in modules.
+
+Every stand-in API call is counted and timed under its Sim4Life name, e.g. "CreateSolidBlock",
+"Unite", "ApplyTransform", "AllEntities" or "settings", so model construction can be measured
+without a licence.
+"""
+from collections import defaultdict
+import functools
+import time
+
+
+class Recorder:
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = defaultdict(int)
+        self.times = defaultdict(float)
+
+    def record(self, name: str, seconds: float = 0.0) -> None:
+        self.counts[name] += 1
+        self.times[name] += seconds
+
+    def snapshot(self) -> dict:
+        return {name: {"count": self.counts[name], "time": self.times[name]} for name in sorted(self.counts)}
+
+
+RECORDER = Recorder()
+
+
+def recorded(name: str):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                RECORDER.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class SettingsNode:
+    """
+    Settings object that accepts any attribute chain, assignment or call, recording each
+    assignment and call as a "settings" operation.
+    """
+    def __init__(self, path: str = ""):
+        object.__setattr__(self, "_path", path or type(self).__name__)
+        object.__setattr__(self, "_values", {})
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        values = object.__getattribute__(self, "_values")
+        if name not in values:
+            values[name] = SettingsNode(f"{self._path}.{name}")
+        return values[name]
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+            return
+        start = time.perf_counter()
+        self._values[name] = value
+        RECORDER.record("settings", time.perf_counter() - start)
+
+    def __call__(self, *args, **kwargs):
+        RECORDER.record("settings")
+        return SettingsNode(f"{self._path}()")
+
+    def __iter__(self):
+        return iter([])
+
+    def __repr__(self):
+        return f"<{self._path}>"
+
+
+class Namespace:
+    """
+    Module-like object whose every attribute is a recording settings class, used for the
+    analysis extractors, filters, exporters and viewers.
+    """
+    def __init__(self, path: str):
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        path = f"{self._path}.{name}"
+
+        def factory(*args, **kwargs):
+            RECORDER.record("settings")
+            return SettingsNode(path)
+        return factory
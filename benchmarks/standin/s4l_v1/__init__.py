@@ -0,0 +1,59 @@
+"""
+Headless stand-in for the parts of the Sim4Life s4l_v1 API used by this repository.
+"""
+import numpy as np
+
+
+class Unit(str):
+    pass
+
+
+class Transform:
+    def __init__(self, matrix=None):
+        self.matrix = np.eye(4) if matrix is None else np.asarray(matrix, dtype=float)
+
+    def __mul__(self, other: "Transform") -> "Transform":
+        return Transform(self.matrix @ other.matrix)
+
+    def Inverse(self) -> "Transform":
+        return Transform(np.linalg.inv(self.matrix))
+
+    @property
+    def Scaling(self):
+        from s4l_v1.model import Vec3
+        return Vec3(*np.linalg.norm(self.matrix[:3, :3], axis=0))
+
+    @property
+    def Translation(self):
+        from s4l_v1.model import Vec3
+        return Vec3(*self.matrix[:3, 3])
+
+
+def Translation(vector) -> Transform:
+    matrix = np.eye(4)
+    matrix[:3, 3] = list(vector)
+    return Transform(matrix)
+
+
+def Rotation(axis: int, angle: float) -> Transform:
+    matrix = np.eye(4)
+    i, j = [k for k in range(3) if k != axis]
+    matrix[i, i], matrix[i, j] = np.cos(angle), -np.sin(angle)
+    matrix[j, i], matrix[j, j] = np.sin(angle), np.cos(angle)
+    return Transform(matrix)
+
+
+def Scaling(vector, origin=None) -> Transform:
+    matrix = np.diag(list(vector) + [1.0])
+    if origin is None:
+        return Transform(matrix)
+    return Translation(origin) * Transform(matrix) * Translation([-c for c in origin])
+
+
+class ReleaseVersion:
+    version7_0 = "7.0"
+    active = None
+
+    @classmethod
+    def set_active(cls, version) -> None:
+        cls.active = version
@@ -0,0 +1,7 @@
+from s4l_recorder import Namespace
+
+
+extractors = Namespace("analysis.extractors")
+core = Namespace("analysis.core")
+exporters = Namespace("analysis.exporters")
+viewers = Namespace("analysis.viewers")
@@ -0,0 +1,30 @@
+from s4l_recorder import recorded
+
+
+class Collection:
+    def __init__(self):
+        self._items = []
+
+    @recorded("document.Add")
+    def Add(self, item) -> None:
+        self._items.append(item)
+
+    def __getitem__(self, name):
+        for item in self._items:
+            if item.Name == name:
+                return item
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+AllSimulations = Collection()
+AllAlgorithms = Collection()
+FilePath = "C:\\standin\\project.smash"
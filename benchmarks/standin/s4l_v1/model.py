@@ -0,0 +1,167 @@
+"""
+Stand-in for s4l_v1.model: entities only keep their name, transform and children, Boolean
+operations consume their inputs and return a new entity, and every call is recorded.
+"""
+import copy
+
+from s4l_v1 import Transform
+from s4l_recorder import RECORDER, recorded
+
+
+class Vec3:
+    def __init__(self, x, y=None, z=None):
+        if y is None and z is None:
+            y = z = x
+        self._values = (float(x), float(y), float(z))
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return 3
+
+    def __repr__(self):
+        return "Vec3(%g, %g, %g)" % self._values
+
+
+class Entity:
+    def __init__(self, name: str = "", kind: str = "Entity"):
+        self.Name = name
+        self.kind = kind
+        self.ReadOnly = False
+        self.Transform = Transform()
+        self.children = []
+        self.parent = None
+        ACTIVE_MODEL.entities.append(self)
+
+    @recorded("ApplyTransform")
+    def ApplyTransform(self, transform: Transform) -> None:
+        self._apply(transform)
+
+    def _apply(self, transform: Transform) -> None:
+        self.Transform = transform * self.Transform
+        for child in self.children:
+            child._apply(transform)
+
+    @recorded("Clone")
+    def Clone(self) -> "Entity":
+        clone = Entity(self.Name, self.kind)
+        clone.Transform = copy.deepcopy(self.Transform)
+        clone.ReadOnly = self.ReadOnly
+        return clone
+
+    @recorded("Delete")
+    def Delete(self) -> None:
+        for child in list(self.children):
+            child.Delete()
+        ACTIVE_MODEL.remove(self)
+
+    @recorded("Add")
+    def Add(self, entity: "Entity") -> None:
+        if entity.parent is not None:
+            entity.parent.children.remove(entity)
+        entity.parent = self
+        self.children.append(entity)
+
+    def __repr__(self):
+        return f"<{self.kind} '{self.Name}'>"
+
+
+class EntityList:
+    def __init__(self, entities: list):
+        self._entities = entities
+
+    def __getitem__(self, name):
+        RECORDER.record("AllEntities[]")
+        if isinstance(name, int):
+            return self._entities[name]
+        for entity in self._entities:
+            if entity.Name == name:
+                return entity
+        raise KeyError(name)
+
+    def __contains__(self, name) -> bool:
+        RECORDER.record("AllEntities[]")
+        return any(entity.Name == name for entity in self._entities)
+
+    def __iter__(self):
+        return iter(list(self._entities))
+
+    def __len__(self):
+        return len(self._entities)
+
+
+class ActiveModel:
+    def __init__(self):
+        self.entities = []
+
+    def remove(self, entity: Entity) -> None:
+        if entity in self.entities:
+            self.entities.remove(entity)
+        if entity.parent is not None and entity in entity.parent.children:
+            entity.parent.children.remove(entity)
+
+    def clear(self) -> None:
+        self.entities.clear()
+
+
+ACTIVE_MODEL = ActiveModel()
+
+
+@recorded("AllEntities")
+def AllEntities() -> EntityList:
+    return EntityList(ACTIVE_MODEL.entities)
+
+
+@recorded("CreateGroup")
+def CreateGroup(name: str = "") -> Entity:
+    return Entity(name, "EntityGroup")
+
+
+@recorded("EntityGroup")
+def EntityGroup() -> Entity:
+    return Entity("", "EntityGroup")
+
+
+@recorded("CreateSolidBlock")
+def CreateSolidBlock(p1: Vec3, p2: Vec3) -> Entity:
+    return Entity("Block", "SolidBlock")
+
+
+@recorded("CreateWireBlock")
+def CreateWireBlock(p1: Vec3, p2: Vec3) -> Entity:
+    return Entity("Block", "WireBlock")
+
+
+@recorded("CreateSolidTube")
+def CreateSolidTube(base: Vec3, direction: Vec3, outer_radius: float, inner_radius: float) -> Entity:
+    return Entity("Tube", "SolidTube")
+
+
+@recorded("CreatePolyLine")
+def CreatePolyLine(points: list) -> Entity:
+    return Entity("PolyLine", "PolyLine")
+
+
+def _boolean(entities: list, kind: str) -> Entity:
+    for entity in entities:
+        ACTIVE_MODEL.remove(entity)
+    return Entity(entities[0].Name, kind)
+
+
+@recorded("Unite")
+def Unite(entities: list, *args) -> Entity:
+    return _boolean(entities, "Body")
+
+
+@recorded("Subtract")
+def Subtract(entities: list, *args) -> Entity:
+    return _boolean(entities, "Body")
+
+
+@recorded("Intersect")
+def Intersect(entities: list, *args) -> Entity:
+    return _boolean(entities, "Body")
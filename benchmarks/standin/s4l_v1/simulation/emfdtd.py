@@ -0,0 +1,84 @@
+"""
+Stand-in for s4l_v1.simulation.emfdtd: settings accept anything and record every assignment,
+simulations record every Add, grid and material update.
+"""
+from s4l_recorder import SettingsNode, recorded
+
+
+class MaterialSettings(SettingsNode):
+    pass
+
+
+class EdgePortSettings(SettingsNode):
+    pass
+
+
+class EdgeSensorSettings(SettingsNode):
+    pass
+
+
+class LumpedElementSettings(SettingsNode):
+    pass
+
+
+class ManualGridSettings(SettingsNode):
+    pass
+
+
+class AutomaticGridSettings(SettingsNode):
+    pass
+
+
+class AutomaticVoxelerSettings(SettingsNode):
+    pass
+
+
+class OverallFieldSensorSettings(SettingsNode):
+    pass
+
+
+class MultiportSimulation(SettingsNode):
+    def __init__(self):
+        super().__init__()
+        automatic_grid_settings = AutomaticGridSettings()
+        automatic_grid_settings._values["Name"] = "Automatic"
+        automatic_voxeler_settings = AutomaticVoxelerSettings()
+        automatic_voxeler_settings._values["Name"] = "Automatic Voxeler Settings"
+        self._all_settings = [automatic_grid_settings, automatic_voxeler_settings]
+        self._components = {}
+
+    @property
+    def AllSettings(self) -> list:
+        return list(self._all_settings)
+
+    @recorded("Simulation.Add")
+    def Add(self, settings, components=None) -> None:
+        if settings not in self._all_settings:
+            self._all_settings.append(settings)
+        if components is not None:
+            components = components if isinstance(components, list) else [components]
+            self._components.setdefault(id(settings), []).extend(components)
+
+    @recorded("Simulation.RemoveSettings")
+    def RemoveSettings(self, settings) -> None:
+        self._all_settings.remove(settings)
+
+    @recorded("Simulation.AddManualGridSettings")
+    def AddManualGridSettings(self, components: list) -> ManualGridSettings:
+        settings = ManualGridSettings()
+        self.Add(settings, components)
+        return settings
+
+    @recorded("Simulation.AddOverallFieldSensorSettings")
+    def AddOverallFieldSensorSettings(self) -> OverallFieldSensorSettings:
+        settings = OverallFieldSensorSettings()
+        self._all_settings.append(settings)
+        return settings
+
+    @recorded("Simulation.UpdateAllMaterials")
+    def UpdateAllMaterials(self) -> None:
+        pass
+
+    @recorded("Simulation.UpdateGrid")
+    def UpdateGrid(self) -> None:
+        pass
@@ -0,0 +1,5 @@
+Periods = "Periods"
+MilliMeters = "MilliMeters"
+Hz = "Hz"
+Farads = "Farads"
+Henrys = "Henrys"
@@ -0,0 +1,133 @@
+"""
+Voxel-count independent homogeneity metrics of |B1+|^2 for phase shimming.
+
+For a (voxels x channels) field matrix A and channel weights w the power in every voxel is a
+quadratic form |a_v w|^2 = w^H (a_v^* a_v^T) w. Averaging over the ROI once gives the channel
+covariance matrix R (mean power) and the fourth-order moment tensor T (mean squared power), after
+which every metric of the power distribution costs O(channels^2) or O(channels^4) per evaluation.
+"""
+import numpy as np
+
+from shimming import field_matrix, phase_weights
+
+
+CHUNK_SIZE = 65536  # voxels per block while accumulating the moments
+
+
+def moment_sums(fields, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """
+    Unnormalised second and fourth order channel moments of a set of voxels.
+
+    Sums of disjoint voxel sets add up, so slab moments can be assembled from per-slice sums.
+
+    :return: tuple of the (channels x channels) and (channels^2 x channels^2) sums.
+    """
+    fields = field_matrix(fields)
+    n_channels = fields.shape[1]
+    covariance_sum = np.zeros((n_channels, n_channels), dtype=np.complex128)
+    fourth_moment_sum = np.zeros((n_channels**2, n_channels**2), dtype=np.complex128)
+    for start in range(0, len(fields), chunk_size):
+        chunk = fields[start:start + chunk_size].astype(np.complex128, copy=False)
+        covariance_sum += np.conj(chunk).T @ chunk
+        # outer products conj(a_i) a_j per voxel, flattened to i * channels + j
+        products = (np.conj(chunk)[:, :, None] * chunk[:, None, :]).reshape(len(chunk), -1)
+        fourth_moment_sum += products.T @ products
+    return covariance_sum, fourth_moment_sum
+
+
+class ChannelMoments:
+    def __init__(self, fields, chunk_size: int = CHUNK_SIZE):
+        """
+        Accumulates the second and fourth order channel moments of an ROI.
+
+        :param fields: (voxels x channels) complex field matrix or masked_field.MaskedField of the ROI.
+        :param chunk_size: number of voxels processed at once, bounds the temporary memory.
+        """
+        fields = field_matrix(fields)
+        covariance_sum, fourth_moment_sum = moment_sums(fields, chunk_size)
+        self._set_moments(covariance_sum, fourth_moment_sum, fields.shape[0])
+
+    @classmethod
+    def from_sums(cls, covariance_sum: np.ndarray, fourth_moment_sum: np.ndarray, n_voxels: int):
+        moments = cls.__new__(cls)
+        moments._set_moments(covariance_sum, fourth_moment_sum, n_voxels)
+        return moments
+
+    def _set_moments(self, covariance_sum: np.ndarray, fourth_moment_sum: np.ndarray, n_voxels: int) -> None:
+        self.n_voxels = n_voxels
+        self.n_channels = covariance_sum.shape[0]
+        self.covariance = covariance_sum / n_voxels
+        self.fourth_moment = fourth_moment_sum / n_voxels
+
+    def weighted_covariance(self, weights: np.ndarray) -> np.ndarray:
+        # mean of conj(a_i) a_j |B1+|^2 over the ROI, w^H H w is the mean squared power
+        products = np.outer(np.conj(weights), weights).ravel()
+        return (self.fourth_moment @ products).reshape(self.n_channels, self.n_channels)
+
+    def mean_power(self, phases) -> float:
+        weights = phase_weights(phases)
+        return np.real(np.conj(weights) @ self.covariance @ weights)
+
+    def mean_squared_power(self, phases) -> float:
+        weights = phase_weights(phases)
+        return np.real(np.conj(weights) @ self.weighted_covariance(weights) @ weights)
+
+    def power_mse(self, phases) -> float:
+        # mse of |B1+|^2 against its own mean, i.e. the population variance of the power
+        return self.mean_squared_power(phases) - self.mean_power(phases)**2
+
+    def power_norm_mse(self, phases) -> float:
+        return self.power_mse(phases) / self.mean_power(phases)**2
+
+    def power_cov(self, phases) -> float:
+        return np.sqrt(max(self.power_mse(phases), 0)) / self.mean_power(phases)
+
+    def batch_power_cov(self, phase_population) -> np.ndarray:
+        """
+        Power CoV for a (K x channels) population of phase vectors.
+        """
+        weights = phase_weights(phase_population).T
+        mean_power = np.real(np.sum(np.conj(weights) * (self.covariance @ weights), axis=0))
+        products = (np.conj(weights)[:, None, :] * weights[None, :, :]).reshape(self.n_channels**2, -1)
+        mean_squared_power = np.real(np.sum(products * (self.fourth_moment @ products), axis=0))
+        return np.sqrt(np.maximum(mean_squared_power - mean_power**2, 0)) / mean_power
+
+
+def _power_moments_and_gradients(phases, moments: ChannelMoments):
+    weights = phase_weights(phases)
+    covariance_weights = moments.covariance @ weights
+    weighted_weights = moments.weighted_covariance(weights) @ weights
+
+    mean_power = np.real(np.conj(weights) @ covariance_weights)
+    mean_squared_power = np.real(np.conj(weights) @ weighted_weights)
+
+    # derivatives of the quadratic forms with respect to the phases in degrees
+    d_mean_power = 2 * np.imag(np.conj(weights) * covariance_weights) * np.pi / 180
+    d_mean_squared_power = 4 * np.imag(np.conj(weights) * weighted_weights) * np.pi / 180
+    return mean_power, mean_squared_power, d_mean_power, d_mean_squared_power
+
+
+def power_cov_and_gradient(phases, moments: ChannelMoments):
+    """
+    CoV of |B1+|^2 and its gradient, with the same signature as shimming.cov_and_gradient.
+    """
+    mean_power, mean_squared_power, d_mean_power, d_mean_squared_power = \
+        _power_moments_and_gradients(phases, moments)
+    variance = max(mean_squared_power - mean_power**2, 1e-300)
+    std = np.sqrt(variance)
+
+    d_variance = d_mean_squared_power - 2 * mean_power * d_mean_power
+    gradient = d_variance / (2 * std * mean_power) - std * d_mean_power / mean_power**2
+    return std / mean_power, gradient
+
+
+def power_norm_mse_and_gradient(phases, moments: ChannelMoments):
+    """
+    normMSE of |B1+|^2 and its gradient, with the same signature as shimming.cov_and_gradient.
+    """
+    mean_power, mean_squared_power, d_mean_power, d_mean_squared_power = \
+        _power_moments_and_gradients(phases, moments)
+    # normMSE = mean((1 - p / mean)^2) = mean(p^2) / mean^2 - 1
+    score = mean_squared_power / mean_power**2 - 1
+    gradient = d_mean_squared_power / mean_power**2 - 2 * mean_squared_power * d_mean_power / mean_power**3
+    return score, gradient
@@ -0,0 +1,154 @@
+"""
+Out-of-core CoV objective for shimming ROIs that do not fit in memory.
+
+ChunkedFields evaluates the CoV of |B1+| and its phase gradient chunk by chunk from a field store
+or a memory-mapped (voxels x channels) matrix. The gradient of the CoV is
+
+    c = alpha * sum(conj(B1+) a) + beta * sum(conj(B1+) / |B1+| a)
+
+with a the channel fields of a voxel and alpha, beta depending only on the global mean and
+standard deviation, so every chunk contributes independent partial sums (voxel count, mean,
+squared deviations and the two sums above) that are reduced afterwards. The chunks are evaluated
+on a thread pool and each worker holds one chunk at a time, so the peak memory does not depend on
+the size of the ROI.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from shimming import accumulate_product, match_precision, phase_weights
+
+
+CHUNK_SIZE = 262144  # voxels per chunk of a matrix
+CHUNK_SLICES = 8  # z-slices per chunk of a field store
+
+
+class ChunkedFields:
+    def __init__(self, read_chunk, chunks: list, n_channels: int, max_workers: int = None):
+        """
+        :param read_chunk: function chunk -> (voxels x channels) array without NaN voxels.
+        :param chunks: descriptions of the chunks passed to read_chunk.
+        :param max_workers: threads evaluating chunks concurrently, as for ThreadPoolExecutor.
+        """
+        self.read_chunk = read_chunk
+        self.chunks = chunks
+        self.n_channels = n_channels
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    @classmethod
+    def from_matrix(cls, fields, chunk_size: int = CHUNK_SIZE, **kwargs):
+        """
+        Chunks of a (voxels x channels) matrix, e.g. np.load(file, mmap_mode="r").
+        """
+        def read_chunk(chunk):
+            block = np.asarray(fields[chunk])
+            return block[~np.isnan(block).any(axis=1)]
+
+        chunks = [slice(start, start + chunk_size) for start in range(0, fields.shape[0], chunk_size)]
+        return cls(read_chunk, chunks, fields.shape[1], **kwargs)
+
+    @classmethod
+    def from_store(cls, store, roi=None, z_start: int = 0, z_stop: int = None,
+                   chunk_slices: int = CHUNK_SLICES, **kwargs):
+        """
+        Chunks of z-slices of a field_store.FieldStore, optionally restricted to a roi.ROI.
+        """
+        n_x, n_y, n_z = store.shape
+        indices = None
+        if roi is not None:
+            indices = roi.indices(store.axes)
+            z_start, z_stop = roi.z_range(store.axes)
+        z_stop = n_z if z_stop is None else z_stop
+
+        def read_chunk(chunk):
+            start, stop = chunk
+            block = np.asarray(store.slab(start, stop)).reshape(store.n_channels, -1, order="F").T
+            if indices is not None:
+                offset = n_x * n_y * start
+                local = indices[np.searchsorted(indices, offset):np.searchsorted(indices, n_x * n_y * stop)]
+                block = block[local - offset]
+            return block[~np.isnan(block).any(axis=1)]
+
+        chunks = [(start, min(start + chunk_slices, z_stop)) for start in range(z_start, z_stop, chunk_slices)]
+        return cls(read_chunk, chunks, store.n_channels, **kwargs)
+
+    def _partial_sums(self, chunk, weights: np.ndarray) -> tuple:
+        fields = self.read_chunk(chunk)
+        if fields.shape[0] == 0:
+            return 0, 0.0, 0.0, 0, 0
+        b1_plus = fields @ match_precision(weights, fields)
+        magnitude = np.abs(b1_plus)
+        mean = float(magnitude.mean(dtype=np.float64))
+        deviation = magnitude - mean
+        conj_b1_plus = np.conj(b1_plus)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            unit = np.where(magnitude > 0, conj_b1_plus / magnitude, 0)
+        return (magnitude.size, mean, np.sum(np.square(deviation), dtype=np.float64),
+                accumulate_product(conj_b1_plus, fields), accumulate_product(unit, fields))
+
+    def moments(self, weights) -> tuple:
+        """
+        :return: tuple of the voxel count, mean |B1+|, sum of squared deviations from the mean and
+            the gradient sums sum(conj(B1+) a) and sum(conj(B1+) / |B1+| a).
+        """
+        weights = np.asarray(weights, dtype=np.complex128)
+        count, mean, m2 = 0, 0.0, 0.0
+        linear_sum = np.zeros(self.n_channels, dtype=np.complex128)
+        unit_sum = np.zeros(self.n_channels, dtype=np.complex128)
+        for n, chunk_mean, chunk_m2, chunk_linear, chunk_unit in self.pool.map(
+                lambda chunk: self._partial_sums(chunk, weights), self.chunks):
+            if n == 0:
+                continue
+            total = count + n
+            delta = chunk_mean - mean
+            m2 += chunk_m2 + delta**2 * count * n / total
+            mean += delta * n / total
+            count = total
+            linear_sum += chunk_linear
+            unit_sum += chunk_unit
+        return count, mean, m2, linear_sum, unit_sum
+
+    def cov_and_gradient(self, phases) -> tuple:
+        """
+        CoV of |B1+| and its gradient with respect to the phases in degrees, as shimming.cov_and_gradient.
+        """
+        weights = phase_weights(phases)
+        n, mean, m2, linear_sum, unit_sum = self.moments(weights)
+        std = np.sqrt(m2 / (n - 1))
+        alpha = 1 / ((n - 1) * std * mean)
+        beta = -alpha * mean - std / (mean**2 * n)
+        d_weights = alpha * linear_sum + beta * unit_sum
+        return std / mean, -np.imag(weights * d_weights) * np.pi / 180
+
+    def mean_strength(self, phases) -> float:
+        return self.moments(phase_weights(phases))[1]
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def chunked_cov_and_gradient(phases, fields: ChunkedFields) -> tuple:
+    # objective for shimming.optimise_phases
+    return fields.cov_and_gradient(phases)
+
+
+# if-statement to only perform optimisation when this file is run directly
+if __name__ == "__main__":
+    import field_store
+    import shimming
+
+    STORE_PATH = "FIELD_STORE"
+
+    store = field_store.open_store(shimming.FILES, STORE_PATH)
+    with ChunkedFields.from_store(store) as fields:
+        optimised_phases, optimised_cov = shimming.optimise_phases(fields, shimming.START_PHASES,
+                                                                   objective=chunked_cov_and_gradient)
+        print("FULL VOLUME")
+        print("Phases: " + " ".join(f"{p:f}" for p in shimming.wrap_phases(optimised_phases)))
+        print(f"COV: {optimised_cov:f}")
+        print(f"Mean (Tesla): {fields.mean_strength(optimised_phases):e}")
@@ -0,0 +1,147 @@
+"""
+Forward, reflected and accepted power of arbitrary shims from the port S-matrix.
+
+The exports are normalised to 1 W conducted power per port, so shimming treats |w_i|^2 as the
+power of port i and ignores the mismatch and coupling between the antennas. With the S-matrix of
+simulate.export_s_matrix the weights are the waves incident on the ports in sqrt(W): the forward
+power is |w|^2, the reflected power |S w|^2 and the accepted power w^H (I - S^H S) w. The fields
+are rescaled to a unit incident wave per port once, after which the power balance and B1+
+efficiency of thousands of shims follow from batched products, without the Sim4Life combiner.
+"""
+import numpy as np
+
+from masked_field import MaskedField
+from robustness import batch_cov_and_strength
+from shimming import START_PHASES, field_matrix, match_precision, phase_weights
+
+
+S_MATRIX_FILE = "s_matrix.npz"
+N_SHIMS = 10000  # random phase shims ranked when this file is run directly
+N_BEST = 10
+
+
+def load_s_matrix(file_name: str = S_MATRIX_FILE) -> tuple:
+    """
+    :return: tuple of the S-matrix, its frequency in Hz and the port names in matrix order.
+    """
+    data = np.load(file_name)
+    return data["s_matrix"], float(data["frequency"]), [str(name) for name in data["ports"]]
+
+
+def check_ports(ports: list, n_channels: int, sources: list = None) -> None:
+    """
+    Checks that the rows of the S-matrix are the channels of the exported fields, in order.
+
+    :param ports: port names of load_s_matrix.
+    :param n_channels: number of exported channels, the sensor_<i>.mat files only carry this.
+    :param sources: optional "<simulation>/<port>" name of every channel, e.g. ContainerStore.files.
+    """
+    if len(ports) != n_channels:
+        raise ValueError(f"S-matrix has {len(ports)} ports, the exports {n_channels} channels")
+    if sources is not None:
+        for i, (port, source) in enumerate(zip(ports, sources)):
+            if not source.endswith("/" + port):
+                raise ValueError(f"Channel {i} is '{source}', the S-matrix has port '{port}' there")
+
+
+def incident_fields(fields, s_matrix: np.ndarray):
+    """
+    Fields per unit wave (1 sqrt(W)) incident on every port, from the exported fields.
+
+    Exciting port i with a unit incident wave conducts 1 - |S_ii|^2 W into it, so every channel
+    is scaled by the square root of that.
+
+    :param fields: (voxels x channels) matrix or masked_field.MaskedField normalised to 1 W
+        conducted power per port.
+    :return: the rescaled fields, of the same type and precision.
+    """
+    values = field_matrix(fields)
+    if values.shape[1] != s_matrix.shape[0]:
+        raise ValueError(f"S-matrix has {s_matrix.shape[0]} ports, the fields {values.shape[1]} channels")
+    scale = match_precision(np.sqrt(1 - np.abs(np.diag(s_matrix))**2), values)
+    if isinstance(fields, MaskedField):
+        return MaskedField(values * scale, fields.indices, fields.grid_shape, fields.axes)
+    return values * scale
+
+
+def power_matrix(s_matrix: np.ndarray) -> np.ndarray:
+    # Hermitian matrix of the accepted power, w^H (I - S^H S) w
+    return np.eye(s_matrix.shape[0]) - s_matrix.conj().T @ s_matrix
+
+
+def forward_power(weights) -> np.ndarray:
+    """
+    :param weights: incident waves in sqrt(W), one vector or (K x channels).
+    """
+    return np.sum(np.abs(weights)**2, axis=-1)
+
+
+def reflected_power(weights, s_matrix: np.ndarray) -> np.ndarray:
+    # power leaving all ports, including the power coupled into the other ports
+    return np.sum(np.abs(np.asarray(weights) @ s_matrix.T)**2, axis=-1)
+
+
+def accepted_power(weights, s_matrix: np.ndarray) -> np.ndarray:
+    weights = np.asarray(weights)
+    return np.real(np.sum(np.conj(weights) * (weights @ power_matrix(s_matrix).T), axis=-1))
+
+
+def evaluate_shims(fields, weight_population, s_matrix: np.ndarray) -> dict:
+    """
+    Power balance and B1+ efficiency of many shims.
+
+    :param fields: fields per unit incident wave, see incident_fields.
+    :param weight_population: (K x channels) incident waves in sqrt(W).
+    :return: dict of K-arrays: forward_power, reflected_power and accepted_power in W,
+        mean_strength and cov of |B1+|, and efficiency, the mean |B1+| per sqrt(W) accepted power.
+        The efficiency is NaN where the accepted power is not positive, which a slightly
+        non-passive simulated S-matrix can give.
+    """
+    weight_population = np.atleast_2d(weight_population)
+    covs, means = batch_cov_and_strength(fields, weight_population)
+    accepted = accepted_power(weight_population, s_matrix)
+    positive = accepted > 0
+    efficiency = np.full(accepted.shape, np.nan)
+    efficiency[positive] = means[positive] / np.sqrt(accepted[positive])
+    return {"forward_power": forward_power(weight_population),
+            "reflected_power": reflected_power(weight_population, s_matrix),
+            "accepted_power": accepted,
+            "mean_strength": means,
+            "cov": covs,
+            "efficiency": efficiency}
+
+
+def rank_shims(results: dict, n_best: int = N_BEST, max_cov: float = None) -> np.ndarray:
+    """
+    Indices of the most power efficient shims of evaluate_shims, optionally only among those with a
+    CoV of at most max_cov. Shims without a finite efficiency are never ranked.
+    """
+    candidates = np.flatnonzero(np.isfinite(results["efficiency"]))
+    if max_cov is not None:
+        candidates = candidates[results["cov"][candidates] <= max_cov]
+    return candidates[np.argsort(results["efficiency"][candidates])[::-1][:n_best]]
+
+
+# if-statement to only perform the ranking when this file is run directly
+if __name__ == "__main__":
+    import shimming
+
+    s_matrix, frequency, ports = load_s_matrix()
+    check_ports(ports, len(shimming.FILES))
+    b1_plus_fields = incident_fields(shimming.initialise_fields_matrix(shimming.FILES, shimming.CENTER_SLICE),
+                                     s_matrix)
+
+    rng = np.random.default_rng()
+    phases = np.vstack([START_PHASES, rng.uniform(-180, 180, (N_SHIMS, len(ports)))])
+    results = evaluate_shims(b1_plus_fields, phase_weights(phases), s_matrix)
+
+    print(f"S-MATRIX at {frequency / 1e6:.0f}MHz")
+    print("|S_ii| (dB): " + " ".join(f"{20 * np.log10(abs(s)):.1f}" for s in np.diag(s_matrix)))
+    print(f"Start phases: accepted power {results['accepted_power'][0]:f} W, "
+          f"efficiency {results['efficiency'][0]:e} T/sqrt(W)\n")
+
+    print(f"MOST EFFICIENT OF {N_SHIMS} SHIMS")
+    for index in rank_shims(results):
+        print("Phases: " + " ".join(f"{p:.0f}" for p in phases[index])
+              + f"  accepted {results['accepted_power'][index]:f} W"
+              + f"  efficiency {results['efficiency'][index]:e} T/sqrt(W)  COV {results['cov'][index]:f}")
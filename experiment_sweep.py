@@ -0,0 +1,99 @@
+"""
+Declarative parameter sweeps over the Model_builder antenna experiments.
+
+The experiments are described in a JSON spec file (see experiments.json) with, per experiment, the
+antenna type, the lengths, the lumped element values, the frequencies and the grid settings; keys
+missing from an experiment are taken from the "defaults" entry. Every distinct antenna geometry is
+built once and shared by all of its frequency and lumped element variants, simulations that
+already exist with the same parameters are skipped, and the new ones are optionally queued for the
+solver.
+"""
+import hashlib
+import json
+
+import s4l_v1.document as doc
+import Model_builder
+
+
+SPEC_FILE = "experiments.json"
+RUN_SIMULATIONS = False  # queue the new simulations for the solver after building them
+
+
+def load_spec(spec_file: str = SPEC_FILE) -> list:
+    with open(spec_file) as file:
+        spec = json.load(file)
+    defaults = spec.get("defaults", {})
+    experiments = []
+    for experiment in spec["experiments"]:
+        merged = dict(defaults)
+        merged.update(experiment)
+        merged["grid"] = dict(defaults.get("grid", {}), **experiment.get("grid", {}))
+        experiments.append(merged)
+    return experiments
+
+
+def grid_tag(grid: dict) -> str:
+    # short, stable identifier of the grid settings so differently gridded variants get their own name
+    return hashlib.sha1(json.dumps(grid, sort_keys=True).encode()).hexdigest()[:6]
+
+
+def expand(experiments: list) -> dict:
+    """
+    Groups the simulation variants of all experiments by the antenna geometry they share.
+
+    :return: dict of (dipoletype, L, thickness, matchingLEs) -> list of variant dicts.
+    """
+    geometries = {}
+    for experiment in experiments:
+        for L in experiment["L_list"]:
+            key = (experiment["dipoletype"], L, experiment["thickness"], experiment["matchingLEs"])
+            variants = geometries.setdefault(key, [])
+            for freq in experiment["freq_list"]:
+                for value in experiment["value_list"]:
+                    name = Model_builder.SimulationName(L, experiment["dipoletype"], value, freq,
+                                                        experiment["thickness"], experiment["matchingLEs"])
+                    name += " grid " + grid_tag(experiment["grid"])
+                    variant = {"L": L, "dipoletype": experiment["dipoletype"], "value": value, "freq": freq,
+                               "name": name, "grid": experiment["grid"]}
+                    if variant not in variants:
+                        variants.append(variant)
+    return geometries
+
+
+def run_sweep(spec_file: str = SPEC_FILE, run: bool = RUN_SIMULATIONS) -> dict:
+    """
+    Builds the geometries and simulations of a spec file.
+
+    :return: dict with the names of the "created", "skipped" and "queued" simulations.
+    """
+    existing = {simulation.Name for simulation in doc.AllSimulations}
+    summary = {"created": [], "skipped": [], "queued": []}
+
+    for (dipoletype, L, thickness, matchingLEs), variants in expand(load_spec(spec_file)).items():
+        new_variants = [variant for variant in variants if variant["name"] not in existing]
+        summary["skipped"] += [variant["name"] for variant in variants if variant["name"] in existing]
+        if not new_variants:
+            continue
+
+        # MakeModel returns the existing antenna group if this geometry was built before, all geometry
+        # parameters are part of the entity names so the variants never pick up another geometry
+        Model_builder.MakeModel(L, dipoletype=dipoletype, thickness=thickness, matchingLEs=matchingLEs)
+
+        for variant in new_variants:
+            simulation = Model_builder.MakeSIM_Multi(L=L, dipoletype=dipoletype, value=variant["value"],
+                                                     freq=variant["freq"], name=variant["name"], thickness=thickness,
+                                                     matchingLEs=matchingLEs, **variant["grid"])
+            existing.add(variant["name"])
+            summary["created"].append(variant["name"])
+            if run:
+                simulation.RunSimulation(wait=False)
+                summary["queued"].append(variant["name"])
+
+    for key in ("created", "skipped", "queued"):
+        print(f"{key.capitalize()}: {len(summary[key])} simulations")
+    return summary
+
+
+# if-statement to only run the sweep when this file is run directly
+if __name__ == "__main__":
+    run_sweep(SPEC_FILE, run=RUN_SIMULATIONS)
@@ -0,0 +1,102 @@
+"""
+Superposition of the per-port B1+ exports for arbitrary channel weights outside of Sim4Life.
+
+Equivalent to weighting the channels of an EmMultiPortSimulationCombiner, but it only evaluates
+the requested slice or ROI, reads the field store in z-chunks and keeps recently combined regions
+in an LRU cache keyed by the weight vector, so comparing candidate shims needs no combiner.Update().
+"""
+from collections import OrderedDict
+import numpy as np
+
+import field_store
+from shimming import match_precision, phase_weights
+
+
+CACHE_SIZE_LIMIT = 512 * 1024**2  # bytes of combined regions kept in memory
+CHUNK_SLICES = 16  # z-slices read from the store at once
+
+
+def channel_weights(phases, amplitudes=None) -> np.ndarray:
+    """
+    Complex channel weights from phases in degrees and optional amplitudes, as in simulate.set_phases.
+    """
+    weights = phase_weights(phases)
+    if amplitudes is not None:
+        weights = weights * np.asarray(amplitudes, dtype=float)
+    return weights
+
+
+def _region_key(region: tuple) -> tuple:
+    return tuple((s.start, s.stop, s.step) if isinstance(s, slice) else s for s in region)
+
+
+class FieldCombiner:
+    def __init__(self, store, size_limit: int = CACHE_SIZE_LIMIT, chunk_slices: int = CHUNK_SLICES):
+        """
+        :param store: field_store.FieldStore of the per-port exports.
+        :param size_limit: bytes of combined regions kept in the LRU cache, larger regions are not cached.
+        :param chunk_slices: number of z-slices combined at once, bounds the temporary memory.
+        """
+        self.store = store
+        self.size_limit = size_limit
+        self.chunk_slices = chunk_slices
+        self._cache = OrderedDict()
+
+    @classmethod
+    def from_exports(cls, files: list, store_path: str, **kwargs):
+        return cls(field_store.open_store(files, store_path), **kwargs)
+
+    def combine(self, weights, x=slice(None), y=slice(None), z=slice(None)) -> np.ndarray:
+        """
+        Combined complex B1+ of the region (x, y, z) for the given complex channel weights.
+
+        Integer indices select a single plane, e.g. combine(weights, z=198) gives an XY slice.
+        """
+        weights = np.asarray(weights, dtype=np.complex128)
+        key = (weights.tobytes(), _region_key((x, y, z)))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        combined = self._combine_chunked(weights, x, y, z)
+        combined.flags.writeable = False
+        if combined.nbytes <= self.size_limit:
+            self._cache[key] = combined
+            while self.cache_bytes() > self.size_limit:
+                self._cache.popitem(last=False)
+        return combined
+
+    def cache_bytes(self) -> int:
+        return sum(combined.nbytes for combined in self._cache.values())
+
+    def magnitude(self, weights, x=slice(None), y=slice(None), z=slice(None)) -> np.ndarray:
+        return np.abs(self.combine(weights, x, y, z))
+
+    def slice(self, weights, axis: int, index: int) -> np.ndarray:
+        """
+        Combined complex B1+ plane at the given index along axis 0 (x), 1 (y) or 2 (z).
+        """
+        region = [slice(None)] * 3
+        region[axis] = index
+        return self.combine(weights, *region)
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def _combine_chunked(self, weights: np.ndarray, x, y, z) -> np.ndarray:
+        weights = match_precision(weights, self.store.fields)
+        if not isinstance(z, slice):
+            return np.tensordot(weights, self.store.roi(x, y, z), axes=1)
+
+        z_indices = range(self.store.shape[2])[z]
+        if len(z_indices) <= self.chunk_slices:
+            return np.tensordot(weights, self.store.roi(x, y, z), axes=1)
+
+        chunks = []
+        for start in range(0, len(z_indices), self.chunk_slices):
+            z_chunk = z_indices[start:start + self.chunk_slices]
+            # a negative stop only occurs when stepping backwards past slice 0
+            stop = z_chunk.stop if z_chunk.stop >= 0 else None
+            chunk = self.store.roi(x, y, slice(z_chunk.start, stop, z_chunk.step))
+            chunks.append(np.tensordot(weights, chunk, axes=1))
+        return np.concatenate(chunks, axis=-1)
@@ -0,0 +1,158 @@
+"""
+Consolidated on-disk store of the per-port B1+ exports.
+
+convert_exports packs every sensor_<i>.mat file into a single (channel, x, y, z) complex64 array
+with the axis midpoints stored alongside. The array is kept in column-major order like the MATLAB
+exports, so every z-slab is one contiguous block on disk and the voxels of a slab are already laid
+out as a (voxels x channels) matrix. FieldStore memory-maps the array, so slab, slice and ROI
+reads only touch the bytes they need. ContainerStore reads the HDF5 container written by
+simulate.export_singleports through the same interface, one compressed z-slice chunk at a time.
+"""
+import os
+import numpy as np
+
+from shimming import load_b1_plus
+
+
+FIELDS_FILE = "fields.npy"
+AXES_FILE = "axes.npz"
+CONTAINER_FILE = "b1_fields.h5"
+
+
+def convert_exports(files: list, store_path: str) -> None:
+    """
+    One-time conversion of the MatlabExporter files into a field store.
+
+    :param files: sensor_<i>.mat files, in channel order.
+    :param store_path: directory to write the store to, created if it does not exist.
+    """
+    if not files:
+        raise ValueError("No export files to convert")
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+
+    fields = None
+    for i, file_name in enumerate(files):
+        b1_plus, axes = load_b1_plus(file_name)
+        if fields is None:
+            fields = np.lib.format.open_memmap(os.path.join(store_path, FIELDS_FILE), mode="w+",
+                                               dtype=np.complex64, shape=(len(files),) + b1_plus.shape,
+                                               fortran_order=True)
+        fields[i] = b1_plus
+        print(f"Stored: {file_name} as channel {i}")
+        del b1_plus
+
+    fields.flush()
+    del fields
+    np.savez(os.path.join(store_path, AXES_FILE), x=axes[0], y=axes[1], z=axes[2],
+             files=np.array([os.path.abspath(f) for f in files]))
+
+
+def is_current(files: list, store_path: str) -> bool:
+    fields_path = os.path.join(store_path, FIELDS_FILE)
+    axes_path = os.path.join(store_path, AXES_FILE)
+    if not (os.path.exists(fields_path) and os.path.exists(axes_path)):
+        return False
+    with np.load(axes_path) as axes:
+        if list(axes["files"]) != [os.path.abspath(f) for f in files]:
+            return False
+    stored = os.path.getmtime(fields_path)
+    return all(os.path.getmtime(f) <= stored for f in files)
+
+
+def open_store(files: list, store_path: str):
+    """
+    Opens the field store of the given exports, converting them first if the store is missing or
+    older than any of the files.
+    """
+    if not is_current(files, store_path):
+        convert_exports(files, store_path)
+    return FieldStore(store_path)
+
+
+class FieldStore:
+    def __init__(self, store_path: str):
+        self.path = store_path
+        self.fields = np.load(os.path.join(store_path, FIELDS_FILE), mmap_mode="r")
+        with np.load(os.path.join(store_path, AXES_FILE)) as axes:
+            self.axes = [axes["x"], axes["y"], axes["z"]]
+            self.files = list(axes["files"])
+        self.n_channels = self.fields.shape[0]
+        self.shape = self.fields.shape[1:]
+
+    def _check_slab(self, z_start: int, z_stop: int) -> None:
+        # negative starts would wrap around to the end of the array instead of failing
+        if not 0 <= z_start <= z_stop <= self.shape[2]:
+            raise ValueError(f"Slices {z_start} to {z_stop} are outside the {self.shape[2]} slices of the store")
+
+    def slab(self, z_start: int, z_stop: int) -> np.ndarray:
+        """
+        Read-only (channel, x, y, z) view of the slices z_start up to but not including z_stop.
+        """
+        self._check_slab(z_start, z_stop)
+        return self.fields[:, :, :, z_start:z_stop]
+
+    def slice(self, axis: int, index: int) -> np.ndarray:
+        """
+        (channel, u, v) plane at the given index along axis 0 (x), 1 (y) or 2 (z).
+        """
+        selection = [slice(None)] * 4
+        selection[axis + 1] = index
+        return np.asarray(self.fields[tuple(selection)])
+
+    def roi(self, x: slice, y: slice, z: slice) -> np.ndarray:
+        return np.asarray(self.fields[:, x, y, z])
+
+    def slab_matrix(self, center_slice: int, half_width: int, drop_nan: bool = True) -> np.ndarray:
+        """
+        (voxels x channels) matrix of the slab center_slice +- half_width, as used by shimming.
+
+        The slab is contiguous on disk, so this reads exactly its bytes and needs no transpose. A
+        slab that does not fit in the store raises a ValueError.
+        """
+        slab = self.slab(center_slice - half_width, center_slice + half_width + 1)
+        fields = np.asarray(slab).reshape(self.n_channels, -1, order="F").T
+        if drop_nan:
+            fields = fields[~np.isnan(fields).any(axis=1)]
+        return np.ascontiguousarray(fields)
+
+
+class ContainerStore(FieldStore):
+    def __init__(self, container_path: str = CONTAINER_FILE):
+        """
+        :param container_path: HDF5 container written by simulate.export_singleports, needs h5py.
+        """
+        import h5py
+
+        self.path = container_path
+        self.container = h5py.File(container_path, "r")
+        self.fields = self.container["b1_plus"]
+        self.axes = [self.container[name][()] for name in ("x", "y", "z")]
+        self.files = [source.decode() for source in self.container["sources"][()]]
+        self.n_channels = self.fields.shape[0]
+        self.shape = self.fields.shape[1:]
+
+    def slab(self, z_start: int, z_stop: int) -> np.ndarray:
+        self._check_slab(z_start, z_stop)
+        return self.fields[:, :, :, z_start:z_stop]
+
+    def roi(self, x: slice, y: slice, z: slice) -> np.ndarray:
+        # HDF5 selections only step forwards, so read the bounding block and index it in memory
+        selection, local = [slice(None)], [slice(None)]
+        for s, size in zip((x, y, z), self.shape):
+            if isinstance(s, slice) and s.step is not None and s.step < 0:
+                indices = range(size)[s]
+                if len(indices) == 0:
+                    selection.append(slice(0, 0))
+                    local.append(slice(None))
+                    continue
+                selection.append(slice(indices[-1], indices[0] + 1))
+                local.append(slice(None, None, s.step))
+            else:
+                selection.append(s)
+                if isinstance(s, slice):
+                    local.append(slice(None))
+        return self.fields[tuple(selection)][tuple(local)]
+
+    def close(self) -> None:
+        self.container.close()
@@ -0,0 +1,292 @@
+"""
+Pre-solve estimate of the FDTD grid that simulate.multiport_sim will produce.
+
+Reproduces the non-uniform grid line placement from the ElipseArray layout, the bounding box and
+the manual grid settings: every geometric feature of an antenna (arm ends, feed gap, meander
+edges) and every face of the bounding box is a fixed grid line, the steps grow geometrically away
+from a feature at its resolution up to the max step of the region it lies in, and the padding is
+gridded at the bounding box max step. From the lines it reports the cell count, the expected GPU
+memory and the time per period, and rank_settings compares alternative grid settings.
+
+The memory per cell, grading ratio and solver throughput are order of magnitude values, not
+calibrated against a run of this array; calibrate them against the UpdateGrid() and solver logs of
+a finished simulation. Estimates beyond the GPU memory or the time budget are flagged in the report
+and by check_budget, which warns with a RuntimeWarning.
+"""
+import itertools
+import warnings
+import numpy as np
+
+
+SPEED_OF_LIGHT = 299792458.0  # m/s
+GRADING_RATIO = 1.2  # maximum ratio between neighbouring steps
+COURANT_FACTOR = 0.99  # fraction of the Courant limit used as time step
+BYTES_PER_CELL = 48  # field components, update coefficients and material indices
+SENSOR_BYTES_PER_CELL = 48  # complex E and H at the center frequency in the field sensor
+THROUGHPUT = 1.5e9  # cell updates per second of the CUDA kernel
+GPU_MEMORY = 24 * 1024**3  # bytes
+TIME_BUDGET = 48 * 3600.0  # seconds of solver time per simulation
+
+# mirrors setup_controls_duke.py and simulation_controls.py
+DIPOLE_SETTINGS = {"length": 350,
+                   "width": 10,
+                   "gapwidth": 2,
+                   "thickness": 0,
+                   "matchingLEs": False}
+GRID_SETTINGS = {"antenna_grid_max_step": 1.0,
+                 "antenna_grid_resolution": 0.05,
+                 "phantom_grid_max_step": 3.0,
+                 "phantom_grid_resolution": 10.0
+                 }
+
+
+class Layout:
+    def __init__(self, coords_2D: np.ndarray, angles: np.ndarray, antenna_parameters: dict,
+                 array_width: float, array_height: float):
+        """
+        Positions and parameters of the antennas of an ElipseArray, without any Sim4Life entities.
+        """
+        self.coords_2D = np.asarray(coords_2D, dtype=float)
+        self.angles = np.asarray(angles, dtype=float)
+        self.antenna_parameters = antenna_parameters
+        self.width = array_width
+        self.height = array_height
+        self.length = antenna_parameters["length"]
+
+    @classmethod
+    def elipse(cls, n_antennas: int, antenna_parameters: dict, array_width: float = 240, array_height: float = 300):
+        # same placement as antennas.ElipseArray
+        angles = np.linspace(0.5*np.pi, 2.5*np.pi, n_antennas, endpoint=False)
+        coords_2D = np.vstack([np.array((array_width/2*np.cos(t), array_height/2*np.sin(t))) for t in angles])
+        return cls(coords_2D, angles, antenna_parameters, array_width, array_height)
+
+    @classmethod
+    def from_array(cls, array):
+        return cls(array.coords_2D, array.angles, array.antenna_parameters, array.width, array.height)
+
+    def bounding_box(self) -> tuple:
+        # corners of antennas.ElipseArray.add_bounding_box
+        return (np.array([-self.width/2, -self.height/2, -self.length/2]),
+                np.array([self.width/2, self.height/2, self.length/2]))
+
+    def antenna_features(self) -> tuple:
+        """
+        Feature coordinates of all FractionatedDipole elements along x, y and z.
+        """
+        hl = self.length / 2.0
+        hgw = self.antenna_parameters.get("gapwidth", 2) / 2.0
+        hw = self.antenna_parameters.get("width", 10) / 2.0
+        thickness = self.antenna_parameters.get("thickness", 0)
+
+        # local (normal, tangent) features of the conductor, including the meander pieces
+        normal = [0.0, thickness]
+        tangent = [s * u for s in (-1, 1) for u in (hw, hw + 6, hw + 12)]
+        z = [-hl, -hgw, hgw, hl]
+        for z_segment in hl * np.array([-2. / 3, -1. / 3, 1. / 3, 2. / 3]):
+            z += [z_segment + dz for dz in (-10, -6, -2, 2, 6, 10)]
+
+        x, y = [], []
+        for (cx, cy), angle in zip(self.coords_2D, self.angles):
+            for n, u in itertools.product(normal, tangent):
+                x.append(cx + n * np.cos(angle) - u * np.sin(angle))
+                y.append(cy + n * np.sin(angle) + u * np.cos(angle))
+        return np.array(x), np.array(y), np.array(z)
+
+    def antenna_extents(self) -> list:
+        """
+        Per antenna the (lower, upper) corner of its axis-aligned bounding box.
+        """
+        x, y, z = self.antenna_features()
+        n_features = len(x) // len(self.angles)
+        extents = []
+        for i in range(len(self.angles)):
+            xs = x[i * n_features:(i + 1) * n_features]
+            ys = y[i * n_features:(i + 1) * n_features]
+            extents.append((np.array([xs.min(), ys.min(), z.min()]), np.array([xs.max(), ys.max(), z.max()])))
+        return extents
+
+
+def _fill_interval(length: float, left_step: float, right_step: float, max_step: float, grading: float) -> list:
+    """
+    Steps covering an interval, growing geometrically from both ends and capped at max_step.
+    """
+    left_step = min(left_step, max_step)
+    right_step = min(right_step, max_step)
+    left, right = [], []
+    remaining = length
+    while True:
+        step = min(left_step, right_step)
+        if step >= remaining:
+            break
+        if left_step <= right_step:
+            left.append(left_step)
+            left_step = min(left_step * grading, max_step)
+        else:
+            right.append(right_step)
+            right_step = min(right_step * grading, max_step)
+        remaining -= step
+
+    steps = left + right[::-1]
+    if not steps or remaining > 0.5 * min(left_step, right_step):
+        steps.insert(len(left), remaining)
+    else:
+        # stretch the steps slightly rather than leaving a sliver cell
+        steps = [s * length / (length - remaining) for s in steps]
+    return steps
+
+
+def grid_lines(lower: float, upper: float, features: list, regions: list, background_step: float,
+               grading: float = GRADING_RATIO) -> np.ndarray:
+    """
+    Non-uniform grid lines along one axis.
+
+    :param features: (position, resolution) of every fixed grid line.
+    :param regions: (lower, upper, max_step) of every object region.
+    :param background_step: max step outside all regions, i.e. in the padding.
+    """
+    points = sorted([(lower, background_step), (upper, background_step)]
+                    + [(p, r) for p, r in features if lower < p < upper])
+
+    # merge features closer than their resolution, keeping the finest resolution
+    merged = [points[0]]
+    for position, resolution in points[1:]:
+        previous, previous_resolution = merged[-1]
+        if position - previous < min(resolution, previous_resolution):
+            merged[-1] = (previous, min(resolution, previous_resolution))
+        else:
+            merged.append((position, resolution))
+
+    lines = [merged[0][0]]
+    for (a, resolution_a), (b, resolution_b) in zip(merged[:-1], merged[1:]):
+        center = (a + b) / 2
+        max_steps = [step for low, high, step in regions if low <= center <= high]
+        max_step = min(max_steps) if max_steps else background_step
+        position = a
+        for step in _fill_interval(b - a, resolution_a, resolution_b, max_step, grading):
+            position += step
+            lines.append(position)
+        lines[-1] = b
+    return np.array(lines)
+
+
+class GridEstimate:
+    def __init__(self, lines: list, frequency: float, simulation_time: float, box_cells: int,
+                 throughput: float = THROUGHPUT):
+        """
+        :param lines: grid lines in millimeters along x, y and z.
+        :param frequency: center frequency in MHz.
+        :param simulation_time: simulation time in periods.
+        :param box_cells: cells inside the bounding box, recorded by the overall field sensor.
+        """
+        self.lines = lines
+        self.shape = tuple(len(axis_lines) - 1 for axis_lines in lines)
+        self.n_cells = int(np.prod(self.shape))
+        self.min_steps = [np.diff(axis_lines).min() for axis_lines in lines]
+
+        min_steps_m = np.array(self.min_steps) * 1e-3
+        self.time_step = COURANT_FACTOR / (SPEED_OF_LIGHT * np.sqrt(np.sum(1 / min_steps_m**2)))
+        self.steps_per_period = int(np.ceil(1 / (frequency * 1e6) / self.time_step))
+        self.memory = self.n_cells * BYTES_PER_CELL + box_cells * SENSOR_BYTES_PER_CELL
+        self.time_per_period = self.steps_per_period * self.n_cells / throughput
+        self.total_time = self.time_per_period * simulation_time
+
+    def fits(self, gpu_memory: int = GPU_MEMORY) -> bool:
+        return self.memory <= gpu_memory
+
+    def problems(self, gpu_memory: int = GPU_MEMORY, time_budget: float = TIME_BUDGET) -> list:
+        """
+        :return: descriptions of the budgets the estimate exceeds, empty if it is within both.
+        """
+        problems = []
+        if not self.fits(gpu_memory):
+            problems.append(f"GPU memory {self.memory / 1024**3:.2f} GB exceeds {gpu_memory / 1024**3:.2f} GB")
+        if self.total_time > time_budget:
+            problems.append(f"runtime {self.total_time / 3600:.2f} h exceeds {time_budget / 3600:.2f} h")
+        return problems
+
+    def report(self, gpu_memory: int = GPU_MEMORY, time_budget: float = TIME_BUDGET) -> str:
+        report = (f"Grid: {self.shape[0]} x {self.shape[1]} x {self.shape[2]} = {self.n_cells / 1e6:.1f} MCells\n"
+                  f"Min steps (mm): {self.min_steps[0]:.3f} {self.min_steps[1]:.3f} {self.min_steps[2]:.3f}\n"
+                  f"Time steps per period: {self.steps_per_period}\n"
+                  f"GPU memory: {self.memory / 1024**3:.2f} GB\n"
+                  f"Time per period: {self.time_per_period:.1f} s, total: {self.total_time / 3600:.2f} h")
+        for problem in self.problems(gpu_memory, time_budget):
+            report += f"\nWARNING: {problem}"
+        return report
+
+
+def check_budget(estimate: GridEstimate, gpu_memory: int = GPU_MEMORY, time_budget: float = TIME_BUDGET) -> bool:
+    """
+    Warns with a RuntimeWarning for every budget the estimate exceeds.
+
+    :return: whether the estimate is within the GPU memory and the time budget.
+    """
+    problems = estimate.problems(gpu_memory, time_budget)
+    for problem in problems:
+        warnings.warn(f"Estimated grid: {problem}", RuntimeWarning)
+    return not problems
+
+
+def estimate_grid(layout: Layout, top_padding: float, bottom_padding: float, frequency: float = 298,
+                  simulation_time: float = 500, antenna_grid_max_step: float = 5.0,
+                  antenna_grid_resolution: float = 0.05, phantom_grid_max_step: float = 5.0,
+                  phantom_grid_resolution: float = 10.0, throughput: float = THROUGHPUT) -> GridEstimate:
+    """
+    Estimates the grid of multiport_sim for an array with a bounding box, taking the same arguments.
+    """
+    box_lower, box_upper = layout.bounding_box()
+    domain_lower = box_lower - bottom_padding
+    domain_upper = box_upper + top_padding
+    antenna_features = layout.antenna_features()
+    antenna_extents = layout.antenna_extents()
+
+    lines = []
+    for axis in range(3):
+        features = [(p, antenna_grid_resolution) for p in antenna_features[axis]]
+        features += [(box_lower[axis], phantom_grid_resolution), (box_upper[axis], phantom_grid_resolution)]
+        regions = [(box_lower[axis], box_upper[axis], phantom_grid_max_step)]
+        regions += [(low[axis], high[axis], antenna_grid_max_step) for low, high in antenna_extents]
+        lines.append(grid_lines(domain_lower[axis], domain_upper[axis], features, regions, phantom_grid_max_step))
+
+    box_cells = int(np.prod([np.sum((axis_lines[:-1] >= box_lower[axis]) & (axis_lines[1:] <= box_upper[axis]))
+                             for axis, axis_lines in enumerate(lines)]))
+    return GridEstimate(lines, frequency, simulation_time, box_cells, throughput)
+
+
+def rank_settings(layout: Layout, top_padding: float, bottom_padding: float, candidates: list,
+                  gpu_memory: int = GPU_MEMORY, time_budget: float = TIME_BUDGET, **kwargs) -> list:
+    """
+    Estimates every candidate grid setting and ranks them by total runtime, the ones within the GPU
+    memory and time budget first.
+
+    :param candidates: dicts of grid settings as in simulation_controls.GRID_SETTINGS.
+    :return: list of (grid settings, GridEstimate) tuples.
+    """
+    estimates = [(settings, estimate_grid(layout, top_padding, bottom_padding, **settings, **kwargs))
+                 for settings in candidates]
+    return sorted(estimates, key=lambda item: (bool(item[1].problems(gpu_memory, time_budget)), item[1].total_time))
+
+
+def candidate_settings(antenna_resolutions=(0.05, 0.1, 0.25, 0.5), antenna_max_steps=(0.5, 1.0, 2.0),
+                       phantom_max_steps=(2.0, 3.0, 5.0), phantom_resolution: float = 10.0) -> list:
+    return [{"antenna_grid_max_step": antenna_max_step,
+             "antenna_grid_resolution": antenna_resolution,
+             "phantom_grid_max_step": phantom_max_step,
+             "phantom_grid_resolution": phantom_resolution}
+            for antenna_resolution, antenna_max_step, phantom_max_step
+            in itertools.product(antenna_resolutions, antenna_max_steps, phantom_max_steps)
+            if antenna_resolution <= antenna_max_step]
+
+
+# if-statement to only perform the estimate when this file is run directly
+if __name__ == "__main__":
+    padding = 200 * 0.95
+    layout = Layout.elipse(8, DIPOLE_SETTINGS, array_width=170, array_height=260)
+
+    print("CURRENT SETTINGS")
+    print(estimate_grid(layout, padding, padding, **GRID_SETTINGS).report())
+
+    print("\nRANKED ALTERNATIVES")
+    for settings, estimate in rank_settings(layout, padding, padding, candidate_settings())[:10]:
+        print(f"{settings}: {estimate.n_cells / 1e6:.1f} MCells, {estimate.memory / 1024**3:.2f} GB, "
+              f"{estimate.total_time / 3600:.2f} h" + "".join(f" ({problem})" for problem in estimate.problems()))
@@ -0,0 +1,130 @@
+"""
+Tissue-only representation of the per-port B1+ exports.
+
+The exports pass through a FieldMaskingFilter, so everything outside the Duke tissues is NaN. A
+MaskedField keeps only the valid voxels as a flat (voxels x channels) matrix together with their
+column-major linear indices into the export grid. The mask is determined once at load time, after
+which metrics and optimisers work on the matrix directly and scatter() puts values back on the
+grid for plotting.
+"""
+import numpy as np
+
+from shimming import load_b1_plus, match_precision, phase_weights
+
+
+class MaskedField:
+    def __init__(self, values: np.ndarray, indices: np.ndarray, grid_shape: tuple, axes: list = None):
+        """
+        :param values: (voxels x channels) complex fields of the valid voxels.
+        :param indices: column-major linear index of every voxel into the grid.
+        :param grid_shape: (x, y, z) shape of the export grid.
+        :param axes: axis midpoints of the export grid.
+        """
+        self.values = np.ascontiguousarray(values)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.grid_shape = tuple(grid_shape)
+        self.axes = axes
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    @property
+    def n_voxels(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def n_channels(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def fill_fraction(self) -> float:
+        return self.n_voxels / np.prod(self.grid_shape)
+
+    @classmethod
+    def from_exports(cls, files: list, z_start: int = 0, z_stop: int = None, dtype=np.complex128):
+        """
+        Loads the sensor_<i>.mat exports, keeping only voxels that are valid in every channel.
+
+        Each channel is reduced to the voxels valid in the first one as soon as it is loaded, so no
+        more than one full volume is held in memory.
+
+        :param dtype: precision of the values, the field store is always np.complex64.
+        """
+        columns = []
+        for file_name in files:
+            b1_plus, axes = load_b1_plus(file_name)
+            grid_shape = b1_plus.shape
+            volume = b1_plus[:, :, z_start:z_stop].ravel(order="F")
+            del b1_plus
+            if not columns:
+                local_indices = np.flatnonzero(~np.isnan(volume))
+            columns.append(volume[local_indices].astype(dtype))
+
+        values = np.stack(columns, axis=1)
+        valid = ~np.isnan(values).any(axis=1)
+        indices = local_indices[valid] + grid_shape[0] * grid_shape[1] * z_start
+        return cls(values[valid], indices, grid_shape, axes)
+
+    @classmethod
+    def from_store(cls, store, z_start: int = 0, z_stop: int = None, chunk_slices: int = 16):
+        """
+        Builds the masked field from a field_store.FieldStore, reading it in z-chunks. An empty
+        z-range gives a field without voxels.
+        """
+        n_x, n_y, n_z = store.shape
+        z_stop = n_z if z_stop is None else z_stop
+        if z_stop <= z_start:
+            # e.g. a thin ROI that contains no voxel midpoint of a coarse grid
+            return cls(np.empty((0, store.n_channels), dtype=store.fields.dtype), np.empty(0, dtype=np.int64),
+                       store.shape, store.axes)
+
+        values = []
+        indices = []
+        for start in range(z_start, z_stop, chunk_slices):
+            stop = min(start + chunk_slices, z_stop)
+            chunk = np.asarray(store.slab(start, stop)).reshape(store.n_channels, -1, order="F").T
+            valid = np.flatnonzero(~np.isnan(chunk).any(axis=1))
+            values.append(chunk[valid])
+            indices.append(valid + n_x * n_y * start)
+
+        return cls(np.concatenate(values), np.concatenate(indices), store.shape, store.axes)
+
+    def grid_coordinates(self) -> tuple:
+        # (x, y, z) grid indices of every voxel
+        return np.unravel_index(self.indices, self.grid_shape, order="F")
+
+    def slice_starts(self) -> np.ndarray:
+        """
+        Offsets of every z-slice in the voxel list, slice z spans slice_starts[z]:slice_starts[z + 1].
+
+        Relies on the voxels being sorted by linear index, as they are after loading.
+        """
+        n_x, n_y, n_z = self.grid_shape
+        return np.searchsorted(self.indices, np.arange(n_z + 1) * n_x * n_y)
+
+    def select(self, voxels) -> "MaskedField":
+        """
+        MaskedField of a subset of the voxels, given as a boolean mask or an index array.
+        """
+        return MaskedField(self.values[voxels], self.indices[voxels], self.grid_shape, self.axes)
+
+    def slab(self, z_start: int, z_stop: int) -> "MaskedField":
+        z = self.indices // (self.grid_shape[0] * self.grid_shape[1])
+        return self.select((z >= z_start) & (z < z_stop))
+
+    def astype(self, dtype) -> "MaskedField":
+        return MaskedField(self.values.astype(dtype), self.indices, self.grid_shape, self.axes)
+
+    def combine(self, phases) -> np.ndarray:
+        return self.values @ match_precision(phase_weights(phases), self.values)
+
+    def scatter(self, voxel_values: np.ndarray, fill=np.nan) -> np.ndarray:
+        """
+        Places per-voxel values back on the (x, y, z) export grid, e.g. for plotting.
+        """
+        voxel_values = np.asarray(voxel_values)
+        dtype = np.result_type(voxel_values.dtype, np.asarray(fill).dtype)
+        volume = np.full(int(np.prod(self.grid_shape)), fill, dtype=dtype)
+        volume[self.indices] = voxel_values
+        return volume.reshape(self.grid_shape, order="F")
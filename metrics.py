@@ -0,0 +1,151 @@
+"""
+B1+ homogeneity metrics in a single streaming pass.
+
+Python counterpart of the cov, newCov, mse and normMSE helpers in phase_optimiser.m and the MSE in
+calcMSE_plotstrengthvsMSE.m. HomogeneityAccumulator takes |B1+| in chunks and keeps the voxel
+count, mean, sum of squared deviations, extremes and a histogram in float64, so CoV, MSE,
+normalised MSE, min/max ratio, percentiles and mean |B1+| all come from one read of the data and
+a full-body volume never has to be in memory at once. NaN voxels are skipped like omitnan.
+"""
+import numpy as np
+
+from field_combiner import channel_weights
+from shimming import field_matrix, match_precision
+
+
+CHUNK_SIZE = 262144  # voxels combined at once
+CHUNK_SLICES = 16  # z-slices read from a field store at once
+N_BINS = 8192  # histogram bins for the percentiles
+PERCENTILES = (5, 50, 95)
+
+
+class HomogeneityAccumulator:
+    def __init__(self, n_bins: int = N_BINS):
+        """
+        :param n_bins: histogram resolution of the percentiles. The histogram covers [0, upper) and
+            doubles its range when a larger value arrives, so percentiles are accurate to within
+            about 2 * max|B1+| / n_bins.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.histogram = np.zeros(n_bins, dtype=np.int64)
+        self.upper = None
+
+    def update(self, magnitude) -> None:
+        """
+        Adds a chunk of non-negative |B1+| values, NaN values are ignored.
+        """
+        magnitude = np.asarray(magnitude, dtype=np.float64).ravel()
+        magnitude = magnitude[~np.isnan(magnitude)]
+        if magnitude.size == 0:
+            return
+
+        # merge the chunk mean and squared deviations with the running ones (Chan et al.)
+        n = magnitude.size
+        chunk_mean = magnitude.mean()
+        deviation = magnitude - chunk_mean
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.m2 += deviation @ deviation + delta**2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+
+        chunk_max = magnitude.max()
+        self.minimum = min(self.minimum, magnitude.min())
+        self.maximum = max(self.maximum, chunk_max)
+
+        if self.upper is None:
+            self.upper = 2.0 ** (np.floor(np.log2(chunk_max)) + 1) if chunk_max > 0 else 1.0
+        while chunk_max >= self.upper:
+            half = self.histogram.reshape(-1, 2).sum(axis=1)
+            self.histogram = np.concatenate([half, np.zeros_like(half)])
+            self.upper *= 2
+        n_bins = self.histogram.size
+        self.histogram += np.bincount((magnitude * (n_bins / self.upper)).astype(np.int64), minlength=n_bins)
+
+    def percentile(self, q) -> np.ndarray:
+        """
+        Percentiles in [0, 100], interpolated linearly within the histogram bins.
+        """
+        q = np.asarray(q, dtype=float)
+        cumulative = np.cumsum(self.histogram)
+        target = q / 100 * self.count
+        index = np.minimum(np.searchsorted(cumulative, target), self.histogram.size - 1)
+        before = cumulative[index] - self.histogram[index]
+        width = self.upper / self.histogram.size
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(self.histogram[index] > 0, (target - before) / self.histogram[index], 0)
+        return np.clip((index + fraction) * width, self.minimum, self.maximum)
+
+    def metrics(self, percentiles=PERCENTILES) -> dict:
+        """
+        :return: dict with the voxel count, mean |B1+|, CoV (sample standard deviation, as std in
+            MATLAB), MSE and normalised MSE with respect to the mean, min/max ratio and the
+            requested percentiles as percentile_<q>.
+        """
+        result = {"n_voxels": self.count,
+                  "mean_strength": self.mean,
+                  "cov": np.sqrt(self.m2 / (self.count - 1)) / self.mean,
+                  "mse": self.m2 / self.count,
+                  "norm_mse": self.m2 / self.count / self.mean**2,
+                  "min_max_ratio": self.minimum / self.maximum}
+        for q, value in zip(percentiles, self.percentile(percentiles)):
+            result[f"percentile_{q:g}"] = value
+        return result
+
+
+def magnitude_metrics(magnitude, chunk_size: int = CHUNK_SIZE, percentiles=PERCENTILES) -> dict:
+    """
+    Metrics of a |B1+| array of any shape, read in chunks along its first axis (e.g. a memmap).
+    """
+    rows = max(1, chunk_size // max(1, int(np.prod(np.shape(magnitude)[1:]))))
+    accumulator = HomogeneityAccumulator()
+    for start in range(0, len(magnitude), rows):
+        accumulator.update(magnitude[start:start + rows])
+    return accumulator.metrics(percentiles)
+
+
+def field_metrics(fields, phases, amplitudes=None, chunk_size: int = CHUNK_SIZE, percentiles=PERCENTILES) -> dict:
+    """
+    Metrics of the combined |B1+| of a (voxels x channels) matrix or masked_field.MaskedField.
+    """
+    fields = field_matrix(fields)
+    weights = match_precision(channel_weights(phases, amplitudes), fields)
+    accumulator = HomogeneityAccumulator()
+    for start in range(0, fields.shape[0], chunk_size):
+        accumulator.update(np.abs(fields[start:start + chunk_size] @ weights))
+    return accumulator.metrics(percentiles)
+
+
+def store_metrics(store, phases, amplitudes=None, z_start: int = 0, z_stop: int = None,
+                  chunk_slices: int = CHUNK_SLICES, percentiles=PERCENTILES) -> dict:
+    """
+    Metrics of the combined |B1+| of the slices z_start up to z_stop of a field_store.FieldStore,
+    read chunk_slices at a time.
+    """
+    z_stop = store.shape[2] if z_stop is None else z_stop
+    weights = match_precision(channel_weights(phases, amplitudes), store.fields)
+    accumulator = HomogeneityAccumulator()
+    for start in range(z_start, z_stop, chunk_slices):
+        slab = store.slab(start, min(start + chunk_slices, z_stop))
+        accumulator.update(np.abs(np.tensordot(weights, slab, axes=1)))
+    return accumulator.metrics(percentiles)
+
+
+# if-statement to only compute the metrics when this file is run directly
+if __name__ == "__main__":
+    import field_store
+    import shimming
+
+    STORE_PATH = "FIELD_STORE"
+
+    store = field_store.open_store(shimming.FILES, STORE_PATH)
+    slab_metrics = store_metrics(store, shimming.START_PHASES,
+                                 z_start=shimming.CENTER_SLICE - shimming.HALF_WIDTH,
+                                 z_stop=shimming.CENTER_SLICE + shimming.HALF_WIDTH + 1)
+    volume_metrics = store_metrics(store, shimming.START_PHASES)
+    for name in slab_metrics:
+        print(f"{name}: slab {slab_metrics[name]:e}, volume {volume_metrics[name]:e}")
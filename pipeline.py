@@ -0,0 +1,216 @@
+"""
+Overlapped solve and extract pipeline for a queue of multiport simulations.
+
+The solve stage builds each simulation with simulate.multiport_sim, submits it to the solver and
+polls its status, while the extract stage runs extract_multiport and the single port exports of
+simulations that already finished. Finished simulations are passed through a bounded queue, so the
+solver is never more than queue_size simulations ahead of the extraction. Both stages run on one
+asyncio event loop in the Sim4Life main thread; the overlap comes from the solver running in its
+own process while the extraction of the previous simulation runs. Simulations that have no results
+within solve_timeout of their submission (e.g. a failed solve) are given up, and simulations whose
+build, submission or extraction raises are skipped; both are reported and the other simulations
+continue. The clock and sleep are injectable, so tests can run the pipeline on a FakeClock.
+"""
+import asyncio
+import time
+
+
+QUEUE_SIZE = 2  # finished simulations waiting for extraction before the solve stage pauses
+MAX_SUBMITTED = 2  # simulations submitted to the solver at once, the next one waits in its queue
+POLL_INTERVAL = 5.0  # seconds between solver status checks
+SOLVE_TIMEOUT = 24 * 3600.0  # seconds from submission after which a simulation counts as failed
+
+
+class Sim4LifeSolver:
+    def submit(self, simulation_name: str) -> None:
+        import s4l_v1.document as document
+
+        document.AllSimulations[simulation_name].RunSimulation(wait=False)
+
+    def finished(self, simulation_name: str) -> bool:
+        import s4l_v1.document as document
+
+        return document.AllSimulations[simulation_name].HasResults()
+
+
+class FakeClock:
+    def __init__(self):
+        """
+        Simulated time for the pipeline: it only advances by sleep and advance, so runs are
+        deterministic regardless of the load of the machine.
+        """
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        # e.g. an extraction that blocks the event loop for seconds
+        self.now += seconds
+
+    async def sleep(self, seconds: float) -> None:
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+class FakeSolver:
+    def __init__(self, solve_time: float = 2.0, failing: tuple = (), clock=time.perf_counter):
+        """
+        Local stand-in for the solver that finishes the submitted simulations one after another.
+
+        :param solve_time: seconds each simulation takes once it reaches the front of the queue.
+        :param failing: names of simulations that never finish.
+        :param clock: the clock of the pipeline, e.g. a FakeClock.
+        """
+        self.solve_time = solve_time
+        self.failing = set(failing)
+        self.clock = clock
+        self._done_at = {}
+
+    def submit(self, simulation_name: str) -> None:
+        if simulation_name in self.failing:
+            return
+        start = max([self.clock()] + list(self._done_at.values()))
+        self._done_at[simulation_name] = start + self.solve_time
+
+    def finished(self, simulation_name: str) -> bool:
+        return self.clock() >= self._done_at.get(simulation_name, float("inf"))
+
+
+def _log(timings: dict, name: str, stage: str, seconds: float) -> None:
+    timings.setdefault(name, {})[stage] = seconds
+    print(f"[{stage}] {name}: {seconds:.1f} s")
+
+
+def _log_error(timings: dict, name: str, stage: str, seconds: float, error: Exception) -> None:
+    _log(timings, name, "error", seconds)
+    print(f"[error] {name}: {stage} failed: {error!r}")
+
+
+async def solve_stage(jobs: list, build, solver, queue: asyncio.Queue, timings: dict,
+                      max_submitted: int = MAX_SUBMITTED, poll_interval: float = POLL_INTERVAL,
+                      solve_timeout: float = SOLVE_TIMEOUT, clock=time.perf_counter, sleep=asyncio.sleep) -> None:
+    pending = list(enumerate(jobs))
+    running = {}
+    while pending or running:
+        while pending and len(running) < max_submitted:
+            index, job = pending.pop(0)
+            start = clock()
+            name = None
+            try:
+                name = build(job)
+                if name is None:
+                    continue
+                _log(timings, name, "build", clock() - start)
+                solver.submit(name)
+            except Exception as error:
+                _log_error(timings, name if name is not None else f"job {index}", "build", clock() - start, error)
+                continue
+            running[name] = clock()
+
+        for name in [name for name in running if solver.finished(name)]:
+            _log(timings, name, "solve", clock() - running.pop(name))
+            # blocks while the extraction is queue_size simulations behind
+            await queue.put((name, clock()))
+
+        for name in [name for name in running if clock() - running[name] > solve_timeout]:
+            _log(timings, name, "timeout", clock() - running.pop(name))
+
+        if running:
+            await sleep(poll_interval)
+    await queue.put(None)
+
+
+async def extract_stage(queue: asyncio.Queue, extract, timings: dict, clock=time.perf_counter) -> None:
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        name, finished = item
+        start = clock()
+        timings[name]["wait"] = start - finished
+        try:
+            extract(name)
+        except Exception as error:
+            _log_error(timings, name, "extract", clock() - start, error)
+        else:
+            _log(timings, name, "extract", clock() - start)
+        # lets the solve stage poll and submit between extractions
+        await asyncio.sleep(0)
+
+
+async def run_pipeline(jobs: list, build, solver, extract, queue_size: int = QUEUE_SIZE,
+                       max_submitted: int = MAX_SUBMITTED, poll_interval: float = POLL_INTERVAL,
+                       solve_timeout: float = SOLVE_TIMEOUT, clock=time.perf_counter, sleep=asyncio.sleep) -> dict:
+    """
+    Runs the solve and extract stages concurrently.
+
+    :param jobs: one entry per simulation, passed to build.
+    :param build: callable that creates the simulation of a job and returns its name, or None when
+        there is nothing to solve (e.g. the results were restored from the cache).
+    :param solver: object with submit(name) and finished(name), e.g. Sim4LifeSolver or FakeSolver.
+    :param extract: callable that extracts and exports the results of a finished simulation.
+    :param solve_timeout: seconds from submission after which a simulation without results is given
+        up and not extracted.
+    :param clock: callable returning the time in seconds, time.perf_counter or a FakeClock.
+    :param sleep: coroutine function waiting between solver polls, asyncio.sleep or FakeClock.sleep.
+    :return: dict of simulation name to the seconds spent per stage (build, solve, wait, extract). Solve
+        counts from submission, so it includes the time spent waiting in the solver queue. Simulations
+        that timed out have a timeout entry instead of solve, and simulations whose build, submission
+        or extraction raised an error entry, see failed_simulations. A job that raised before its
+        simulation had a name is logged as "job <index in jobs>".
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    timings = {}
+    start = clock()
+    await asyncio.gather(solve_stage(jobs, build, solver, queue, timings, max_submitted, poll_interval,
+                                     solve_timeout, clock, sleep),
+                         extract_stage(queue, extract, timings, clock))
+    failed = failed_simulations(timings)
+    print(f"Pipeline finished {len(timings) - len(failed)} simulations in {clock() - start:.1f} s")
+    if failed:
+        print("Failed (timed out or raised): " + ", ".join(failed))
+    return timings
+
+
+def failed_simulations(timings: dict) -> list:
+    return [name for name, stages in timings.items() if "timeout" in stages or "error" in stages]
+
+
+def run_simulations(jobs: list, normalized_power: float = 8.0, relative_path: str = "EXPORTS",
+                    cache=None, batch_export: bool = False, **options) -> dict:
+    """
+    Solves and extracts a queue of multiport simulations in Sim4Life.
+
+    :param jobs: keyword arguments of simulate.multiport_sim per simulation. Every job exports into
+        its own folder, relative_path/<simulation name>.
+    :param cache: optional result_cache.ResultCache, cached simulations are restored and not solved.
+    :param batch_export: use simulate.export_singleports instead of extract_singleports.
+    """
+    import simulate
+
+    def build(job):
+        name = simulate.simulation_name(job["array"], job.get("frequency", 298))
+        key = simulate.multiport_sim(cache=cache, relative_path=f"{relative_path}\\{name}", **job)
+        if cache is not None and cache.restored(name) == key:
+            return None
+        return name
+
+    def extract(name):
+        simulate.extract_multiport(simulation_name=name, normalized_power=normalized_power)
+        export = simulate.export_singleports if batch_export else simulate.extract_singleports
+        export(simulation_name=name, relative_path=f"{relative_path}\\{name}", cache=cache)
+
+    return asyncio.run(run_pipeline(jobs, build, Sim4LifeSolver(), extract, **options))
+
+
+# if-statement to only run the fake solver demonstration when this file is run directly
+if __name__ == "__main__":
+    N_JOBS = 4
+    SOLVE_TIME = 2.0
+    EXTRACT_TIME = 1.0
+
+    jobs = [f"variant {i}" for i in range(N_JOBS)]
+    timings = asyncio.run(run_pipeline(jobs, build=lambda job: job, solver=FakeSolver(SOLVE_TIME),
+                                       extract=lambda name: time.sleep(EXTRACT_TIME), poll_interval=0.1))
+    print(f"Sequential: {N_JOBS * (SOLVE_TIME + EXTRACT_TIME):.1f} s")
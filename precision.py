@@ -0,0 +1,70 @@
+"""
+Validation of the single precision (complex64) analysis mode against double precision.
+
+The field store holds complex64 and every loader, combiner and metric keeps complex64 fields in
+single precision, summing in float64 only where a reduction needs it. precision_report runs the
+metrics, the CoV gradient and a phase optimisation on the same fields in both precisions and
+reports the differences, so the single precision mode can be checked on a given data set.
+"""
+import numpy as np
+
+import metrics
+from shimming import START_PHASES, cov_and_gradient, field_matrix, optimise_phases, phases_scorer
+
+
+def _as_precision(fields, dtype):
+    return fields.astype(dtype) if hasattr(fields, "astype") else np.asarray(fields, dtype=dtype)
+
+
+def _difference(double: float, single: float) -> dict:
+    return {"double": double, "single": single, "relative_difference": abs(single - double) / abs(double)}
+
+
+def precision_report(fields, phases=START_PHASES, optimise: bool = True) -> dict:
+    """
+    Differences between the complex64 and complex128 evaluation of the same fields.
+
+    :param fields: (voxels x channels) matrix or masked_field.MaskedField, in either precision.
+    :param optimise: also compare phase optimisations started from phases, by the CoV their
+        optimised phases give on the double precision fields.
+    :return: dict of quantity to a dict with the double and single precision value and their
+        relative difference. The gradient is compared by norm, its relative difference is that
+        of the gradient vector.
+    """
+    double = _as_precision(fields, np.complex128)
+    single = _as_precision(fields, np.complex64)
+
+    report = {}
+    double_metrics = metrics.field_metrics(double, phases)
+    single_metrics = metrics.field_metrics(single, phases)
+    for name in double_metrics:
+        if name != "n_voxels":
+            report[name] = _difference(double_metrics[name], single_metrics[name])
+
+    double_gradient = cov_and_gradient(phases, double)[1]
+    single_gradient = cov_and_gradient(phases, single)[1]
+    report["gradient"] = {"double": np.linalg.norm(double_gradient), "single": np.linalg.norm(single_gradient),
+                          "relative_difference": (np.linalg.norm(single_gradient - double_gradient)
+                                                  / np.linalg.norm(double_gradient))}
+
+    if optimise:
+        double_phases, double_cov = optimise_phases(double, phases)
+        single_phases, _ = optimise_phases(single, phases)
+        report["optimised_cov"] = _difference(double_cov, phases_scorer(single_phases, double))
+
+    report["memory_bytes"] = _difference(field_matrix(double).nbytes, field_matrix(single).nbytes)
+    return report
+
+
+def print_report(report: dict) -> None:
+    for name, row in report.items():
+        print(f"{name:16s} double {row['double']:e}  single {row['single']:e}  "
+              f"relative difference {row['relative_difference']:.2e}")
+
+
+# if-statement to only perform the validation when this file is run directly
+if __name__ == "__main__":
+    import shimming
+
+    b1_plus_fields = shimming.initialise_fields_matrix(shimming.FILES, shimming.CENTER_SLICE, dtype=np.complex64)
+    print_report(precision_report(b1_plus_fields))
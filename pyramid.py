@@ -0,0 +1,173 @@
+"""
+Coarse-to-fine phase optimisation on a multiresolution pyramid of the per-port fields.
+
+build_pyramid downsamples the field store by 2, 4 and 8 per axis in a single pass over its
+z-slices. Every coarse voxel is the mean of the tissue voxels in its block, and it only counts as
+tissue when at least min_fill of the block is tissue, so the pyramid follows the mask instead of
+smearing NaN. Each level is written as a field store in a subdirectory of the original one, or
+next to the HDF5 file of a field_store.ContainerStore.
+coarse_to_fine_optimise converges on the coarsest level first and refines on every finer level,
+starting from the phases of the level below, so most iterations run on 1/512 to 1/64 of the voxels.
+"""
+import os
+import numpy as np
+
+import field_store
+from masked_field import MaskedField
+from shimming import cov_and_gradient, optimise_phases, phases_scorer, wrap_phases
+
+
+FACTORS = (2, 4, 8)
+MIN_FILL = 0.5  # fraction of a block that must be tissue for the coarse voxel to be tissue
+CHUNK_BLOCKS = 2  # blocks of every level read per pass
+MIN_VOXELS = 100  # coarser levels with fewer tissue voxels are skipped
+
+
+def level_path(store_path: str, factor: int) -> str:
+    # the path of a ContainerStore is its .h5 file, its levels are directories next to it
+    if os.path.isfile(store_path):
+        return f"{os.path.splitext(store_path)[0]}_pyramid_{factor}"
+    return os.path.join(store_path, f"pyramid_{factor}")
+
+
+def _fields_file(store) -> str:
+    # file whose modification time is that of the fields of a FieldStore or ContainerStore
+    return store.path if os.path.isfile(store.path) else os.path.join(store.path, field_store.FIELDS_FILE)
+
+
+def _block_mean(chunk: np.ndarray, factor: int, min_fill: float) -> np.ndarray:
+    # mean of the non-NaN voxels of every factor^3 block of a (channel, x, y, z) chunk
+    n_channels = chunk.shape[0]
+    padded_shape = [n_channels] + [-(-n // factor) * factor for n in chunk.shape[1:]]
+    padded = np.full(padded_shape, np.nan, dtype=chunk.dtype)
+    padded[:, :chunk.shape[1], :chunk.shape[2], :chunk.shape[3]] = chunk
+
+    blocks = padded.reshape(n_channels, padded_shape[1] // factor, factor, padded_shape[2] // factor, factor,
+                            padded_shape[3] // factor, factor)
+    valid = ~np.isnan(blocks)
+    count = valid[0].sum(axis=(1, 3, 5))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, blocks, 0).sum(axis=(2, 4, 6)) / count
+    mean[:, count < min_fill * factor**3] = np.nan
+    return mean.astype(chunk.dtype)
+
+
+def _coarse_axis(axis: np.ndarray, factor: int) -> np.ndarray:
+    # midpoint of every block, averaged over the voxels the block actually contains
+    return np.array([axis[i:i + factor].mean() for i in range(0, axis.size, factor)])
+
+
+def build_pyramid(store, factors=FACTORS, min_fill: float = MIN_FILL) -> None:
+    """
+    Writes the downsampled levels of a field_store.FieldStore or ContainerStore next to it.
+    """
+    n_z = store.shape[2]
+    levels = {}
+    for factor in factors:
+        path = level_path(store.path, factor)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        shape = (store.n_channels,) + tuple(-(-n // factor) for n in store.shape)
+        levels[factor] = np.lib.format.open_memmap(os.path.join(path, field_store.FIELDS_FILE), mode="w+",
+                                                   dtype=np.complex64, shape=shape, fortran_order=True)
+
+    chunk_slices = int(np.lcm.reduce(factors)) * CHUNK_BLOCKS
+    for start in range(0, n_z, chunk_slices):
+        chunk = np.asarray(store.slab(start, min(start + chunk_slices, n_z)))
+        for factor in factors:
+            coarse = _block_mean(chunk, factor, min_fill)
+            levels[factor][:, :, :, start // factor:start // factor + coarse.shape[3]] = coarse
+
+    for factor in factors:
+        levels[factor].flush()
+        axes = [_coarse_axis(axis, factor) for axis in store.axes]
+        np.savez(os.path.join(level_path(store.path, factor), field_store.AXES_FILE),
+                 x=axes[0], y=axes[1], z=axes[2], files=np.array(store.files))
+        print(f"Stored: pyramid level {factor} with shape {levels[factor].shape[1:]}")
+    del levels
+
+
+def open_pyramid(store, factors=FACTORS, min_fill: float = MIN_FILL) -> dict:
+    """
+    Opens the pyramid levels of a field store, building them if missing or older than the store.
+
+    :return: dict of factor to field_store.FieldStore, including the store itself as factor 1.
+    """
+    stored = os.path.getmtime(_fields_file(store))
+    for factor in factors:
+        fields_path = os.path.join(level_path(store.path, factor), field_store.FIELDS_FILE)
+        axes_path = os.path.join(level_path(store.path, factor), field_store.AXES_FILE)
+        if not (os.path.exists(axes_path) and os.path.exists(fields_path) and os.path.getmtime(fields_path) >= stored):
+            build_pyramid(store, factors, min_fill)
+            break
+
+    levels = {1: store}
+    for factor in factors:
+        levels[factor] = field_store.FieldStore(level_path(store.path, factor))
+    return levels
+
+
+def level_fields(levels: dict, roi=None) -> dict:
+    """
+    Masked fields of every pyramid level, restricted to the same physical roi.ROI if given. A level
+    may have no voxels when the ROI is thinner than its voxels, coarse_to_fine_optimise skips it.
+    """
+    fields = {}
+    for factor, store in levels.items():
+        fields[factor] = roi.from_store(store) if roi is not None else MaskedField.from_store(store)
+    return fields
+
+
+def coarse_to_fine_optimise(fields: dict, start_phases, objective=cov_and_gradient, min_voxels: int = MIN_VOXELS,
+                            **options) -> tuple:
+    """
+    Optimises the phases level by level, from the largest factor down to the finest. Coarse levels
+    with fewer than min_voxels voxels would overfit the phases and are skipped, as are empty levels.
+
+    :param fields: dict of factor to the fields of that level, e.g. from level_fields.
+    :return: tuple of the phases in degrees and a list with per level the factor, voxel count,
+        objective evaluations, CoV of the starting phases (the optimum of the coarser level) and the
+        optimised CoV.
+    """
+    phases = np.asarray(start_phases, dtype=float)
+    report = []
+    finest = min(fields)
+    if fields[finest].n_voxels == 0:
+        raise ValueError("the finest level has no voxels to optimise")
+    for factor in sorted(fields, reverse=True):
+        if factor != finest and fields[factor].n_voxels < max(min_voxels, 1):
+            continue
+        evaluations = []
+
+        def counted(p, f):
+            evaluations.append(1)
+            return objective(p, f)
+
+        start_cov = phases_scorer(phases, fields[factor])
+        phases, score = optimise_phases(fields[factor], phases, objective=counted, **options)
+        report.append({"factor": factor,
+                       "n_voxels": fields[factor].n_voxels,
+                       "evaluations": len(evaluations),
+                       "start_cov": start_cov,
+                       "cov": score})
+        print(f"Level {factor}: {fields[factor].n_voxels} voxels, {len(evaluations)} evaluations, "
+              f"COV {start_cov:f} -> {score:f}")
+    return wrap_phases(phases), report
+
+
+# if-statement to only perform optimisation when this file is run directly
+if __name__ == "__main__":
+    import shimming
+    from roi import Box
+
+    STORE_PATH = "FIELD_STORE"
+
+    store = field_store.open_store(shimming.FILES, STORE_PATH)
+    levels = open_pyramid(store)
+    slab = Box.from_slices(store.axes, shimming.CENTER_SLICE, shimming.HALF_WIDTH)
+    optimised_phases, report = coarse_to_fine_optimise(level_fields(levels, slab), shimming.START_PHASES)
+
+    print("Phases: " + " ".join(f"{p:f}" for p in optimised_phases))
+    for previous, level in zip(report, report[1:]):
+        print(f"COV change from level {previous['factor']} to {level['factor']}: "
+              f"{level['start_cov'] - previous['cov']:+f}")
@@ -0,0 +1,148 @@
+"""
+Content-addressed cache of solved simulation results.
+
+simulate.multiport_sim hashes everything that determines a solve (array layout, dipole parameters,
+phantom scale and material, padding, grid settings, frequency and simulation time) into a key.
+When a key is in the cache, its exported per-port fields are restored instead of queuing a new
+solve and the simulation is recorded as restored, so there is nothing to extract; otherwise the
+key is remembered for the simulation so simulate.extract_singleports can store the exports once
+they exist. The cache is bounded in size and evicts the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+CACHE_DIR = "SIMULATION_CACHE"
+CACHE_SIZE_LIMIT = 20 * 1024**3  # bytes
+INDEX_FILE = "index.json"
+
+
+def _canonical(value):
+    # rounds floats and converts numpy types so equal parameters always serialise identically
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if hasattr(value, "tolist"):
+        return _canonical(value.tolist())
+    if isinstance(value, float):
+        return round(value, 9)
+    return value
+
+
+def simulation_key(parameters: dict) -> str:
+    text = json.dumps(_canonical(parameters), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, size_limit: int = CACHE_SIZE_LIMIT):
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                index = json.load(file)
+            index.setdefault("restored", {})
+            return index
+        return {"entries": {}, "pending": {}, "restored": {}}
+
+    def _save_index(self) -> None:
+        with open(self.index_path, "w") as file:
+            json.dump(self.index, file, indent=2)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key: str):
+        """
+        :return: the cached entry, a dict with its parameters, files and size, or None when it is
+            missing or any of its files was removed.
+        """
+        entry = self.index["entries"].get(key)
+        if entry is None or not all(os.path.isfile(os.path.join(self.entry_path(key), file_name))
+                                    for file_name in entry["files"]):
+            return None
+        entry["last_used"] = time.time()
+        self._save_index()
+        return entry
+
+    def register_pending(self, simulation_name: str, key: str, parameters: dict) -> None:
+        # remembers which key a newly created simulation belongs to until its results are stored
+        self.index["pending"][simulation_name] = {"key": key, "parameters": _canonical(parameters)}
+        self.index["restored"].pop(simulation_name, None)
+        self._save_index()
+
+    def pending(self, simulation_name: str):
+        return self.index["pending"].get(simulation_name)
+
+    def register_restored(self, simulation_name: str, key: str) -> None:
+        # remembers that the results of simulation_name were restored, so no simulation exists to extract
+        self.index["restored"][simulation_name] = key
+        self.index["pending"].pop(simulation_name, None)
+        self._save_index()
+
+    def restored(self, simulation_name: str):
+        # cache key of the restored results of simulation_name, or None when it was built
+        return self.index["restored"].get(simulation_name)
+
+    def store(self, key: str, files: list, parameters: dict) -> None:
+        """
+        Copies result files into the cache under key, evicting old entries to stay within the size limit.
+        """
+        path = self.entry_path(key)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        size = 0
+        for file_name in files:
+            shutil.copy2(file_name, path)
+            size += os.path.getsize(file_name)
+
+        self.index["entries"][key] = {"parameters": _canonical(parameters),
+                                      "files": [os.path.basename(f) for f in files],
+                                      "size": size,
+                                      "last_used": time.time()}
+        self.index["pending"] = {name: pending for name, pending in self.index["pending"].items()
+                                 if pending["key"] != key}
+        self.evict(keep=key)
+        self._save_index()
+
+    def restore(self, key: str, destination: str) -> list:
+        """
+        Copies the cached files of key into destination.
+
+        :return: paths of the restored files.
+        """
+        entry = self.lookup(key)
+        if entry is None:
+            raise KeyError(key)
+        if not os.path.exists(destination):
+            os.makedirs(destination)
+        restored = []
+        for file_name in entry["files"]:
+            restored.append(shutil.copy2(os.path.join(self.entry_path(key), file_name), destination))
+        return restored
+
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self.index["entries"].values())
+
+    def evict(self, keep: str = None) -> None:
+        entries = self.index["entries"]
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if self.size() <= self.size_limit:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            del entries[key]
+            print(f"Evicted cached results: {key}")
+        self._save_index()
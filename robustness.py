@@ -0,0 +1,167 @@
+"""
+Robustness of a shim against the phase (and amplitude) errors of the transmit hardware.
+
+phase_optimiser.m keeps several "experimentally successful" phase sets a few degrees apart, as the
+phases applied on the scanner are never exact. jitter_analysis draws thousands of jittered weight
+vectors around a shim and evaluates them all with batched (voxels x channels) x (channels x K)
+products, giving the distribution of CoV and mean |B1+|. robust_cov_and_gradient is the expected
+CoV under jitter, estimated on a fixed set of jitter samples so it is smooth and can be minimised
+with shimming.optimise_phases.
+"""
+import numpy as np
+
+from field_combiner import channel_weights
+from shimming import (START_PHASES, accumulate_product, field_matrix, match_precision, optimise_phases,
+                      phase_weights, wrap_phases)
+
+
+PHASE_STD = 3.0  # degrees
+N_SAMPLES = 2000  # jittered shims per analysis
+N_ROBUST_SAMPLES = 32  # jitter samples of the robust objective
+MAX_ELEMENTS = 2**22  # voxels x samples combined at once, bounds the temporary memory
+
+
+def jittered_weights(weights, n_samples: int = N_SAMPLES, phase_std: float = PHASE_STD,
+                     amplitude_std: float = 0.0, seed=None) -> np.ndarray:
+    """
+    Complex weights with normally distributed phase errors and relative amplitude errors.
+
+    :param weights: nominal complex channel weights, see field_combiner.channel_weights.
+    :param phase_std: standard deviation of the phase error in degrees.
+    :param amplitude_std: standard deviation of the relative amplitude error.
+    :return: (n_samples x channels) array of jittered weights.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.asarray(weights, dtype=complex)
+    jitter = phase_weights(rng.normal(0, phase_std, (n_samples, weights.size)))
+    if amplitude_std:
+        jitter = jitter * np.clip(1 + rng.normal(0, amplitude_std, (n_samples, weights.size)), 0, None)
+    return weights * jitter
+
+
+def batch_cov_and_strength(fields, weight_population, max_elements: int = MAX_ELEMENTS) -> tuple:
+    """
+    CoV and mean |B1+| of many weight vectors, in batches of samples that keep the combined
+    (voxels x samples) block below max_elements.
+
+    :param weight_population: (K x channels) complex weights.
+    :return: tuple of arrays with the K CoV values and the K mean |B1+| values.
+    """
+    fields = field_matrix(fields)
+    weight_population = match_precision(weight_population, fields)
+    batch = max(1, max_elements // fields.shape[0])
+    covs = np.empty(len(weight_population))
+    means = np.empty(len(weight_population))
+    for start in range(0, len(weight_population), batch):
+        magnitude = np.abs(fields @ weight_population[start:start + batch].T)
+        means[start:start + batch] = magnitude.mean(axis=0, dtype=np.float64)
+        covs[start:start + batch] = magnitude.std(axis=0, ddof=1, dtype=np.float64) / means[start:start + batch]
+    return covs, means
+
+
+class JitterResult:
+    def __init__(self, covs: np.ndarray, means: np.ndarray, nominal_cov: float, nominal_mean: float):
+        self.covs = covs
+        self.means = means
+        self.nominal_cov = nominal_cov
+        self.nominal_mean = nominal_mean
+
+    @property
+    def expected_cov(self) -> float:
+        return self.covs.mean()
+
+    def cov_percentiles(self, q=(5, 50, 95)) -> np.ndarray:
+        return np.percentile(self.covs, q)
+
+    def mean_percentiles(self, q=(5, 50, 95)) -> np.ndarray:
+        return np.percentile(self.means, q)
+
+    def summary(self) -> str:
+        covs = " ".join(f"{c:f}" for c in self.cov_percentiles())
+        means = " ".join(f"{m:e}" for m in self.mean_percentiles())
+        return (f"COV nominal {self.nominal_cov:f}, expected {self.expected_cov:f}, 5/50/95% {covs}\n"
+                f"Mean (Tesla) nominal {self.nominal_mean:e}, 5/50/95% {means}")
+
+
+def jitter_analysis(fields, weights, n_samples: int = N_SAMPLES, phase_std: float = PHASE_STD,
+                    amplitude_std: float = 0.0, seed=None) -> JitterResult:
+    """
+    Distribution of CoV and mean |B1+| of a shim under hardware phase and amplitude errors.
+    """
+    population = jittered_weights(weights, n_samples, phase_std, amplitude_std, seed)
+    covs, means = batch_cov_and_strength(fields, population)
+    nominal_cov, nominal_mean = batch_cov_and_strength(fields, np.asarray(weights, dtype=complex)[None])
+    return JitterResult(covs, means, nominal_cov[0], nominal_mean[0])
+
+
+def _robust_batch(fields: np.ndarray, weights: np.ndarray) -> tuple:
+    # sums of the CoV and of its gradient over a batch of weight vectors, one column per sample
+    b1_plus = fields @ match_precision(weights.T, fields)
+    magnitude = np.abs(b1_plus)
+    n = magnitude.shape[0]
+
+    # batched weights_cov_and_gradient
+    mean = magnitude.mean(axis=0, dtype=np.float64)
+    deviation = magnitude - mean.astype(magnitude.dtype)
+    std = np.sqrt(np.sum(np.square(deviation), axis=0, dtype=np.float64) / (n - 1))
+    alpha = (1 / ((n - 1) * std * mean)).astype(magnitude.dtype)
+    beta = (std / (mean**2 * n)).astype(magnitude.dtype)
+    d_magnitude = deviation * alpha - beta
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d_b1_plus = np.where(magnitude > 0, d_magnitude / magnitude, 0) * np.conj(b1_plus)
+    gradients = -np.imag(weights * accumulate_product(d_b1_plus.T, fields)) * np.pi / 180
+    return np.sum(std / mean), gradients.sum(axis=0)
+
+
+def robust_cov_and_gradient(phases, fields, jitter, max_elements: int = MAX_ELEMENTS):
+    """
+    Mean CoV of |B1+| over the jittered phases phases + jitter, and its gradient in degrees.
+
+    The samples are evaluated in batches that keep the (voxels x samples) temporaries below
+    max_elements, like batch_cov_and_strength, accumulating the CoV and gradient sums.
+
+    :param jitter: (K x channels) fixed phase errors in degrees.
+    """
+    fields = field_matrix(fields)
+    weights = phase_weights(np.asarray(phases, dtype=float) + jitter)
+    batch = max(1, max_elements // fields.shape[0])
+    cov_sum = 0.0
+    gradient_sum = np.zeros(weights.shape[1])
+    for start in range(0, len(weights), batch):
+        cov, gradient = _robust_batch(fields, weights[start:start + batch])
+        cov_sum += cov
+        gradient_sum += gradient
+    return cov_sum / len(weights), gradient_sum / len(weights)
+
+
+def optimise_robust_phases(fields, start_phases=START_PHASES, phase_std: float = PHASE_STD,
+                           n_samples: int = N_ROBUST_SAMPLES, seed: int = 0, **options) -> tuple:
+    """
+    Phases that minimise the expected CoV under phase errors with standard deviation phase_std.
+
+    :return: tuple of the phases in degrees and the expected CoV on the jitter samples.
+    """
+    jitter = np.random.default_rng(seed).normal(0, phase_std, (n_samples, len(start_phases)))
+    phases, score = optimise_phases(fields, start_phases,
+                                    objective=lambda p, f: robust_cov_and_gradient(p, f, jitter), **options)
+    return wrap_phases(phases), score
+
+
+# if-statement to only perform the analysis when this file is run directly
+if __name__ == "__main__":
+    import shimming
+
+    EXPERIMENTAL_PHASES = [[-85, -124, -185, 134, 95, 56, -5, -46],
+                           [-83, -126, -187, 136, 97, 54, -7, -48]]
+
+    b1_plus_fields = shimming.initialise_fields_matrix(shimming.FILES, shimming.CENTER_SLICE)
+    optimised_phases, _ = optimise_phases(b1_plus_fields, START_PHASES)
+    robust_phases, _ = optimise_robust_phases(b1_plus_fields, optimised_phases)
+
+    for name, phases in [("QUADRATURE", START_PHASES), ("EXPERIMENTAL", EXPERIMENTAL_PHASES[0]),
+                         ("EXPERIMENTAL", EXPERIMENTAL_PHASES[1]), ("OPTIMISED", optimised_phases),
+                         ("ROBUST", robust_phases)]:
+        result = jitter_analysis(b1_plus_fields, channel_weights(phases), seed=0)
+        print(f"{name} ({PHASE_STD} degrees jitter)")
+        print("Phases: " + " ".join(f"{p:f}" for p in phases))
+        print(result.summary() + "\n")
@@ -0,0 +1,161 @@
+"""
+Regions of interest in physical coordinates, shared by metrics, optimisers and plots.
+
+calcMSE_plotstrengthvsMSE.m selects a box with find calls on the axes for every file and
+phase_optimiser.m scores a window of slices around center_slice. An ROI is instead defined in the
+units of the export axes (a box, a sphere or a set of tissue labels) and mapped onto a grid by
+binary search on its axis midpoints, so it keeps its physical size at any grid resolution. The
+resulting column-major voxel indices are cached per grid hash, so every export on the same grid
+reuses them.
+"""
+import hashlib
+import numpy as np
+
+from masked_field import MaskedField
+
+
+def grid_hash(axes: list) -> str:
+    digest = hashlib.sha1()
+    for axis in axes:
+        axis = np.ascontiguousarray(axis, dtype=np.float64)
+        digest.update(str(axis.size).encode())
+        digest.update(axis.tobytes())
+    return digest.hexdigest()
+
+
+def _linear_indices(x, y, z, grid_shape: tuple) -> np.ndarray:
+    # column-major linear indices of the block x * y * z, in ascending order
+    n_x, n_y, _ = grid_shape
+    return (x[:, None, None] + n_x * (y[None, :, None] + n_y * z[None, None, :])).ravel(order="F")
+
+
+class ROI:
+    def __init__(self):
+        self._indices = {}
+
+    def _compute(self, axes: list) -> np.ndarray:
+        raise NotImplementedError
+
+    def indices(self, axes: list) -> np.ndarray:
+        """
+        Sorted column-major linear indices of the ROI voxels on the grid with the given axis
+        midpoints. Read-only, computed once per grid.
+        """
+        key = grid_hash(axes)
+        if key not in self._indices:
+            indices = np.asarray(self._compute(axes), dtype=np.int64)
+            indices.flags.writeable = False
+            self._indices[key] = indices
+        return self._indices[key]
+
+    def mask(self, axes: list) -> np.ndarray:
+        """
+        Boolean (x, y, z) volume of the ROI, e.g. for plotting its outline.
+        """
+        grid_shape = tuple(len(axis) for axis in axes)
+        mask = np.zeros(int(np.prod(grid_shape)), dtype=bool)
+        mask[self.indices(axes)] = True
+        return mask.reshape(grid_shape, order="F")
+
+    def z_range(self, axes: list) -> tuple:
+        # z_start and z_stop of the slices the ROI touches
+        indices = self.indices(axes)
+        if indices.size == 0:
+            return 0, 0
+        slice_size = len(axes[0]) * len(axes[1])
+        return int(indices[0] // slice_size), int(indices[-1] // slice_size) + 1
+
+    def select(self, fields: MaskedField) -> MaskedField:
+        """
+        The voxels of a masked field that lie in the ROI.
+        """
+        indices = self.indices(fields.axes)
+        return fields.select(np.flatnonzero(np.isin(fields.indices, indices, assume_unique=True)))
+
+    def from_store(self, store, chunk_slices: int = 16) -> MaskedField:
+        """
+        Masked field of the ROI voxels of a field_store.FieldStore, reading only the slices it spans.
+        """
+        z_start, z_stop = self.z_range(store.axes)
+        return self.select(MaskedField.from_store(store, z_start, z_stop, chunk_slices))
+
+
+class Box(ROI):
+    def __init__(self, lower, upper):
+        """
+        Axis-aligned box, inclusive of voxels whose midpoint lies on its faces.
+
+        :param lower: (x, y, z) lower corner, use -np.inf to leave a direction unbounded.
+        :param upper: (x, y, z) upper corner, use np.inf to leave a direction unbounded.
+        """
+        super().__init__()
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+
+    @classmethod
+    def axial_slab(cls, z_center: float, half_height: float):
+        return cls([-np.inf, -np.inf, z_center - half_height], [np.inf, np.inf, z_center + half_height])
+
+    @classmethod
+    def from_slices(cls, axes: list, center_slice: int, half_width: int):
+        """
+        Axial slab with the physical extent of the slices center_slice +- half_width of a grid, the
+        ROI of phase_optimiser.m. On other grids it covers the same height rather than slice count.
+        """
+        z = axes[2]
+        return cls([-np.inf, -np.inf, z[center_slice - half_width]], [np.inf, np.inf, z[center_slice + half_width]])
+
+    def ranges(self, axes: list) -> list:
+        # index ranges [start, stop) per axis, the axis midpoints are ascending
+        return [(np.searchsorted(axis, low, "left"), np.searchsorted(axis, high, "right"))
+                for axis, low, high in zip(axes, self.lower, self.upper)]
+
+    def _compute(self, axes: list) -> np.ndarray:
+        x, y, z = (np.arange(start, stop) for start, stop in self.ranges(axes))
+        return _linear_indices(x, y, z, tuple(len(axis) for axis in axes))
+
+
+class Sphere(ROI):
+    def __init__(self, center, radius: float):
+        super().__init__()
+        self.center = np.asarray(center, dtype=float)
+        self.radius = float(radius)
+
+    def _compute(self, axes: list) -> np.ndarray:
+        box = Box(self.center - self.radius, self.center + self.radius)
+        x, y, z = (np.arange(start, stop) for start, stop in box.ranges(axes))
+        distance = ((axes[0][x, None, None] - self.center[0])**2
+                    + (axes[1][None, y, None] - self.center[1])**2
+                    + (axes[2][None, None, z] - self.center[2])**2)
+        inside = (distance <= self.radius**2).ravel(order="F")
+        return _linear_indices(x, y, z, tuple(len(axis) for axis in axes))[inside]
+
+
+class LabelMask(ROI):
+    def __init__(self, label_volume: np.ndarray, label_axes: list, labels):
+        """
+        Tissues selected from a label volume, e.g. a voxelled Duke model.
+
+        :param label_volume: (x, y, z) integer tissue labels.
+        :param label_axes: axis midpoints of the label volume, which can differ from the export grid.
+        :param labels: label values that belong to the ROI.
+        """
+        super().__init__()
+        self.label_volume = np.asarray(label_volume)
+        self.label_axes = [np.asarray(axis, dtype=float) for axis in label_axes]
+        self.labels = np.asarray(list(labels))
+
+    def _compute(self, axes: list) -> np.ndarray:
+        # nearest label voxel of every grid midpoint, found by binary search on the label voxel edges
+        lookups = []
+        for axis, label_axis in zip(axes, self.label_axes):
+            edges = np.concatenate([[1.5 * label_axis[0] - 0.5 * label_axis[1]],
+                                    (label_axis[:-1] + label_axis[1:]) / 2,
+                                    [1.5 * label_axis[-1] - 0.5 * label_axis[-2]]])
+            index = np.searchsorted(edges, axis, "right") - 1
+            inside = (index >= 0) & (index < label_axis.size)
+            lookups.append((np.flatnonzero(inside), index[inside]))
+
+        (x, label_x), (y, label_y), (z, label_z) = lookups
+        selected = np.isin(self.label_volume[np.ix_(label_x, label_y, label_z)], self.labels)
+        return _linear_indices(x, y, z, tuple(len(axis) for axis in axes))[selected.ravel(order="F")]
@@ -0,0 +1,358 @@
+"""
+Phase shimming of the per-port B1+ fields exported by simulate.extract_singleports.
+
+Python counterpart of phase_optimiser.m. The exports are loaded once into a contiguous
+(voxels x channels) complex matrix, so combining the channels for a set of phases is a single
+matrix-vector product and the CoV objective comes with an analytic gradient.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from scipy.io import loadmat
+from scipy.optimize import differential_evolution, minimize
+
+
+FILES = [f"sensor_{i}.mat" for i in range(8)]
+CENTER_SLICE = 224  # zero-based, slice 225 in phase_optimiser.m
+HALF_WIDTH = 10  # slices on either side of the center slice for which homogeneity is scored
+START_PHASES = [-90, -129, -180, 129, 90, 51, 0, -51]  # quadrature phases in degrees
+N_RESTARTS = 8  # independent global optimisations for multistart_optimise_phases
+TOTAL_POWER = 8.0  # forward power budget in watts, NORMALIZED_POWER in analysis_controls.py
+ACCUMULATE_CHUNK = 65536  # voxels per partial sum of single precision products
+
+
+def axis_midpoints(axis) -> np.ndarray:
+    axis = np.ravel(axis)
+    return (axis[:-1] + axis[1:]) / 2
+
+
+def load_b1_plus(file_name: str):
+    """
+    Loads the B1+ component of a single MatlabExporter file.
+
+    :param file_name: path to a sensor_<i>.mat file.
+    :return: tuple of the B1+ volume (x, y, z) and the list of its three axis midpoints.
+    """
+    data = loadmat(file_name)
+    axes = [axis_midpoints(data[f"Axis{i}"]) for i in range(3)]
+    # MATLAB stores the snapshot in column-major order
+    b1_plus = data["Snapshot0"][:, 0].reshape([len(axis) for axis in axes], order="F")
+    return b1_plus, axes
+
+
+def initialise_fields_matrix(files: list, center_slice: int, half_width: int = HALF_WIDTH,
+                             dtype=np.complex128) -> np.ndarray:
+    """
+    Builds the (voxels x channels) field matrix of the slab center_slice +- half_width.
+
+    Voxels that are NaN in any channel (masked out during export) are dropped, which matches the
+    omitnan behaviour of the MATLAB homogeneity functions.
+
+    :param dtype: np.complex64 halves the memory of the matrix, every function in this module keeps
+        single precision fields in single precision and only accumulates sums in double precision.
+    """
+    slab = slice(center_slice - half_width, center_slice + half_width + 1)
+    columns = []
+    for file_name in files:
+        b1_plus, _ = load_b1_plus(file_name)
+        columns.append(b1_plus[:, :, slab].ravel(order="F"))
+        del b1_plus
+
+    fields = np.empty((columns[0].size, len(columns)), dtype=dtype)
+    for i, column in enumerate(columns):
+        fields[:, i] = column
+
+    valid = ~np.isnan(fields).any(axis=1)
+    return np.ascontiguousarray(fields[valid])
+
+
+def field_matrix(fields) -> np.ndarray:
+    # accepts a plain (voxels x channels) array or a masked_field.MaskedField
+    return getattr(fields, "values", fields)
+
+
+def phase_weights(phases) -> np.ndarray:
+    return np.exp(1j * np.deg2rad(np.asarray(phases, dtype=float)))
+
+
+def match_precision(weights, fields: np.ndarray) -> np.ndarray:
+    # complex64 fields are combined with complex64 weights, so the field matrix is never upcast
+    weights = np.asarray(weights)
+    return weights.astype(np.complex64) if fields.dtype == np.complex64 else weights
+
+
+def accumulate_product(left: np.ndarray, fields: np.ndarray, chunk_size: int = ACCUMULATE_CHUNK) -> np.ndarray:
+    """
+    left @ fields, reducing over the voxels. For complex64 fields the single precision products of
+    chunks of voxels are summed in double precision.
+    """
+    if fields.dtype != np.complex64:
+        return left @ fields
+    total = 0
+    for start in range(0, fields.shape[0], chunk_size):
+        chunk = left[..., start:start + chunk_size].astype(np.complex64, copy=False)
+        total = total + (chunk @ fields[start:start + chunk_size]).astype(np.complex128)
+    return total
+
+
+def combine(fields, phases) -> np.ndarray:
+    fields = field_matrix(fields)
+    return fields @ match_precision(phase_weights(phases), fields)
+
+
+def cov(magnitude: np.ndarray) -> float:
+    return np.std(magnitude, ddof=1, dtype=np.float64) / np.mean(magnitude, dtype=np.float64)
+
+
+def mean_strength(fields, phases) -> float:
+    return np.mean(np.abs(combine(fields, phases)), dtype=np.float64)
+
+
+def weights_cov_and_gradient(fields: np.ndarray, weights: np.ndarray, efficiency_weight: float = 0,
+                             reference_strength: float = 1):
+    """
+    CoV of |fields @ weights|, minus an optional reward for the mean |B1+|, and its complex gradient.
+
+    :param efficiency_weight: weight of the mean |B1+| relative to reference_strength in the score.
+    :return: tuple of the score and the vector c such that d(score) = Re(c^T d(weights)).
+    """
+    b1_plus = fields @ match_precision(weights, fields)
+    magnitude = np.abs(b1_plus)
+    n = magnitude.size
+
+    # python floats keep the per-voxel arithmetic in the precision of the fields
+    reference_strength = float(reference_strength)
+    mean = float(magnitude.mean(dtype=np.float64))
+    deviation = magnitude - mean
+    std = float(np.sqrt(np.sum(np.square(deviation), dtype=np.float64) / (n - 1)))
+    score = std / mean - efficiency_weight * mean / reference_strength
+
+    # d(score)/d|B1+| per voxel, then chain through |B1+| = |fields @ w| to the weights
+    d_magnitude = (deviation / ((n - 1) * std * mean) - std / (mean**2 * n)
+                   - efficiency_weight / (n * reference_strength))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d_b1_plus = np.where(magnitude > 0, d_magnitude / magnitude, 0) * np.conj(b1_plus)
+    return score, accumulate_product(d_b1_plus, fields)
+
+
+def cov_and_gradient(phases, fields):
+    """
+    Coefficient of variation of |B1+| and its gradient with respect to the phases in degrees.
+    """
+    weights = phase_weights(phases)
+    score, d_weights = weights_cov_and_gradient(field_matrix(fields), weights)
+    return score, -np.imag(weights * d_weights) * np.pi / 180
+
+
+def batch_cov(fields, phase_population) -> np.ndarray:
+    """
+    CoV of |B1+| for a whole population of phase vectors at once.
+
+    :param phase_population: (K x channels) array of phases in degrees.
+    :return: array of K CoV values.
+    """
+    fields = field_matrix(fields)
+    magnitude = np.abs(fields @ match_precision(phase_weights(phase_population).T, fields))
+    return np.std(magnitude, axis=0, ddof=1, dtype=np.float64) / np.mean(magnitude, axis=0, dtype=np.float64)
+
+
+def wrap_phases(phases) -> np.ndarray:
+    return (np.asarray(phases, dtype=float) + 180) % 360 - 180
+
+
+def phases_scorer(phases, fields) -> float:
+    return cov(np.abs(combine(fields, phases)))
+
+
+def optimise_phases(fields, start_phases, objective=cov_and_gradient, **options):
+    """
+    Local quasi-Newton phase optimisation, the analogue of fminunc in phase_optimiser.m.
+
+    :param fields: (voxels x channels) field matrix, or whatever the objective takes instead, e.g. a
+        channel_moments.ChannelMoments for the voxel-count independent power metrics.
+    :param objective: function (phases, fields) -> (score, gradient in degrees).
+    :return: tuple of the optimised phases in degrees and the corresponding score.
+    """
+    result = minimize(objective, np.asarray(start_phases, dtype=float), args=(fields,),
+                      jac=True, method="BFGS", options=options)
+    return result.x, result.fun
+
+
+def scale_to_power(weights, total_power: float = TOTAL_POWER) -> np.ndarray:
+    # the exports are normalised to 1 W conducted power per port, so |w_i|^2 is the power of port i
+    weights = np.asarray(weights, dtype=complex)
+    return weights * np.sqrt(total_power) / np.linalg.norm(weights)
+
+
+def shim_cov_and_gradient(parameters, fields, total_power: float = TOTAL_POWER, efficiency_weight: float = 0,
+                          reference_strength: float = 1):
+    """
+    Score of complex channel weights, parametrised as real and imaginary parts that are rescaled
+    onto the total power budget, and its gradient with respect to those parameters.
+    """
+    fields = field_matrix(fields)
+    n_channels = fields.shape[1]
+    unscaled = parameters[:n_channels] + 1j * parameters[n_channels:]
+    norm = np.linalg.norm(unscaled)
+    weights = unscaled * np.sqrt(total_power) / norm
+
+    score, d_weights = weights_cov_and_gradient(fields, weights, efficiency_weight, reference_strength)
+
+    # chain through w = sqrt(P) z / |z|
+    d_unscaled = np.sqrt(total_power) / norm * (
+        d_weights - np.real(d_weights @ unscaled) / norm**2 * np.conj(unscaled))
+    return score, np.concatenate([np.real(d_unscaled), -np.imag(d_unscaled)])
+
+
+def optimise_weights(fields, start_phases=START_PHASES, start_amplitudes=None, total_power: float = TOTAL_POWER,
+                     efficiency_weight: float = 0, **options):
+    """
+    Full RF shim: optimises the amplitude and phase of every channel under the total power budget.
+
+    The CoV does not depend on the overall scale of the weights, so with the default
+    efficiency_weight of 0 the budget only sets the field strength. A positive efficiency_weight
+    trades homogeneity for mean |B1+| relative to the starting shim.
+
+    :return: tuple of the complex weights, with sum(|w|^2) equal to total_power, and the score.
+    """
+    fields = field_matrix(fields)
+    amplitudes = np.ones(fields.shape[1]) if start_amplitudes is None else np.asarray(start_amplitudes)
+    start_weights = scale_to_power(amplitudes * phase_weights(start_phases), total_power)
+    reference_strength = float(np.mean(np.abs(fields @ match_precision(start_weights, fields)), dtype=np.float64))
+
+    result = minimize(shim_cov_and_gradient, np.concatenate([np.real(start_weights), np.imag(start_weights)]),
+                      args=(fields, total_power, efficiency_weight, reference_strength),
+                      jac=True, method="BFGS", options=options)
+    n_channels = fields.shape[1]
+    weights = scale_to_power(result.x[:n_channels] + 1j * result.x[n_channels:], total_power)
+    return weights, result.fun
+
+
+def channel_settings(weights) -> tuple:
+    """
+    Splits complex weights into the amplitudes in sqrt(W) and phases in degrees taken by
+    simulate.set_phases, which converts the amplitudes to the channel powers of the combiner.
+    """
+    return np.abs(weights), np.rad2deg(np.angle(weights))
+
+
+def global_optimise_phases(fields, seed=None, popsize: int = 15, maxiter: int = 200):
+    """
+    Differential evolution over all phases followed by a gradient polish.
+
+    The first channel is kept at 0 degrees as the CoV does not depend on a common phase offset.
+    Every generation is scored with one (voxels x channels) x (channels x K) product.
+
+    :return: tuple of the optimised phases in degrees relative to the first channel and the CoV.
+    """
+    fields = field_matrix(fields)
+    n_channels = fields.shape[1]
+
+    def population_cov(relative_phases):
+        # differential_evolution passes the population as (channels - 1) x K
+        population = np.vstack([np.zeros((1, relative_phases.shape[1])), relative_phases]).T
+        return batch_cov(fields, population)
+
+    result = differential_evolution(population_cov, [(-180, 180)] * (n_channels - 1), seed=seed,
+                                    popsize=popsize, maxiter=maxiter, polish=False, vectorized=True,
+                                    updating="deferred")
+    phases, score = optimise_phases(fields, np.concatenate([[0], result.x]))
+    return wrap_phases(phases - phases[0]), score
+
+
+class MultiStartResult:
+    def __init__(self, phases: np.ndarray, covs: np.ndarray):
+        order = np.argsort(covs)
+        self.phases = phases[order]
+        self.covs = covs[order]
+        self.best_phases = self.phases[0]
+        self.best_cov = self.covs[0]
+
+    @property
+    def cov_spread(self) -> tuple:
+        return self.covs.min(), np.median(self.covs), self.covs.max()
+
+    @property
+    def phase_spread(self) -> np.ndarray:
+        # circular standard deviation per channel in degrees
+        resultant = np.abs(np.mean(phase_weights(self.phases), axis=0))
+        return np.rad2deg(np.sqrt(-2 * np.log(np.clip(resultant, 1e-12, 1))))
+
+
+_worker_memory = None
+_worker_fields = None
+
+
+def _attach_fields(memory_name: str, shape: tuple, dtype: str) -> None:
+    global _worker_memory, _worker_fields
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    _worker_fields = np.ndarray(shape, dtype=dtype, buffer=_worker_memory.buf)
+    _worker_fields.flags.writeable = False
+
+
+def _run_restart(seed: int, popsize: int, maxiter: int):
+    return global_optimise_phases(_worker_fields, seed=seed, popsize=popsize, maxiter=maxiter)
+
+
+def multistart_optimise_phases(fields, n_restarts: int = N_RESTARTS, max_workers=None,
+                               seed: int = 0, popsize: int = 15, maxiter: int = 200) -> MultiStartResult:
+    """
+    Runs independent global phase optimisations on a process pool.
+
+    The field matrix is placed in shared memory once and mapped read-only by every worker, so the
+    restarts do not each receive a pickled copy.
+    """
+    fields = field_matrix(fields)
+    memory = shared_memory.SharedMemory(create=True, size=fields.nbytes)
+    try:
+        shared_fields = np.ndarray(fields.shape, dtype=fields.dtype, buffer=memory.buf)
+        shared_fields[:] = fields
+        seeds = np.random.SeedSequence(seed).generate_state(n_restarts)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_fields,
+                                 initargs=(memory.name, fields.shape, fields.dtype.str)) as pool:
+            results = list(pool.map(_run_restart, seeds, [popsize] * n_restarts, [maxiter] * n_restarts))
+        del shared_fields
+    finally:
+        memory.close()
+        memory.unlink()
+
+    phases = np.array([result[0] for result in results])
+    covs = np.array([result[1] for result in results])
+    return MultiStartResult(phases, covs)
+
+
+# if-statement to only perform optimisation when this file is run directly
+if __name__ == "__main__":
+    b1_plus_fields = initialise_fields_matrix(FILES, CENTER_SLICE)
+
+    start_cov = phases_scorer(START_PHASES, b1_plus_fields)
+    start_mean_strength = mean_strength(b1_plus_fields, START_PHASES)
+
+    optimised_phases, optimised_cov = optimise_phases(b1_plus_fields, START_PHASES)
+    optimised_mean_strength = mean_strength(b1_plus_fields, optimised_phases)
+
+    print("STARTING STATE")
+    print("Phases: " + " ".join(f"{p:d}" for p in START_PHASES))
+    print(f"COV: {start_cov:f}")
+    print(f"Mean (Tesla): {start_mean_strength:e}\n")
+
+    print("OPTIMISED STATE")
+    print("Phases: " + " ".join(f"{p:f}" for p in optimised_phases))
+    print(f"COV: {optimised_cov:f}")
+    print(f"Mean (Tesla): {optimised_mean_strength:e}\n")
+
+    multistart = multistart_optimise_phases(b1_plus_fields)
+
+    print(f"MULTISTART ({N_RESTARTS} restarts)")
+    print("Phases: " + " ".join(f"{p:f}" for p in multistart.best_phases))
+    print("COV (min/median/max): %f %f %f" % multistart.cov_spread)
+    print("Phase spread (degrees): " + " ".join(f"{p:.1f}" for p in multistart.phase_spread))
+
+    shim_weights, shim_cov = optimise_weights(b1_plus_fields, multistart.best_phases)
+    shim_amplitudes, shim_phases = channel_settings(shim_weights)
+
+    print(f"\nRF SHIM ({TOTAL_POWER} W)")
+    print("Amplitudes: " + " ".join(f"{a:f}" for a in shim_amplitudes))
+    print("Phases: " + " ".join(f"{p:f}" for p in shim_phases))
+    print(f"COV: {shim_cov:f}")
+    print(f"Mean (Tesla): {np.mean(np.abs(b1_plus_fields @ shim_weights)):e}")
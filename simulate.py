@@ -2,24 +2,97 @@ import s4l_v1.simulation.emfdtd as emfdtd
 import s4l_v1.analysis as analysis
 import s4l_v1.document as document
 import s4l_v1.units as units
-import s4l_v1.model as model
 from s4l_v1 import Unit
 from s4l_v1.model import Vec3 as v3
 from s4l_v1 import Translation
 
 import utils
+import result_cache
 import numpy as np
+import hashlib
 import os
 
 
+VOLTAGE_OUTPUT = "EM Potential(f)"  # edge sensor outputs used for the S-matrix
+CURRENT_OUTPUT = "EM Current(f)"
+REFERENCE_IMPEDANCE = 50.0  # ohm, internal resistance of the edge ports
+EDGE_SENSOR_PREFIX = "Edge Sensor - "  # followed by the antenna name
+S_MATRIX_FILE = "s_matrix.npz"
+PHANTOM_CONDUCTIVITY = 0.552035  # S/m
+PHANTOM_PERMITTIVITY = 51.954693  # relative
+
+
+def export_path(relative_path: str) -> str:
+    # directory relative_path next to the current Sim4Life project file
+    path = document.FilePath
+    path = path.split('\\')[:-1]
+    path = "\\".join(path)
+    return path + '\\' + relative_path
+
+
+def open_result_cache() -> result_cache.ResultCache:
+    # the cache lives next to the exports, not in the working directory of the Sim4Life process
+    return result_cache.ResultCache(export_path(result_cache.CACHE_DIR))
+
+
+def simulation_parameters(array, top_padding, bottom_padding, phantom_name: str, phantom_scale: float,
+                          frequency: int, simulation_time: int, antenna_grid_max_step: float,
+                          antenna_grid_resolution: float, phantom_grid_max_step: float,
+                          phantom_grid_resolution: float, bounding_box: str) -> dict:
+    # everything that determines the solved fields of multiport_sim, hashed into its cache key
+    return {"array": {"antenna_class": type(array.antenna_list[0]).__name__ if array.antenna_list else "",
+                      "antenna_parameters": array.antenna_parameters,
+                      "width": array.width,
+                      "height": array.height,
+                      "antennas": [[antenna.x, antenna.y, antenna.angle] for antenna in array.antenna_list],
+                      "spacers": [[spacer.height, spacer.x, spacer.y, spacer.angle] for spacer in array.spacer_list]},
+            "phantom_name": phantom_name,
+            "phantom_scale": phantom_scale,
+            "phantom_material": [PHANTOM_CONDUCTIVITY, PHANTOM_PERMITTIVITY] if phantom_name else [],
+            "bounding_box": bounding_box,
+            "padding": [top_padding, bottom_padding],
+            "grid": [antenna_grid_max_step, antenna_grid_resolution, phantom_grid_max_step, phantom_grid_resolution],
+            "frequency": frequency,
+            "simulation_time": simulation_time}
+
+
+def simulation_name(array, frequency: int = 298) -> str:
+    return f"{array.name} simulation at {frequency}MHz"
+
+
 def multiport_sim(array, top_padding, bottom_padding, phantom_name: str = "",
                   frequency: int = 298, simulation_time: int = 500, cuda_kernel: bool = False,
                   antenna_grid_max_step: float = 5.0, antenna_grid_resolution: float = 0.05,
                   phantom_grid_max_step: float = 5.0, phantom_grid_resolution: float = 10.0,
-                  bounding_box: str = "") -> None:
+                  bounding_box: str = "", phantom_scale: float = 1.0, cache=None,
+                  relative_path: str = "EXPORTS"):
+    """
+    Builds the multiport simulation of an array, unless its results are already cached.
+
+    :param cache: optional result_cache.ResultCache, see open_result_cache. On a hit the cached
+        exports are restored into relative_path and no simulation is created, which is recorded in
+        the cache so analysis_controls.py skips the extraction. Otherwise the new simulation is
+        registered so extract_singleports can store its exports.
+    :return: the cache key of the simulation parameters.
+    """
+    parameters = simulation_parameters(array, top_padding, bottom_padding, phantom_name, phantom_scale,
+                                       frequency, simulation_time, antenna_grid_max_step,
+                                       antenna_grid_resolution, phantom_grid_max_step,
+                                       phantom_grid_resolution, bounding_box)
+    key = result_cache.simulation_key(parameters)
+    if cache is not None and cache.lookup(key) is not None:
+        # entries without an S-matrix must not leave the one of another simulation in place
+        s_matrix_path = export_path(relative_path) + '\\' + S_MATRIX_FILE
+        if os.path.exists(s_matrix_path):
+            os.remove(s_matrix_path)
+        restored = cache.restore(key, export_path(relative_path))
+        cache.register_restored(simulation_name(array, frequency), key)
+        print(f"Reused cached results {key[:12]}: restored {len(restored)} files to {relative_path}")
+        return key
+
     # Instantiate the simulation
     simulation = emfdtd.MultiportSimulation()
-    simulation.Name = f"{array.name} simulation at {frequency}MHz"
+    simulation.Name = simulation_name(array, frequency)
 
     # Editing SetupSettings
     setup_settings = simulation.SetupSettings
@@ -57,7 +130,7 @@ def multiport_sim(array, top_padding, bottom_padding, phantom_name: str = "",
 
         # Add EdgeSensorSettings
         edge_sensor_settings = emfdtd.EdgeSensorSettings()
-        edge_sensor_settings.Name = f"Edge Sensor - {antenna.name}"
+        edge_sensor_settings.Name = EDGE_SENSOR_PREFIX + antenna.name
         simulation.Add(edge_sensor_settings, antenna.source)
 
         # Add ManualGridSettings for antenna
@@ -71,11 +144,11 @@ def multiport_sim(array, top_padding, bottom_padding, phantom_name: str = "",
 
     # Add phantom settings
     if phantom_name:
-        phantom = model.AllEntities()[phantom_name]
+        phantom = utils.ENTITY_INDEX.first(phantom_name)
         # Add scan object MaterialSettings
         phantom_material_settings = emfdtd.MaterialSettings()
-        phantom_material_settings.ElectricProps.Conductivity = 0.552035, Unit("S/m")
-        phantom_material_settings.ElectricProps.RelativePermittivity = 51.954693
+        phantom_material_settings.ElectricProps.Conductivity = PHANTOM_CONDUCTIVITY, Unit("S/m")
+        phantom_material_settings.ElectricProps.RelativePermittivity = PHANTOM_PERMITTIVITY
         phantom_material_settings.Name = "Phantom"
 
         simulation.Add(phantom_material_settings, [phantom])
@@ -96,7 +169,7 @@ def multiport_sim(array, top_padding, bottom_padding, phantom_name: str = "",
         # BOX_material_settings.ElectricProps.RelativePermittivity = 1
         # BOX_material_settings.Name = "Box"
         # simulation.Add(BOX_material_settings, [BOX])
-        box = model.AllEntities()[bounding_box]
+        box = utils.ENTITY_INDEX.first(bounding_box)
 
         BOX_grid_settings = simulation.AddManualGridSettings([box])
         BOX_grid_settings.Name = "Box Grid"
@@ -124,6 +197,10 @@ def multiport_sim(array, top_padding, bottom_padding, phantom_name: str = "",
     # Add the simulation to the UI
     document.AllSimulations.Add(simulation)
 
+    if cache is not None:
+        cache.register_pending(simulation.Name, key, parameters)
+    return key
+
 
 def extract_multiport(simulation_name: str, normalized_power: int = 0):
     # Add an EmMultiPortSimulationExtractor
@@ -135,6 +212,7 @@ def extract_multiport(simulation_name: str, normalized_power: int = 0):
     em_multi_port_simulation_combiner = analysis.extractors.EmMultiPortSimulationCombiner(inputs=inputs)
 
     phases = np.linspace(0, 360, len(inputs), endpoint=False)
+    # the combiner takes the power of every channel in W
     for i, channel in enumerate(em_multi_port_simulation_combiner.GetChannelWeights()):
         power = normalized_power/len(inputs) if normalized_power else 0
         em_multi_port_simulation_combiner.SetChannelWeight(channel, power, phases[i])
@@ -145,12 +223,10 @@ def extract_multiport(simulation_name: str, normalized_power: int = 0):
     document.AllAlgorithms.Add(em_multi_port_simulation_combiner)
 
 
-def extract_singleports(simulation_name: str, relative_path: str):
+def extract_singleports(simulation_name: str, relative_path: str, cache=None, extra_files: list = None):
+    # extra_files, e.g. the S-matrix of export_s_matrix, are cached together with the exports
     # Prepare new path for exports
-    path = document.FilePath
-    path = path.split('\\')[:-1]
-    path = "\\".join(path)
-    newpath = path + '\\' + relative_path
+    newpath = export_path(relative_path)
     print("Export path: " + newpath)
     if not os.path.exists(newpath):
         os.makedirs(newpath)
@@ -159,6 +235,7 @@ def extract_singleports(simulation_name: str, relative_path: str):
     simulation = document.AllSimulations[simulation_name]
     em_multiport_simulation_extractor = simulation.Results()
     sensors = [s for s in em_multiport_simulation_extractor]
+    exported_files = []
 
     for i, s in enumerate(sensors):
         em_sensor = s["Bounding Box"]
@@ -181,21 +258,200 @@ def extract_singleports(simulation_name: str, relative_path: str):
         exporter.Update(overwrite=True)
         document.AllAlgorithms.Add(viewer)
         document.AllAlgorithms.Add(mask)
+        exported_files.append(exporter.FileName)
+
+    # Store the exports under the cache key registered by multiport_sim
+    pending = cache.pending(simulation_name) if cache is not None else None
+    if pending is not None:
+        cache.store(pending["key"], exported_files + list(extra_files or []), pending["parameters"])
+        print(f"Cached results {pending['key'][:12]}")
+
+
+def _b1_plus_output(sensor):
+    # B1 output of a port's bounding box sensor, normalised to its conducted power
+    em_sensor = sensor["Bounding Box"]
+    em_sensor.Normalization.Normalize = True
+    em_sensor.Normalization.AvailableReferences = u"Conducted Power(f)"
+    return em_sensor.Outputs["B1(x,y,z,f0)"]
+
+
+def _b1_plus_data(output) -> tuple:
+    # axis edges and the column-major B1+ component of an updated B1 output
+    output.Update()
+    field_data = output.Data
+    grid = field_data.Grid
+    axes = [np.asarray(grid.XAxis), np.asarray(grid.YAxis), np.asarray(grid.ZAxis)]
+    # B1+ component, exported as Snapshot0(:, 1) by the MatlabExporter
+    b1_plus = np.asarray(field_data.Field(0))[:, 0].astype(np.complex64)
+    return axes, b1_plus
+
+
+def export_singleports(simulation_name: str, relative_path: str, file_name: str = "b1_fields.h5",
+                       overwrite: bool = False, cache=None, extra_files: list = None) -> None:
+    """
+    Batch export of the B1+ field of every port into a single HDF5 container.
+
+    The tissue mask is computed once with a FieldMaskingFilter on the first port and applied to the
+    other ports directly. The container holds a (channel, x, y, z) complex64 dataset, chunked and
+    compressed per z-slice, with the axis midpoints alongside. The first port is always read to
+    determine the grid: when the port count, shape or axes of the container differ, it is rebuilt.
+    Its field is also hashed into a solve stamp stored with every exported port, so a port is only
+    skipped when it was exported for the same simulation from the same solve; re-solving under
+    the same name, e.g. with another simulation time, phantom scale or materials, exports every
+    port again. overwrite exports every port regardless. No algorithms or viewers are added to the
+    document.
+
+    :param extra_files: files cached together with the container, e.g. the S-matrix of export_s_matrix.
+    """
+    import h5py
+
+    newpath = export_path(relative_path)
+    if not os.path.exists(newpath):
+        os.makedirs(newpath)
+    container_path = newpath + '\\' + file_name
+    print("Export file: " + container_path)
+
+    simulation = document.AllSimulations[simulation_name]
+    sensors = [s for s in simulation.Results()]
+
+    mask = analysis.core.FieldMaskingFilter(inputs=[_b1_plus_output(sensors[0])])
+    mask.SetAllMaterials(False)
+    mask.SetEntities(get_duke_materials())
+    mask.UpdateAttributes()
+    axes, first_b1_plus = _b1_plus_data(mask.Outputs["B1(x,y,z,f0)"])
+    tissue = ~np.isnan(first_b1_plus)
+    stamp = hashlib.sha256(first_b1_plus.tobytes()).hexdigest()
+    shape = tuple(len(axis) - 1 for axis in axes)
+    midpoints = [(axis[:-1] + axis[1:]) / 2 for axis in axes]
+
+    with h5py.File(container_path, "a") as container:
+        current = ("b1_plus" in container and container["b1_plus"].shape == (len(sensors),) + shape
+                   and all(name in container and container[name].shape == midpoint.shape
+                           and np.allclose(container[name][()], midpoint)
+                           for name, midpoint in zip(("x", "y", "z"), midpoints)))
+        if not current:
+            for name in ("b1_plus", "x", "y", "z", "sources", "stamps", "written"):
+                if name in container:
+                    del container[name]
+            container.create_dataset("b1_plus", shape=(len(sensors),) + shape, dtype=np.complex64,
+                                     chunks=(1, shape[0], shape[1], 1), compression="gzip",
+                                     compression_opts=4, shuffle=True)
+            for name, midpoint in zip(("x", "y", "z"), midpoints):
+                container.create_dataset(name, data=midpoint)
+            container.create_dataset("sources", data=np.array([b""] * len(sensors), dtype="S256"))
+            container.create_dataset("written", data=np.zeros(len(sensors), dtype=bool))
+        if "stamps" not in container:
+            container.create_dataset("stamps", data=np.array([b""] * len(sensors), dtype="S64"))
+
+        for i, s in enumerate(sensors):
+            source = f"{simulation_name}/{s.Name}"
+            if (not overwrite and container["written"][i] and container["sources"][i].decode() == source
+                    and container["stamps"][i].decode() == stamp):
+                print(f"Skipped: port {i} is current")
+                continue
+
+            if i == 0:
+                b1_plus = first_b1_plus
+            else:
+                b1_plus = _b1_plus_data(_b1_plus_output(s))[1]
+                b1_plus[~tissue] = np.nan
+
+            container["b1_plus"][i] = b1_plus.reshape(shape, order="F")
+            container["sources"][i] = source.encode()
+            container["stamps"][i] = stamp.encode()
+            container["written"][i] = True
+            print(f"Exported: port {i}")
+
+    pending = cache.pending(simulation_name) if cache is not None else None
+    if pending is not None:
+        cache.store(pending["key"], [container_path] + list(extra_files or []), pending["parameters"])
+        print(f"Cached results {pending['key'][:12]}")
+
+
+def _sensor_value(output, frequency: int) -> complex:
+    # value of a frequency domain edge sensor output at the sample nearest to frequency in MHz
+    output.Update()
+    frequencies = np.asarray(output.Data.Axis)
+    values = np.ravel(output.Data.GetComponent(0))
+    return complex(values[np.argmin(np.abs(frequencies - frequency * 1e6))])
+
+
+def _port_sensor(port_name: str, sensor_names: list) -> str:
+    # edge sensor of the antenna a port result belongs to, both are named after the antenna
+    matches = [name for name in sensor_names if port_name.endswith(name[len(EDGE_SENSOR_PREFIX):])]
+    if not matches:
+        raise ValueError(f"No edge sensor matches port '{port_name}', sensors: {sensor_names}")
+    # the longest antenna name, so "Antenna 1" does not claim the port of "Dipole Antenna 1"
+    return max(matches, key=len)
+
+
+def export_s_matrix(simulation_name: str, relative_path: str, frequency: int = 298,
+                    file_name: str = S_MATRIX_FILE, reference_impedance: float = REFERENCE_IMPEDANCE) -> np.ndarray:
+    """
+    Exports the N x N scattering matrix of the array from the edge sensors of multiport_sim.
+
+    Every port simulation excites one port while the others are terminated by their internal
+    resistance. The voltage and current of every edge sensor give the power waves
+    a = (V + Z0 I) / (2 sqrt(2 Z0)) incident on and b = (V - Z0 I) / (2 sqrt(2 Z0)) leaving the
+    port, and S = B A^-1 over the N excitations, so the passive ports need not be matched. The
+    rows and columns follow the port results of the simulation, the order of the exported field
+    channels, and every port is matched to the edge sensor of its antenna by name. The port and
+    sensor names are saved with the matrix so coupling.check_ports can verify the order. A
+    previously exported matrix is removed first, so a failed export leaves no stale one behind.
+
+    :return: the S-matrix, S[j, i] is the wave leaving port j per unit wave incident on port i.
+    """
+    newpath = export_path(relative_path)
+    if not os.path.exists(newpath):
+        os.makedirs(newpath)
+    s_matrix_path = newpath + '\\' + file_name
+    if os.path.exists(s_matrix_path):
+        os.remove(s_matrix_path)
+
+    simulation = document.AllSimulations[simulation_name]
+    ports = [s for s in simulation.Results()]
+    edge_sensors = [settings.Name for settings in simulation.AllSettings
+                    if isinstance(settings, emfdtd.EdgeSensorSettings)]
+    sensor_names = [_port_sensor(port.Name, edge_sensors) for port in ports]
+    if len(set(sensor_names)) != len(sensor_names):
+        raise ValueError(f"Ports do not match distinct edge sensors: {sensor_names}")
+
+    incident = np.zeros((len(ports), len(ports)), dtype=complex)
+    reflected = np.zeros((len(ports), len(ports)), dtype=complex)
+    for i, port in enumerate(ports):
+        for j, sensor_name in enumerate(sensor_names):
+            voltage = _sensor_value(port[sensor_name].Outputs[VOLTAGE_OUTPUT], frequency)
+            current = _sensor_value(port[sensor_name].Outputs[CURRENT_OUTPUT], frequency)
+            incident[j, i] = (voltage + reference_impedance * current) / (2 * np.sqrt(2 * reference_impedance))
+            reflected[j, i] = (voltage - reference_impedance * current) / (2 * np.sqrt(2 * reference_impedance))
+
+    s_matrix = reflected @ np.linalg.inv(incident)
+    np.savez(s_matrix_path, s_matrix=s_matrix, frequency=frequency * 1e6,
+             ports=np.array([port.Name for port in ports]), sensors=np.array(sensor_names))
+    print("Exported: S-matrix, |S_ii| (dB) " + " ".join(f"{20 * np.log10(abs(s)):.1f}" for s in np.diag(s_matrix)))
+    return s_matrix
 
 
 def get_duke_materials():
-    entities = model.AllEntities()
-    materials = [m for m in entities if m.ReadOnly is True]
-    return materials
+    return utils.ENTITY_INDEX.read_only()
+
 
+def set_phases(combiner_name: str, phases: list, amplitudes: list = None):
+    """
+    Sets the channel weights of a multiport combiner.
 
-def set_phases(combiner_name: str, phases: list):
+    :param phases: phases in degrees.
+    :param amplitudes: amplitudes in sqrt(W), as from shimming.channel_settings, 1 (1 W) by
+        default. The combiner takes the power of every channel in W, as in extract_multiport, so
+        they are squared.
+    """
     for alg in document.AllAlgorithms:
         if alg.Name == combiner_name:
             combiner = alg
 
             for i, channel in enumerate(combiner.GetChannelWeights()):
-                combiner.SetChannelWeight(channel, 1, phases[i])
+                amplitude = amplitudes[i] if amplitudes is not None else 1
+                combiner.SetChannelWeight(channel, amplitude**2, phases[i])
 
             combiner.UpdateAttributes()
             combiner.Update()
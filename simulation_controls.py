@@ -1,11 +1,13 @@
 import simulate
 import utils
+import result_cache
+import grid_estimator
 import setup_controls_duke
 import imp
 
 
 # force module updates
-CUSTOM_MODULES = [simulate, utils, setup_controls_duke]
+CUSTOM_MODULES = [simulate, utils, result_cache, grid_estimator, setup_controls_duke]
 for module in CUSTOM_MODULES:
     imp.reload(module)
 
@@ -13,6 +15,7 @@ for module in CUSTOM_MODULES:
 PHANTOM_NAME = ""  # Duke is not incorperated in sim function, empty string is the same as omitting phantom name
 USE_CUDA = True
 BOUNDING_BOX = "Bounding Box"
+USE_CACHE = True  # reuse the exports of an identical, previously solved simulation
 
 # Grid padding settings set-up
 top_padding = 200
@@ -29,6 +32,12 @@ GRID_SETTINGS = {"antenna_grid_max_step": 1.0,
 
 # if-statement to only perform simulation when this file is run directly
 if __name__ == "__main__":
+    # warn before building when the estimated grid exceeds the GPU memory or the time budget
+    estimate = grid_estimator.estimate_grid(grid_estimator.Layout.from_array(frac_dipole_array),
+                                            top_padding, bottom_padding, **GRID_SETTINGS)
+    print(estimate.report())
+    grid_estimator.check_budget(estimate)
+
     # run multiport simulation
     simulate.multiport_sim(array=frac_dipole_array,
                            phantom_name=PHANTOM_NAME,
@@ -36,4 +45,6 @@ if __name__ == "__main__":
                            cuda_kernel=USE_CUDA,
                            top_padding=top_padding,
                            bottom_padding=bottom_padding,
+                           phantom_scale=setup_controls_duke.PHANTOM_SCALE_FACTOR,
+                           cache=simulate.open_result_cache() if USE_CACHE else None,
                            **GRID_SETTINGS)
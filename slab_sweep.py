@@ -0,0 +1,113 @@
+"""
+Phase shimming of every axial slab in one call, instead of choosing center_slice by hand.
+
+The channel moments of every single slice are computed once and summed cumulatively along Z, so
+the moments of any slab center_slice +- half_width are a difference of two cumulative sums. Each
+slab is optimised on these moments, warm-started from the optimum of the previous slab, and
+optionally refined on the CoV of |B1+| over the slab voxels.
+"""
+import csv
+import numpy as np
+
+import shimming
+from channel_moments import ChannelMoments, moment_sums, power_cov_and_gradient
+from masked_field import MaskedField
+
+
+STORE_PATH = "FIELD_STORE"
+SWEEP_FILE = "slab_sweep.csv"
+MIN_VOXELS = 100  # slabs with fewer tissue voxels are skipped
+
+
+def cumulative_slice_moments(fields: MaskedField) -> tuple:
+    """
+    Cumulative per-slice channel moment sums along Z.
+
+    :return: tuple of the cumulative voxel counts, covariance sums and fourth moment sums, each with
+        n_z + 1 entries such that the slab [a, b) is entry b minus entry a.
+    """
+    n_z = fields.grid_shape[2]
+    slice_starts = fields.slice_starts()
+
+    n_channels = fields.n_channels
+    counts = np.zeros(n_z + 1, dtype=np.int64)
+    covariance_sums = np.zeros((n_z + 1, n_channels, n_channels), dtype=np.complex128)
+    fourth_moment_sums = np.zeros((n_z + 1, n_channels**2, n_channels**2), dtype=np.complex128)
+    for z in range(n_z):
+        start, stop = slice_starts[z], slice_starts[z + 1]
+        counts[z + 1] = stop - start
+        if stop > start:
+            covariance_sums[z + 1], fourth_moment_sums[z + 1] = moment_sums(fields.values[start:stop])
+
+    return np.cumsum(counts), np.cumsum(covariance_sums, axis=0), np.cumsum(fourth_moment_sums, axis=0)
+
+
+def sweep_slabs(fields: MaskedField, half_width: int = shimming.HALF_WIDTH, start_phases=shimming.START_PHASES,
+                step: int = 1, refine: bool = True, min_voxels: int = MIN_VOXELS) -> list:
+    """
+    Optimises the phases for every slab position along Z.
+
+    :param fields: masked field of (at least) the range of slabs to sweep.
+    :param half_width: slices on either side of each slab center.
+    :param start_phases: starting phases of the first slab, later slabs start from their neighbour.
+    :param step: distance in slices between consecutive slab centers.
+    :param refine: also optimise the CoV of |B1+| on the slab voxels, starting from the power optimum.
+    :return: list of dicts with the center slice, voxel count, phases, CoV and mean |B1+| per slab.
+    """
+    counts, covariance_sums, fourth_moment_sums = cumulative_slice_moments(fields)
+    n_z = fields.grid_shape[2]
+    slice_starts = fields.slice_starts()
+
+    phases = np.asarray(start_phases, dtype=float)
+    results = []
+    for center_slice in range(half_width, n_z - half_width, step):
+        low, high = center_slice - half_width, center_slice + half_width + 1
+        n_voxels = counts[high] - counts[low]
+        if n_voxels < min_voxels:
+            continue
+
+        moments = ChannelMoments.from_sums(covariance_sums[high] - covariance_sums[low],
+                                           fourth_moment_sums[high] - fourth_moment_sums[low], n_voxels)
+        phases, _ = shimming.optimise_phases(moments, phases, objective=power_cov_and_gradient)
+
+        slab = fields.values[slice_starts[low]:slice_starts[high]]
+        if refine:
+            phases, score = shimming.optimise_phases(slab, phases)
+        else:
+            score = shimming.phases_scorer(phases, slab)
+        phases = shimming.wrap_phases(phases)
+
+        results.append({"center_slice": center_slice,
+                        "n_voxels": int(n_voxels),
+                        "phases": phases,
+                        "cov": score,
+                        "mean_strength": shimming.mean_strength(slab, phases)})
+        print(f"Slab {center_slice}: COV {score:f}")
+
+    return results
+
+
+def save_sweep(results: list, file_name: str = SWEEP_FILE) -> None:
+    n_channels = len(results[0]["phases"]) if results else 0
+    with open(file_name, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["center_slice", "n_voxels", "cov", "mean_strength"]
+                        + [f"phase_{i}" for i in range(n_channels)])
+        for row in results:
+            writer.writerow([row["center_slice"], row["n_voxels"], row["cov"], row["mean_strength"]]
+                            + list(row["phases"]))
+
+
+# if-statement to only perform the sweep when this file is run directly
+if __name__ == "__main__":
+    import field_store
+
+    store = field_store.open_store(shimming.FILES, STORE_PATH)
+    sweep = sweep_slabs(MaskedField.from_store(store))
+    save_sweep(sweep)
+
+    best = min(sweep, key=lambda row: row["cov"])
+    print(f"Best slab center: {best['center_slice']}")
+    print("Phases: " + " ".join(f"{p:f}" for p in best["phases"]))
+    print(f"COV: {best['cov']:f}")
+    print(f"Mean (Tesla): {best['mean_strength']:e}")
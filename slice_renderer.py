@@ -0,0 +1,210 @@
+"""
+B1+ maps of single planes, read lazily from the field store.
+
+Python counterpart of Plot_S4L_2D.m, which loads and sums every export and builds full 3-D
+meshgrid arrays to draw one plane. SliceRenderer reads only the voxels of the requested plane
+from a field_store.FieldStore and combines the channels for the requested phases. Axis-aligned
+planes are read directly; oblique planes are sampled with trilinear interpolation, whose corner
+voxels and weights are cached per plane so rendering it again for other phases reads just those
+voxels. Planes are written as PNG (requires matplotlib) or as .npz arrays.
+"""
+from collections import OrderedDict
+import os
+import numpy as np
+
+from field_combiner import channel_weights
+from shimming import match_precision
+
+
+CACHE_SIZE = 16  # oblique planes whose interpolation weights are kept
+AXIS_NAMES = "XYZ"
+
+
+def _fractional_index(axis: np.ndarray, positions: np.ndarray) -> tuple:
+    # lower neighbour and interpolation fraction of every position on ascending axis midpoints
+    lower = np.clip(np.searchsorted(axis, positions, "right") - 1, 0, axis.size - 2)
+    fraction = (positions - axis[lower]) / (axis[lower + 1] - axis[lower])
+    inside = (positions >= axis[0]) & (positions <= axis[-1])
+    return lower, fraction, inside
+
+
+class SliceRenderer:
+    def __init__(self, store, cache_size: int = CACHE_SIZE):
+        """
+        :param store: field_store.FieldStore (or ContainerStore) of the per-port exports.
+        :param cache_size: number of oblique planes whose interpolation weights are cached.
+        """
+        self.store = store
+        self.cache_size = cache_size
+        self._weights = OrderedDict()
+
+    def axis_plane(self, phases, axis: int, index: int, amplitudes=None) -> tuple:
+        """
+        |B1+| in the plane at the given index along axis 0 (x), 1 (y) or 2 (z).
+
+        :return: tuple of the (u, v) image and the axis midpoints of u and v.
+        """
+        plane = self.store.slice(axis, index)
+        weights = match_precision(channel_weights(phases, amplitudes), plane)
+        image = np.abs(np.tensordot(weights, plane, axes=1))
+        u, v = (self.store.axes[i] for i in range(3) if i != axis)
+        return image, (u, v)
+
+    def axis_plane_at(self, phases, axis: int, position: float, amplitudes=None) -> tuple:
+        """
+        As axis_plane, for the plane nearest to a position in axis units.
+        """
+        midpoints = self.store.axes[axis]
+        index = int(np.clip(np.searchsorted(midpoints, position), 1, midpoints.size - 1))
+        index -= position - midpoints[index - 1] < midpoints[index] - position
+        return self.axis_plane(phases, axis, index, amplitudes)
+
+    def interpolation_weights(self, origin, u, v, extent: tuple, spacing: float) -> tuple:
+        """
+        Trilinear interpolation weights of the oblique plane origin + s * u + t * v.
+
+        :param u: in-plane direction of the image rows, normalised internally.
+        :param v: in-plane direction of the image columns, made orthogonal to u.
+        :param extent: (s_min, s_max, t_min, t_max) of the plane in axis units.
+        :param spacing: pixel size in axis units.
+        :return: tuple of the unique corner voxel indices, the (pixels x 8) positions of every corner
+            in those, the (pixels x 8) weights (NaN outside the grid) and the s and t coordinates.
+        """
+        origin = np.asarray(origin, dtype=float)
+        u = np.asarray(u, dtype=float)
+        u = u / np.linalg.norm(u)
+        v = np.asarray(v, dtype=float)
+        v = v - (v @ u) * u
+        v = v / np.linalg.norm(v)
+        key = (origin.tobytes(), u.tobytes(), v.tobytes(), tuple(extent), spacing)
+        if key in self._weights:
+            self._weights.move_to_end(key)
+            return self._weights[key]
+
+        s = np.arange(extent[0], extent[1] + spacing / 2, spacing)
+        t = np.arange(extent[2], extent[3] + spacing / 2, spacing)
+        points = origin + s[:, None, None] * u + t[None, :, None] * v
+
+        n_x, n_y, _ = self.store.shape
+        linear = np.zeros(points.shape[:2] + (8,), dtype=np.int64)
+        weights = np.ones(points.shape[:2] + (8,))
+        inside = np.ones(points.shape[:2], dtype=bool)
+        strides = (1, n_x, n_x * n_y)
+        for dimension in range(3):
+            lower, fraction, inside_axis = _fractional_index(self.store.axes[dimension], points[..., dimension])
+            inside &= inside_axis
+            for corner in range(8):
+                upper = (corner >> dimension) & 1
+                linear[..., corner] += (lower + upper) * strides[dimension]
+                weights[..., corner] *= fraction if upper else 1 - fraction
+        weights[~inside] = np.nan
+
+        voxels, positions = np.unique(linear, return_inverse=True)
+        result = (voxels, positions.reshape(linear.shape), weights, (s, t))
+        self._weights[key] = result
+        if len(self._weights) > self.cache_size:
+            self._weights.popitem(last=False)
+        return result
+
+    def _gather(self, voxels: np.ndarray) -> np.ndarray:
+        # (channel, voxels) values of the given column-major linear indices
+        if isinstance(self.store.fields, np.ndarray):
+            return np.asarray(self.store.fields.reshape(self.store.n_channels, -1, order="F")[:, voxels])
+        # stores without fancy indexing are read as the bounding block of the voxels
+        x, y, z = np.unravel_index(voxels, self.store.shape, order="F")
+        block = self.store.roi(slice(x.min(), x.max() + 1), slice(y.min(), y.max() + 1),
+                               slice(z.min(), z.max() + 1))
+        return block[:, x - x.min(), y - y.min(), z - z.min()]
+
+    def oblique_plane(self, phases, origin, u, v, extent: tuple, spacing: float, amplitudes=None) -> tuple:
+        """
+        |B1+| in an arbitrary plane, see interpolation_weights for the plane parameters. The complex
+        field is interpolated before taking the magnitude, pixels outside the grid are NaN.
+
+        :return: tuple of the (s, t) image and the s and t coordinates.
+        """
+        voxels, positions, weights, coordinates = self.interpolation_weights(origin, u, v, extent, spacing)
+        values = self._gather(voxels)
+        combined = match_precision(channel_weights(phases, amplitudes), values) @ values
+        image = np.abs(np.sum(combined[positions] * weights, axis=-1))
+        return image, coordinates
+
+    def clear_cache(self) -> None:
+        self._weights.clear()
+
+
+def save_array(image: np.ndarray, coordinates: tuple, file_name: str) -> None:
+    np.savez(file_name, image=image, u=coordinates[0], v=coordinates[1])
+
+
+def save_png(image: np.ndarray, coordinates: tuple, file_name: str, title: str = "", labels=("u", "v"),
+             clim: tuple = None) -> None:
+    """
+    Writes the plane with the jet colormap and equal axes, as Plot_S4L_2D.m draws it.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figure, ax = plt.subplots()
+    mesh = ax.pcolormesh(coordinates[0], coordinates[1], image.T, cmap="jet", shading="gouraud")
+    if clim is not None:
+        mesh.set_clim(*clim)
+    figure.colorbar(mesh, ax=ax)
+    ax.set_aspect("equal")
+    ax.set_xlabel(labels[0])
+    ax.set_ylabel(labels[1])
+    ax.set_title(title)
+    figure.savefig(file_name, dpi=150)
+    plt.close(figure)
+
+
+def render_gallery(renderer: SliceRenderer, phases, axis: int, indices, output_dir: str,
+                   file_format: str = "png", amplitudes=None) -> list:
+    """
+    Renders the planes at the given indices along one axis with a shared color scale. The planes
+    are rendered once to find the maximum over all of them and again when writing, so only one is
+    held in memory. Planes without any tissue are skipped.
+
+    :param file_format: "png" or "npz".
+    :return: paths of the written files.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    labels = tuple(AXIS_NAMES[i] for i in range(3) if i != axis)
+    peak = 0.0
+    tissue_indices = []
+    for index in indices:
+        image = renderer.axis_plane(phases, axis, index, amplitudes)[0]
+        if not np.isnan(image).all():
+            tissue_indices.append(index)
+            peak = max(peak, float(np.nanmax(image)))
+    clim = (0, peak if peak > 0 else 1)
+
+    files = []
+    for index in tissue_indices:
+        image, coordinates = renderer.axis_plane(phases, axis, index, amplitudes)
+        file_name = os.path.join(output_dir, f"{AXIS_NAMES[axis]}_{index}.{file_format}")
+        if file_format == "png":
+            save_png(image, coordinates, file_name, f"{''.join(labels)}-section {index}", labels, clim)
+        else:
+            save_array(image, coordinates, file_name)
+        files.append(file_name)
+    return files
+
+
+# if-statement to only render the gallery when this file is run directly
+if __name__ == "__main__":
+    import field_store
+    import shimming
+
+    STORE_PATH = "FIELD_STORE"
+    PHASES = [-85, -124, -185, 134, 95, 56, -5, -46]
+    GALLERY_DIR = "GALLERY"
+    N_SLICES = 50
+
+    store = field_store.open_store(shimming.FILES, STORE_PATH)
+    renderer = SliceRenderer(store)
+    indices = np.linspace(0, store.shape[2] - 1, N_SLICES).astype(int)
+    files = render_gallery(renderer, PHASES, axis=2, indices=indices, output_dir=GALLERY_DIR)
+    print(f"Rendered {len(files)} slices to {GALLERY_DIR}")
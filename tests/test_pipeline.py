@@ -0,0 +1,67 @@
+import asyncio
+
+from pipeline import FakeClock, FakeSolver, failed_simulations, run_pipeline
+
+
+SOLVE_TIME = 2.0
+EXTRACT_TIME = 1.0
+POLL_INTERVAL = 0.1
+
+
+def run(jobs, clock, solver, extract, build=lambda job: job, **options):
+    return asyncio.run(run_pipeline(jobs, build, solver, extract, poll_interval=POLL_INTERVAL,
+                                    clock=clock, sleep=clock.sleep, **options))
+
+
+def test_pipeline_overlaps_solve_and_extract():
+    clock = FakeClock()
+    jobs = [f"variant {i}" for i in range(4)]
+    timings = run(jobs, clock, FakeSolver(SOLVE_TIME, clock=clock), extract=lambda name: clock.advance(EXTRACT_TIME))
+    assert sorted(timings) == jobs
+    assert all({"build", "solve", "wait", "extract"} <= set(stages) for stages in timings.values())
+    # sequential would take 4 * (solve + extract), pipelined the solves plus the last extraction
+    assert clock() < len(jobs) * SOLVE_TIME + EXTRACT_TIME + len(jobs) * POLL_INTERVAL
+
+
+def test_pipeline_bounds_solved_ahead():
+    clock = FakeClock()
+    queue_size = 1
+    jobs = [f"variant {i}" for i in range(8)]
+    timings = run(jobs, clock, FakeSolver(POLL_INTERVAL, clock=clock), extract=lambda name: clock.advance(EXTRACT_TIME),
+                  queue_size=queue_size, max_submitted=len(jobs))
+    # all simulations finish at once, but a finished one is only handed over when the queue has room,
+    # so none waits longer than the queued ones and the one being extracted, instead of up to 7
+    assert len(timings) == len(jobs)
+    assert max(stages["wait"] for stages in timings.values()) <= (queue_size + 1) * EXTRACT_TIME
+
+
+def test_pipeline_gives_up_on_unfinished_simulations():
+    clock = FakeClock()
+    jobs = ["ok 0", "broken", "ok 1"]
+    extracted = []
+    timings = run(jobs, clock, FakeSolver(SOLVE_TIME, failing=["broken"], clock=clock), extract=extracted.append,
+                  solve_timeout=3 * SOLVE_TIME)
+    assert failed_simulations(timings) == ["broken"]
+    assert "timeout" in timings["broken"]
+    assert extracted == ["ok 0", "ok 1"]
+
+
+def test_pipeline_continues_after_errors():
+    clock = FakeClock()
+    jobs = ["ok 0", "build fails", "export fails", "ok 1"]
+    extracted = []
+
+    def build(job):
+        if job == "build fails":
+            raise RuntimeError("no antennas")
+        return job
+
+    def extract(name):
+        if name == "export fails":
+            raise OSError("disk full")
+        extracted.append(name)
+
+    timings = run(jobs, clock, FakeSolver(SOLVE_TIME, clock=clock), extract, build=build)
+    assert failed_simulations(timings) == ["job 1", "export fails"]
+    assert "solve" in timings["export fails"] and "extract" not in timings["export fails"]
+    assert extracted == ["ok 0", "ok 1"]
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+import field_store
+import pyramid
+from roi import Box
+
+
+def write_store(path, shape=(4, 8, 8, 120), seed=0) -> field_store.FieldStore:
+    # random complex64 fields on a grid of 1 mm voxels
+    rng = np.random.default_rng(seed)
+    fields = np.lib.format.open_memmap(os.path.join(path, field_store.FIELDS_FILE), mode="w+",
+                                       dtype=np.complex64, shape=shape, fortran_order=True)
+    fields[:] = rng.normal(size=shape) + 1j * rng.normal(size=shape)
+    fields.flush()
+    del fields
+    midpoints = [np.arange(n) + 0.5 for n in shape[1:]]
+    np.savez(os.path.join(path, field_store.AXES_FILE), x=midpoints[0], y=midpoints[1], z=midpoints[2],
+             files=np.array(["synthetic"]))
+    return field_store.FieldStore(str(path))
+
+
+def test_thin_roi_skips_empty_levels(tmp_path):
+    store = write_store(tmp_path)
+    levels = pyramid.open_pyramid(store)
+    fields = pyramid.level_fields(levels, Box.from_slices(store.axes, 61, 1))
+    assert fields[1].n_voxels == 8 * 8 * 3
+    assert fields[8].n_voxels == 0
+
+    phases, report = pyramid.coarse_to_fine_optimise(fields, np.zeros(store.n_channels), min_voxels=1)
+    assert 8 not in [level["factor"] for level in report]
+    assert report[-1]["factor"] == 1
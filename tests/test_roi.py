@@ -0,0 +1,29 @@
+import numpy as np
+
+from masked_field import MaskedField
+from roi import Box
+
+
+def masked_field(grid_shape=(12, 10, 30), seed=0) -> MaskedField:
+    # random fields with a tissue mask that leaves gaps in every slice
+    rng = np.random.default_rng(seed)
+    n_voxels = int(np.prod(grid_shape))
+    tissue = np.flatnonzero(rng.random(n_voxels) < 0.6)
+    values = rng.normal(size=(tissue.size, 4)) + 1j * rng.normal(size=(tissue.size, 4))
+    axes = [np.arange(n, dtype=float) * 2.0 for n in grid_shape]
+    return MaskedField(values, tissue, grid_shape, axes)
+
+
+def test_slab_box_selects_slab():
+    fields = masked_field()
+    selected = Box.from_slices(fields.axes, 15, 3).select(fields)
+    slab = fields.slab(12, 19)
+    np.testing.assert_array_equal(selected.indices, slab.indices)
+    np.testing.assert_array_equal(selected.values, slab.values)
+
+
+def test_select_indices_strictly_increasing():
+    fields = masked_field()
+    selected = Box([3, 2, 10], [15, 12, 40]).select(fields)
+    assert selected.n_voxels > 0
+    assert np.all(np.diff(selected.indices) > 0)
@@ -3,22 +3,87 @@ import s4l_v1.model as model
 from s4l_v1 import Scaling, Rotation, Translation
 from s4l_v1.model import Vec3
 
+from collections import defaultdict
 import numpy as np
 
 
+class EntityIndex:
+    """
+    Cached name -> entities index of the active model, shared by the lookups in utils and simulate.
+
+    The index is built from a single model.AllEntities() scan on first use and is invalidated by the
+    code that creates, renames or deletes entities. Entities can also change in the GUI between
+    script runs, so before every lookup the entity count is compared with the one the index was
+    built from, and an entity whose name no longer matches triggers a single rebuild. One-off
+    lookups of a single name use model.AllEntities()[name] directly instead.
+    """
+    def __init__(self):
+        self._entities = None
+        self._read_only = None
+        self._count = None
+
+    def invalidate(self) -> None:
+        self._entities = None
+        self._read_only = None
+        self._count = None
+
+    def _build(self) -> None:
+        entities = model.AllEntities()
+        self._entities = defaultdict(list)
+        self._read_only = []
+        for ent in entities:
+            self._entities[ent.Name].append(ent)
+            if ent.ReadOnly is True:
+                self._read_only.append(ent)
+        self._count = len(entities)
+
+    def _ensure_current(self) -> bool:
+        # builds the index when it is missing or the model has a different number of entities
+        # :return: whether the index was rebuilt
+        if self._entities is None or len(model.AllEntities()) != self._count:
+            self._build()
+            return True
+        return False
+
+    def get(self, name: str) -> list:
+        # all entities with the given name, in model order
+        rebuilt = self._ensure_current()
+        matches = self._entities.get(name, [])
+        if not rebuilt and (not matches or any(ent.Name != name for ent in matches)):
+            # renamed in the GUI, which leaves the entity count unchanged
+            self._build()
+            matches = self._entities.get(name, [])
+        return list(matches)
+
+    def first(self, name: str):
+        matches = self.get(name)
+        if not matches:
+            raise KeyError(name)
+        return matches[0]
+
+    def __contains__(self, name: str) -> bool:
+        return bool(self.get(name))
+
+    def read_only(self) -> list:
+        self._ensure_current()
+        return list(self._read_only)
+
+    def delete(self, names: list) -> None:
+        # single pass over the top-level entities, deleting every one with a listed name
+        names = set(names)
+        for ent in xcm.GetActiveModel().GetEntities():
+            if ent.Name in names:
+                name = ent.Name
+                ent.Delete()
+                print(f"Deleted: {name}")
+        self.invalidate()
+
+
+ENTITY_INDEX = EntityIndex()
+
+
 def clear_from_model(clear_list: list) -> None:
-    for clear_entity in clear_list:
-        exists = True
-        while exists:
-            entity_names = [ent.Name for ent in xcm.GetActiveModel().GetEntities()]
-            if clear_entity in entity_names:
-                for ent in xcm.GetActiveModel().GetEntities():
-                    if ent.Name == clear_entity:
-                        ent.Delete()
-                        print(f"Deleted: {clear_entity}")
-                        break
-            else:
-                exists = False
+    ENTITY_INDEX.delete(clear_list)
 
 
 def scale_model(model_name: str, scale_factor: float) -> None: